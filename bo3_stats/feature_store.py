@@ -0,0 +1,288 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import func
+from typing import Dict, List, Tuple, Union
+from scraper.constants import WINDOWS
+from bo3_stats.stats_over_time import STAT_COLUMN_NAMES, rolling_averages, stat_matrix
+
+
+STORE_DIR = current_directory / "feature_store"
+META_FILE = "meta.json" #windows, columns, row count and the CustomPlayerStatsGame id the store was built up to
+
+# Every file is a plain .npy, opened memory mapped so a lookup only reads the pages it touches
+PLAYER_IDS_FILE = "player_ids.npy" #(players,) sorted player ids
+OFFSETS_FILE = "offsets.npy" #(players + 1,) rows of player i are offsets[i]:offsets[i + 1]
+GAME_IDS_FILE = "game_ids.npy" #(rows,) game of each row
+BEGIN_AT_FILE = "begin_at.npy" #(rows,) game start in unix seconds, ascending within a player
+
+
+def means_file(window: Union[int, str]) -> str:
+    return f"means_{window}.npy" #(rows x stats) float64, column major so a projected stat is contiguous
+
+
+def counts_file(window: Union[int, str]) -> str:
+    return f"counts_{window}.npy" #(rows x stats) int32 non NaN games in the window
+
+
+def unix_seconds(timestamps) -> np.ndarray:
+    """
+    Converts datetimes (naive UTC, like Games.begin_at) to unix seconds.
+
+    :param timestamps: A datetime or a list of them, anything pd.to_datetime accepts.
+    :return: The unix seconds (np.ndarray of int64).
+    """
+    values = pd.to_datetime(pd.Series(np.atleast_1d(np.asarray(timestamps, dtype=object))))
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.to_numpy(dtype='datetime64[ns]').astype('datetime64[s]').astype(np.int64) #NaT becomes the minimum int64
+
+
+def load_player_games(session: Session, columns: List[str] = STAT_COLUMN_NAMES) -> pd.DataFrame:
+    """
+    Loads every CustomPlayerStatsGame row with a player and a game start in one query, ordered like the
+    moving averages (player, then begin_at, then game id).
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[str] columns: The stat columns to load.
+    :return: One row per player and game with player_id, game_id, begin_at, num_rounds and the stat columns.
+    """
+    query = (
+        session.query(
+            CustomPlayerStatsGame.player_id, CustomPlayerStatsGame.game_id, Games.begin_at, CustomPlayerStatsGame.num_rounds,
+            *[getattr(CustomPlayerStatsGame, column) for column in columns])
+        .join(Games, Games.id == CustomPlayerStatsGame.game_id)
+        .filter(CustomPlayerStatsGame.player_id != None, Games.begin_at != None)
+    )
+    games = pd.read_sql(query.statement, session.bind)
+    games['begin_at'] = unix_seconds(games['begin_at']) if len(games.index) > 0 else np.empty(0, dtype=np.int64)
+    return games.sort_values(['player_id', 'begin_at', 'game_id'], kind='mergesort').reset_index(drop=True)
+
+
+def build_feature_store(store_dir: Path = STORE_DIR, windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> int:
+    """
+    Rebuilds the feature store: the moving averages and counts of every stat, window, player and game, as of after the game.
+    The averages are the ones of CustomStatsMA, computed for all players at once from one read of CustomPlayerStatsGame.
+
+    The store is written next to store_dir and swapped in when complete, so readers never see a partial store.
+
+    :param Path store_dir: The store directory.
+    :param List[Union[int, str]] windows: The window sizes, 'inf' for all history.
+    :param List[str] columns: The stat columns.
+    :return: The number of rows written.
+    """
+    session = Session()
+    try:
+        max_stats_id = session.query(func.max(CustomPlayerStatsGame.id)).scalar()
+        games = load_player_games(session, columns)
+    finally:
+        session.close()
+
+    player_ids, starts, sizes = np.unique(games['player_id'].to_numpy(dtype=np.int64), return_index=True, return_counts=True)
+    offsets = np.concatenate([starts, [len(games.index)]]).astype(np.int64)
+    row_starts = np.repeat(starts, sizes)
+
+    store_dir = Path(store_dir)
+    building = store_dir.with_name(store_dir.name + ".building")
+    shutil.rmtree(building, ignore_errors=True)
+    building.mkdir(parents=True)
+
+    np.save(building / PLAYER_IDS_FILE, player_ids)
+    np.save(building / OFFSETS_FILE, offsets)
+    np.save(building / GAME_IDS_FILE, games['game_id'].to_numpy(dtype=np.int64))
+    np.save(building / BEGIN_AT_FILE, games['begin_at'].to_numpy(dtype=np.int64))
+
+    for window, (means, counts) in rolling_averages(stat_matrix(games, columns), windows, row_starts).items():
+        np.save(building / means_file(window), np.asfortranarray(means))
+        np.save(building / counts_file(window), np.asfortranarray(counts.astype(np.int32)))
+
+    with open(building / META_FILE, 'w') as f:
+        json.dump({
+            'windows': [str(window) for window in windows],
+            'columns': list(columns),
+            'rows': len(games.index),
+            'max_stats_id': max_stats_id,
+            'built_at': datetime.utcnow().isoformat(),
+        }, f)
+
+    old = store_dir.with_name(store_dir.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if store_dir.exists():
+        os.replace(store_dir, old)
+    os.replace(building, store_dir)
+    shutil.rmtree(old, ignore_errors=True)
+
+    return len(games.index)
+
+
+class AsOfIndex():
+    """
+    Time sorted per player index of rows: rows are grouped by player (offsets) and ordered by start time within a player,
+    so 'the latest row of these players as of time T' is one binary search over a (player, time) key for all lookups at once.
+    """
+
+    def __init__(self, player_ids: np.ndarray, offsets: np.ndarray, begin_at: np.ndarray):
+        """
+        :param np.ndarray player_ids: Sorted unique player ids.
+        :param np.ndarray offsets: (players + 1,) rows of player i are offsets[i]:offsets[i + 1].
+        :param np.ndarray begin_at: Unix seconds of every row, ascending within a player.
+        """
+        self.player_ids = np.asarray(player_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        # Monotonic key of every row: rank of the player, then seconds since the first row
+        begin_at = np.asarray(begin_at, dtype=np.int64)
+        self.first_second = int(begin_at.min()) if len(begin_at) > 0 else 0
+        self.stride = (int(begin_at.max()) - self.first_second + 2) if len(begin_at) > 0 else 2
+        ranks = np.repeat(np.arange(len(self.player_ids), dtype=np.int64), np.diff(self.offsets))
+        self.keys = ranks * self.stride + (begin_at - self.first_second)
+
+    @classmethod
+    def from_rows(cls, player_ids: np.ndarray, begin_at: np.ndarray) -> 'AsOfIndex':
+        """
+        :param np.ndarray player_ids: The player of every row, rows sorted by player then time.
+        :param np.ndarray begin_at: Unix seconds of every row.
+        """
+        unique, starts = np.unique(np.asarray(player_ids, dtype=np.int64), return_index=True)
+        return cls(unique, np.concatenate([starts, [len(player_ids)]]), begin_at)
+
+    def player_ranks(self, player_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: The position of every player in player_ids of the index and whether the player is in the index at all.
+        """
+        player_ids = np.atleast_1d(np.asarray(player_ids, dtype=np.int64))
+        ranks = np.searchsorted(self.player_ids, player_ids)
+        ranks = np.minimum(ranks, max(len(self.player_ids) - 1, 0))
+        found = (self.player_ids[ranks] == player_ids) if len(self.player_ids) > 0 else np.zeros(len(player_ids), dtype=bool)
+        return ranks, found
+
+    def rows_as_of(self, player_ids: List[int], before=None, inclusive: bool = False) -> np.ndarray:
+        """
+        Finds the latest row of each player as of a moment.
+
+        :param List[int] player_ids: The player of each lookup.
+        :param before: The moment of each lookup (one for all, or one per player), anything pd.to_datetime accepts. Default is no bound.
+        :param bool inclusive: Also count rows starting exactly at the moment. Default is rows strictly before it.
+        :return: The row of each lookup, -1 if the player has no row before the moment (np.ndarray).
+        """
+        ranks, found = self.player_ranks(player_ids)
+        if len(self.player_ids) == 0:
+            return np.full(len(ranks), -1, dtype=np.int64)
+
+        if before is None:
+            rows = self.offsets[ranks + 1] - 1
+        else:
+            seconds = np.broadcast_to(unix_seconds(before), ranks.shape)
+            query_keys = ranks * self.stride + np.clip(seconds - self.first_second, 0, self.stride - 1)
+            rows = np.searchsorted(self.keys, query_keys, side='right' if inclusive else 'left') - 1
+
+        return np.where(found & (rows >= self.offsets[ranks]), rows, -1)
+
+
+class FeatureStore():
+    """
+    Read only, memory mapped view of a store written by build_feature_store.
+
+    Rows are grouped by player and ordered by game start, see AsOfIndex.
+    """
+
+    def __init__(self, store_dir: Path = STORE_DIR):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / META_FILE) as f:
+            self.meta = json.load(f)
+
+        self.windows = self.meta['windows']
+        self.columns = self.meta['columns']
+        self.column_index = {column: index for index, column in enumerate(self.columns)}
+
+        self.game_ids = np.load(self.store_dir / GAME_IDS_FILE, mmap_mode='r')
+        self.means = {window: np.load(self.store_dir / means_file(window), mmap_mode='r') for window in self.windows}
+        self.counts = {window: np.load(self.store_dir / counts_file(window), mmap_mode='r') for window in self.windows}
+        self.index = AsOfIndex(np.load(self.store_dir / PLAYER_IDS_FILE), np.load(self.store_dir / OFFSETS_FILE), np.load(self.store_dir / BEGIN_AT_FILE))
+
+    def rows_as_of(self, player_ids: List[int], before=None, inclusive: bool = False) -> np.ndarray:
+        """
+        Finds the latest row of each player as of a moment, see AsOfIndex.rows_as_of.
+        """
+        return self.index.rows_as_of(player_ids, before, inclusive)
+
+    def lookup(self, rows: np.ndarray, window: Union[int, str], columns: List[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads averages and counts of a projection of the stats.
+
+        :param np.ndarray rows: Rows, see rows_as_of (-1 for none).
+        :param Union[int, str] window: The window.
+        :param List[str] columns: The stats to read. Default is all.
+        :return: (averages, counts), both (rows x columns). NaN and 0 for missing rows.
+        """
+        columns = self.columns if columns is None else columns
+        indexes = [self.column_index[column] for column in columns]
+        rows = np.asarray(rows, dtype=np.int64)
+        present = rows >= 0
+
+        means = np.full((len(rows), len(indexes)), np.nan)
+        counts = np.zeros((len(rows), len(indexes)), dtype=np.int64)
+        if present.any():
+            stored_means = self.means[str(window)]
+            stored_counts = self.counts[str(window)]
+            for position, index in enumerate(indexes):
+                means[present, position] = stored_means[:, index][rows[present]]
+                counts[present, position] = stored_counts[:, index][rows[present]]
+        return means, counts
+
+    def as_of(self, player_ids: List[int], before, window: Union[int, str], columns: List[str] = None, inclusive: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The moving averages of players as they were at a moment, eg before a game for a training row.
+
+        :param List[int] player_ids: The player of each lookup.
+        :param before: The moment of each lookup, see rows_as_of.
+        :param Union[int, str] window: The window.
+        :param List[str] columns: The stats to read. Default is all.
+        :param bool inclusive: Also count games starting exactly at the moment.
+        :return: (averages, counts), both (players x columns). NaN and 0 for players without a game before the moment.
+        """
+        return self.lookup(self.rows_as_of(player_ids, before, inclusive), window, columns)
+
+    def is_current(self, session: Session) -> bool:
+        """
+        Whether no CustomPlayerStatsGame row was added since the store was built.
+
+        :param Session session: A SQLAlchemy session object.
+        :return: bool
+        """
+        return session.query(func.max(CustomPlayerStatsGame.id)).scalar() == self.meta['max_stats_id']
+
+
+_store = None
+
+
+def get_feature_store(store_dir: Path = STORE_DIR) -> Union[FeatureStore, None]:
+    """
+    The feature store, opened once per process.
+
+    :param Path store_dir: The store directory.
+    :return: The store, None if it was never built.
+    """
+    global _store
+    if _store is None or _store.store_dir != Path(store_dir):
+        if not (Path(store_dir) / META_FILE).exists():
+            return None
+        _store = FeatureStore(store_dir)
+    return _store
+
+
+if __name__ == "__main__":
+    #usage: python bo3_stats/feature_store.py
+    init_db()
+
+    print(f"Wrote {build_feature_store()} rows to {STORE_DIR}")
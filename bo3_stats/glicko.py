@@ -6,18 +6,31 @@ sys.path.append(current_directory_str)
 
 from models.models import *
 import numpy as np
+import pandas as pd
 from sqlalchemy.orm import aliased
 from sqlalchemy import func
 from sqlalchemy.sql import exists
-from typing import List, Tuple
-from multiprocessing import Pool
+from typing import Dict, List, Tuple
 import warnings
 from tqdm import tqdm
+from bo3_stats.rating_state import DEFAULT_RATING, DEFAULT_DEVIATION, DEFAULT_VOL, ensure_rating_state, load_rating_state, update_rating_state
 
 
 #config
 warnings.simplefilter("error", RuntimeWarning)
 
+SCALE = 173.7178 #glicko2 scaling between rating and mu
+TAU = 0.5 #global scale parameter that impacts how "fast" ratings and their deviations change
+CONVERGENCE = 0.0001 #volatility iteration tolerance, suggested as 0.000001 (reduced to speed up)
+GAMMA = 1 #exponent of the tdp multipliers
+TDP_MIN_ROUNDS = 12 #games with fewer rounds of data get no tdp multiplier (some games only have a few rounds of data)
+GAMES_PER_COMMIT = 5000 #games written per bulk insert and commit by compute_glicko2
+CHECK_TOLERANCE = 1e-6 #max rating difference between per game and one game period replays, see check_period_mode
+
+TEAM_WINNER = 0
+TEAM_LOSER = 1
+TEAM_OTHER = -1 #player whose team id matches neither team, their rating is carried over unchanged
+
 
 def get_g(phi: float) -> float:
     '''
@@ -60,215 +73,71 @@ def f_of_x(x: int, delta: float, phi: float, v: float, a: float, tau: float) ->
     return (num1/denom1) - (num2/denom2)
 
 
-def games_to_process() -> List[int]:
+def rateable_games(session: Session):
     """
-    Query the database to find all game IDs from the Games table 
-    that are not present in the PlayerGlicko table, 
-    sorted by the begin_at column in ascending order (earliest first).
-    
-    :return: A list of game IDs that need to be processed.
-    :rtype: List[int]
-    """
-    session = Session()
+    Query of the games that can be rated (both teams known, rounds played and per game player stats formatted), earliest first.
 
-    # Use an alias for PlayerGlicko to be able to exclude its game_id in the main query
-    pg_alias = aliased(PlayerGlicko)
-
-    # Use a LEFT OUTER JOIN to find all records in Games with no corresponding record in PlayerGlicko
-    games = session.query(Games) \
-        .outerjoin(pg_alias, Games.id == pg_alias.game_id) \
-        .filter(pg_alias.game_id.is_(None)) \
+    :param session: An SQLAlchemy session object.
+    :return: The Games query.
+    """
+    return session.query(Games) \
         .filter(Games.winner_team_id != None) \
         .filter(Games.loser_team_id != None) \
         .filter(Games.rounds_count != None) \
         .filter(exists().where(CustomPlayerStatsGame.game_id == Games.id)) \
-        .order_by(Games.begin_at.asc()) \
-        .all()
-
-    session.close()
-
-    # Extract just the game_id values from the result set and return as a list
-    #games = [game[0] for game in games]
-
-    return games
+        .order_by(Games.begin_at.asc())
 
 
-def get_game_details(game: object) -> dict:
+def pending_games(session: Session):
     """
-    Retrieves details of a game, including information about the winner and loser teams and their players.
+    Query of the games without PlayerGlicko rows that can be rated, earliest first.
 
-    :param game: The game object containing game details.
-
-    :return:
-    - dict: A dictionary containing game details for the winner team.
-    - dict: A dictionary containing game details for the loser team.
-    
-    Example:
-    get_game_details(game) returns:
-    ({'id': winner_team_id, 'score': winner_team_score_normalized, 'players': [{'mu_pre': mu_pre, 'sigma_pre': sigma_pre, 'tdp': tdp}, ...]},
-     {'id': loser_team_id, 'score': loser_team_score_normalized, 'players': [{'mu_pre': mu_pre, 'sigma_pre': sigma_pre, 'tdp': tdp}, ...]})
+    :param session: An SQLAlchemy session object.
+    :return: The Games query.
     """
-    session = Session()
-
-    games = {
-        'winner': {
-            'id': game.winner_team_id,
-            'score': game.winner_team_score / (game.winner_team_score + game.loser_team_score) if game.winner_team_score is not None and (game.winner_team_score + game.loser_team_score) > 0 else 1,
-            'players': []
-        },
-        'loser': {
-            'id': game.loser_team_id,
-            'score': game.loser_team_score / (game.winner_team_score + game.loser_team_score) if game.winner_team_score is not None and (game.winner_team_score + game.loser_team_score) > 0 else 0,
-            'players': []
-        }
-    }
-
-    # Query to get player stats, glicko ratings, and team_id
-    # Create an alias for PlayerGlicko for the subquery
-    player_glicko_alias = aliased(PlayerGlicko)
-
-    # Subquery to get the most recent PlayerGlicko entry per player
-    subquery = (
-        session.query(
-            player_glicko_alias.player_id,
-            func.max(player_glicko_alias.begin_at).label('max_begin_at')
-        )
-        .group_by(player_glicko_alias.player_id)
-        .subquery()
-    )
-
-    # Main query
-    player_game_stats = (
-        session.query(
-            CustomPlayerStatsGame, 
-            PlayerGlicko, 
-            GamePlayerStats.team_id
-        )
-        .outerjoin(
-            subquery,
-            (subquery.c.player_id == CustomPlayerStatsGame.player_id)
-        )
-        .outerjoin(
-            PlayerGlicko,
-            (PlayerGlicko.player_id == subquery.c.player_id) & (PlayerGlicko.begin_at == subquery.c.max_begin_at)
-        )
-        .outerjoin(
-            GamePlayerStats, 
-            (GamePlayerStats.game_id == CustomPlayerStatsGame.game_id) & (GamePlayerStats.player_id == CustomPlayerStatsGame.player_id)
-        )
-        .filter(CustomPlayerStatsGame.game_id == game.id)
-        .distinct(CustomPlayerStatsGame.player_id)
-        .all()
-    )
-
-    session.close()
-
-    # Process the results
-    for player_stats, player_glicko, team_id in player_game_stats:
-        p = {
-            'player_id': player_stats.player_id,
-            'game_id': game.id,
-            'begin_at': game.begin_at,
-            'rating_pre': player_glicko.rating_post if player_glicko else 1500,
-            'deviation_pre': player_glicko.deviation_post if player_glicko else 350,
-            'vol_pre': player_glicko.vol_post if player_glicko else 0.06,
-            'tdp': player_stats.tdp if player_stats.num_rounds >= 12 else 0, #setting cutoff to cut out some bad data (some games only have a few rounds of data and doesnt make sense to include)
-            'team_id': team_id  # Add team_id to the dictionary
-        }
-
-        if team_id == games['winner']['id']:
-            games['winner']['players'].append(p)
-        elif team_id == games['loser']['id']:
-            games['loser']['players'].append(p)
-        else: #fix for bug wherte team id is wrong for some reason: game id = 34884
-            session = Session()
-            new_glicko = PlayerGlicko(
-                game_id=p['game_id'], player_id=p['player_id'], begin_at=p['begin_at'], 
-                rating_pre=p['rating_pre'], deviation_pre=p['deviation_pre'], vol_pre=p['vol_pre'],
-                rating_post=p['rating_pre'], deviation_post=p['deviation_pre'], vol_post=p['vol_pre'],
-            )
-            session.add(new_glicko)
-            session.commit()
-            session.close()
-
-    return games
-
-
-def gamma_multipliers(game_details: dict, gamma: int = 1) -> None:
-    """
-    Calculates and assigns gamma multipliers to players in the game details.
-
-    :param game_details: A tuple containing game details for the winner and loser teams.
-    :param gamma: Gamma parameter for multiplier calculation (default is 1).
-
-    Example:
-    gamma_multipliers(game_details, gamma=1) modifies the 'game_details' dictionary to include player multipliers.
-    """
-    win_denom = 0
-    lose_denom = 0
-    try:
-        win_denom = sum(d['tdp'] ** gamma if d['tdp'] > 0 else 1/0 for d in game_details['winner']['players']) #hacky exception raise
-        lose_denom = sum(1 / (d['tdp'] ** gamma) for d in game_details['loser']['players'])
-    except: #hacky fix for bad data
-        for player in game_details['winner']['players']:
-            player['multiplier'] = 1
-
-        for player in game_details['loser']['players']:
-            player['multiplier'] = 1
-
-        return
+    # Use an alias for PlayerGlicko to be able to exclude its game_id in the main query
+    pg_alias = aliased(PlayerGlicko)
 
-    for player in game_details['winner']['players']:
-        player['multiplier'] = 5 * (player['tdp'] ** gamma) / win_denom
+    # Use a LEFT OUTER JOIN to find all records in Games with no corresponding record in PlayerGlicko
+    return rateable_games(session) \
+        .outerjoin(pg_alias, Games.id == pg_alias.game_id) \
+        .filter(pg_alias.game_id.is_(None))
 
-    for player in game_details['loser']['players']:
-            player['multiplier'] = 5 * (1 / (player['tdp'] ** gamma)) / lose_denom
-        
 
-def compute_glicko2_player(args: Tuple[dict, dict]) -> None:
+def glicko2_update(rating: float, deviation: float, vol: float, opp_ratings: np.ndarray, opp_deviations: np.ndarray, score: float,
+                   multiplier: float = 1, tau: float = TAU, convergence: float = CONVERGENCE) -> Tuple[float, float, float]:
     """
-    Calculate and update a player's Glicko-2 rating and other parameters based on match results.
-
-    :param args: A tuple containing two dictionaries: player dictionary and opponent team dictionary.
-                 The player dictionary should have keys: 'rating_pre', 'deviation_pre', 'vol_pre',
-                 'game_id', 'player_id', 'begin_at', 'multiplier'.
-                 The opponent team dictionary should have a key: 'players' which is a list of dictionaries
-                 with keys: 'rating_pre', 'deviation_pre'.
-    :type args: Tuple[dict, dict]
-
-    :return: None
+    One Glicko-2 update of a player against the players of the opposing team. Pure, nothing is read or written.
+
+    :param rating: The player's rating before the game.
+    :param deviation: The player's rating deviation before the game.
+    :param vol: The player's volatility before the game.
+    :param opp_ratings: Ratings of the opposing players before the game.
+    :param opp_deviations: Rating deviations of the opposing players before the game.
+    :param score: The player's team share of the rounds (1 - the opposing team's score).
+    :param multiplier: Scales the rating change, see team_multipliers.
+    :param tau: Global scale parameter that impacts how "fast" ratings and their deviations change.
+    :param convergence: Tolerance of the volatility iteration.
+    :return: The rating, rating deviation and volatility after the game. Unchanged without opponents.
     """
-    #step 1
-    player, opp_team = args
-
-    tau = 0.5 #Constant
+    if len(opp_ratings) == 0: #handling bad data (gameid = 27443) where all players were stored as one team
+        return rating, deviation, vol
 
     #Step 2
-    mu = (player['rating_pre'] - 1500) / 173.7178
-    phi = player['deviation_pre'] / 173.7178
-    vol = player['vol_pre']
+    mu = (rating - 1500) / SCALE
+    phi = deviation / SCALE
 
     #Step 3
-    opp_phis = np.array([d['deviation_pre'] / 173.7178 for d in opp_team['players']])
-    opp_mus = np.array([(d['rating_pre'] - 1500) / 173.7178 for d in opp_team['players']])
-
-    if len(opp_mus) == 0: #handling bad data (gameid = 27443) where all players were stored as one team
-        session = Session()
-        new_glicko = PlayerGlicko(
-            game_id=player['game_id'], player_id=player['player_id'], begin_at=player['begin_at'], 
-            rating_pre=player['rating_pre'], deviation_pre=player['deviation_pre'], vol_pre=player['vol_pre'],
-            rating_post=player['rating_pre'], deviation_post=player['deviation_pre'], vol_post=player['vol_pre'],
-        )
-        session.add(new_glicko)
-        session.commit()
-        session.close()
-        return
+    opp_phis = np.asarray(opp_deviations, dtype=np.float64) / SCALE
+    opp_mus = (np.asarray(opp_ratings, dtype=np.float64) - 1500) / SCALE
 
-    v = 1 / (np.sum((get_g(opp_phis)**2) * get_E(mu, opp_mus, opp_phis) * (1 - get_E(mu, opp_mus, opp_phis))))
+    g = get_g(opp_phis)
+    E = get_E(mu, opp_mus, opp_phis)
+    v = 1 / (np.sum((g**2) * E * (1 - E)))
 
     #Step 4
-    match_results = np.array([(1-opp_team['score'])] * len(opp_team['players']))
-    delta = np.sum( get_g(opp_phis) * ( match_results - get_E(mu, opp_mus, opp_phis) ) ) * v
+    improvement = np.sum(g * (score - E))
+    delta = improvement * v
 
     #Step 5
     A = np.log(vol**2)
@@ -284,7 +153,7 @@ def compute_glicko2_player(args: Tuple[dict, dict]) -> None:
 
     Fa = f_of_x(A, delta, phi, v, a, tau)
     Fb = f_of_x(B, delta, phi, v, a, tau)
-    while np.abs(B - A) > 0.0001:  #Suggested as 0.000001 (reduced to test if speeds up)
+    while np.abs(B - A) > convergence:
         C = A + (((A - B) * Fa) / (Fb - Fa))
         Fc = f_of_x(C, delta, phi, v, a, tau)
         if Fb * Fc <= 0:
@@ -302,105 +171,480 @@ def compute_glicko2_player(args: Tuple[dict, dict]) -> None:
 
     #Step 7
     phi_prime = 1 / np.sqrt((1 / phi_star**2) + (1 / v))
+    mu_prime = mu + (phi_prime**2 * multiplier * improvement)
 
-    mu_prime = mu + (phi_prime**2 * player['multiplier'] * np.sum( get_g(opp_phis) * ( match_results - get_E(mu, opp_mus, opp_phis) ) ))
-    
     #Step 8
-    rating_prime = (173.7178 * mu_prime) + 1500
-    RD_prime = (173.7178 * phi_prime)
+    return float((SCALE * mu_prime) + 1500), float(SCALE * phi_prime), float(sigma_prime)
 
-    player['rating_post'] = rating_prime
-    player['deviation_post'] = RD_prime
-    player['vol_post'] = sigma_prime
 
-    session = Session()
+class GlickoState():
+    """
+    Current rating, rating deviation and volatility of every player, as arrays indexed by position in player_ids.
+    """
 
-    new_glicko = PlayerGlicko(
-        game_id=player['game_id'], player_id=player['player_id'], begin_at=player['begin_at'], 
-        rating_pre=player['rating_pre'], deviation_pre=player['deviation_pre'], vol_pre=player['vol_pre'],
-        rating_post=player['rating_post'], deviation_post=player['deviation_post'], vol_post=player['vol_post'],
-    )
+    def __init__(self, player_ids: np.ndarray, rating: float = DEFAULT_RATING, deviation: float = DEFAULT_DEVIATION, vol: float = DEFAULT_VOL):
+        self.player_ids = np.unique(np.asarray(player_ids, dtype=np.int64))
+        self.rating = np.full(len(self.player_ids), rating, dtype=np.float64)
+        self.deviation = np.full(len(self.player_ids), deviation, dtype=np.float64)
+        self.vol = np.full(len(self.player_ids), vol, dtype=np.float64)
+
+    def index(self, player_ids: np.ndarray) -> np.ndarray:
+        """
+        :return: The position of each player in the state arrays (every player must be in the state).
+        """
+        return np.searchsorted(self.player_ids, np.asarray(player_ids, dtype=np.int64))
+
+    def load(self, ratings: pd.DataFrame) -> 'GlickoState':
+        """
+        Start players from their stored ratings instead of the defaults.
+
+        :param ratings: Columns player_id, rating, deviation and vol, see load_rating_state.
+        :return: self
+        """
+        ratings = ratings[ratings['player_id'].isin(self.player_ids)]
+        index = self.index(ratings['player_id'].to_numpy())
+        self.rating[index] = ratings['rating'].to_numpy(dtype=np.float64)
+        self.deviation[index] = ratings['deviation'].to_numpy(dtype=np.float64)
+        self.vol[index] = ratings['vol'].to_numpy(dtype=np.float64)
+        return self
+
+    def copy(self) -> 'GlickoState':
+        state = GlickoState(self.player_ids)
+        state.rating, state.deviation, state.vol = self.rating.copy(), self.deviation.copy(), self.vol.copy()
+        return state
+
+
+def load_games(session: Session, query=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Loads games to rate and their players in two queries.
+
+    :param session: An SQLAlchemy session object.
+    :param query: A Games query of the games to rate. Default is pending_games.
+    :return: The games (id, begin_at, team ids and scores) and one row per game and player (game_id, player_id, num_rounds, tdp, team_id).
+    """
+    query = pending_games(session) if query is None else query
+
+    games = pd.read_sql(query.with_entities(
+        Games.id, Games.begin_at, Games.winner_team_id, Games.loser_team_id, Games.winner_team_score, Games.loser_team_score
+    ).statement, session.bind)
+
+    players = pd.read_sql(
+        session.query(
+            CustomPlayerStatsGame.game_id,
+            CustomPlayerStatsGame.player_id,
+            CustomPlayerStatsGame.num_rounds,
+            CustomPlayerStatsGame.tdp,
+            GamePlayerStats.team_id
+        )
+        .outerjoin(
+            GamePlayerStats,
+            (GamePlayerStats.game_id == CustomPlayerStatsGame.game_id) & (GamePlayerStats.player_id == CustomPlayerStatsGame.player_id)
+        )
+        .filter(CustomPlayerStatsGame.game_id.in_(query.with_entities(Games.id).order_by(None).scalar_subquery()))
+        .filter(CustomPlayerStatsGame.player_id != None)
+        .statement, session.bind)
+
+    return games, players.drop_duplicates(['game_id', 'player_id'])
 
-    session.add(new_glicko)
-    session.commit()
-    session.close()
 
+def game_arrays(games: pd.DataFrame, players: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Lays out games and their players as flat arrays in rating order (begin_at, then game id, games without a start last).
+    The players of game i are the rows offsets[i]:offsets[i + 1].
 
-def compute_glicko2_pool(args: List[Tuple[dict, dict]], num_processes: int) -> None:
+    :param games: The games, see load_games.
+    :param players: The players of the games, see load_games.
+    :return: Arrays game_id, begin_at, dated, winner_score, loser_score, offsets (per game) and player_id, team, tdp (per player row).
     """
-    Calculate Glicko-2 ratings for a pool of players concurrently using multiprocessing.
+    games = games.assign(dated=games['begin_at'].notna()).sort_values(['dated', 'begin_at', 'id'], ascending=[False, True, True], kind='mergesort')
+    games = games.reset_index(drop=True)
+
+    winner_score = games['winner_team_score'].astype(np.float64).to_numpy()
+    loser_score = games['loser_team_score'].astype(np.float64).to_numpy()
+    total = winner_score + loser_score
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scored = ~np.isnan(total) & (total > 0)
+        winner_share = np.where(scored, winner_score / total, 1)
+        loser_share = np.where(scored, loser_score / total, 0)
+
+    players = players.merge(games[['id', 'winner_team_id', 'loser_team_id']].reset_index(names='position'), left_on='game_id', right_on='id')
+    players = players.sort_values('position', kind='mergesort').reset_index(drop=True)
+
+    team = np.full(len(players.index), TEAM_OTHER, dtype=np.int8)
+    team[(players['team_id'] == players['winner_team_id']).to_numpy()] = TEAM_WINNER
+    team[(players['team_id'] == players['loser_team_id']).to_numpy()] = TEAM_LOSER
+
+    num_rounds = players['num_rounds'].astype(np.float64).to_numpy()
+    tdp = players['tdp'].astype(np.float64).to_numpy()
+    with np.errstate(invalid='ignore'):
+        tdp = np.where(num_rounds >= TDP_MIN_ROUNDS, tdp, 0)
+
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(players['position'].to_numpy(), minlength=len(games.index)))]).astype(np.int64)
+
+    return {
+        'game_id': games['id'].to_numpy(dtype=np.int64),
+        'begin_at': games['begin_at'].to_numpy(),
+        'dated': games['dated'].to_numpy(),
+        'winner_score': winner_share,
+        'loser_score': loser_share,
+        'offsets': offsets,
+        'player_id': players['player_id'].to_numpy(dtype=np.int64),
+        'team': team,
+        'tdp': tdp,
+    }
 
-    :param args: A list of tuples, each containing two dictionaries: player dictionary and opponent team dictionary.
-                 The player dictionary should have keys: 'rating_pre', 'deviation_pre', 'vol_pre',
-                 'game_id', 'player_id', 'begin_at', 'multiplier'.
-                 The opponent team dictionary should have a key: 'players' which is a list of dictionaries
-                 with keys: 'rating_pre', 'deviation_pre'.
-    :type args: List[Tuple[dict, dict]]
 
-    :param num_processes: The number of processes to use for parallel computation.
-    :type num_processes: int
+def team_multipliers(tdp: np.ndarray, team: np.ndarray, gamma: float = GAMMA) -> np.ndarray:
+    """
+    Multipliers of the rating changes of the players of one game: winners by their tdp share,
+    losers by their inverse tdp share, all 1 if a tdp is missing (or not positive for a winner, zero for a loser).
 
-    :return: None
+    :param tdp: The players' tdp (0 below TDP_MIN_ROUNDS, NaN if missing).
+    :param team: TEAM_WINNER, TEAM_LOSER or TEAM_OTHER per player.
+    :param gamma: Gamma parameter for multiplier calculation.
+    :return: The multiplier of each player.
     """
-    with Pool(processes=num_processes) as pool:
-        pool.map(compute_glicko2_player, [(player, opp_team) for player, opp_team in args])
+    multipliers = np.ones(len(tdp))
+    winners = tdp[team == TEAM_WINNER]
+    losers = tdp[team == TEAM_LOSER]
+    if np.isnan(winners).any() or (winners <= 0).any() or np.isnan(losers).any() or (losers == 0).any(): #hacky fix for bad data
+        return multipliers
+
+    multipliers[team == TEAM_WINNER] = 5 * (winners ** gamma) / np.sum(winners ** gamma)
+    multipliers[team == TEAM_LOSER] = 5 * (1 / (losers ** gamma)) / np.sum(1 / (losers ** gamma))
+    return multipliers
 
 
-def compute_glicko2(window: int = 10, num_processes: int = 8) -> None:
+def replay_glicko2(arrays: Dict[str, np.ndarray], state: GlickoState, tau: float = TAU, gamma: float = GAMMA,
+                   convergence: float = CONVERGENCE, progress: bool = False) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Calculate Glicko-2 ratings for a batch of games.
+    Rates games one after another in memory. Every player of a game is updated from the ratings before the game,
+    then the state moves on. Games without a start are rated but do not move the state (they are never a player's latest rating).
+
+    :param arrays: The games, see game_arrays.
+    :param state: The ratings before the first game, updated in place.
+    :param tau: Global scale parameter that impacts how "fast" ratings and their deviations change.
+    :param gamma: Gamma parameter of the tdp multipliers.
+    :param convergence: Tolerance of the volatility iteration.
+    :param progress: Show a progress bar.
+    :return: The (rating, deviation, vol) of every player row before and after its game, both (player rows x 3).
+    """
+    offsets = arrays['offsets']
+    index = state.index(arrays['player_id'])
+    pre = np.empty((len(index), 3))
+    post = np.empty((len(index), 3))
 
-    :param window: The number of games to process before printing progress.
-    :type window: int, optional
+    for position in tqdm(range(len(offsets) - 1), desc="Processing", disable=not progress):
+        start, end = offsets[position], offsets[position + 1]
+        players = index[start:end]
+        team = arrays['team'][start:end]
 
-    :param num_processes: The number of processes to use for parallel computation.
-    :type num_processes: int, optional
+        pre[start:end] = np.column_stack([state.rating[players], state.deviation[players], state.vol[players]])
+        post[start:end] = pre[start:end]
 
-    :return: None
+        multipliers = team_multipliers(arrays['tdp'][start:end], team, gamma)
+        for side, opponents, score in [(TEAM_WINNER, TEAM_LOSER, arrays['winner_score'][position]), (TEAM_LOSER, TEAM_WINNER, arrays['loser_score'][position])]:
+            opp_ratings = pre[start:end, 0][team == opponents]
+            opp_deviations = pre[start:end, 1][team == opponents]
+            for k in np.flatnonzero(team == side):
+                post[start + k] = glicko2_update(pre[start + k, 0], pre[start + k, 1], pre[start + k, 2], opp_ratings, opp_deviations, score, multipliers[k], tau, convergence)
+
+        if arrays['dated'][position]:
+            state.rating[players], state.deviation[players], state.vol[players] = post[start:end].T
+
+    return pre, post
+
+
+def solve_volatility(delta: np.ndarray, phi: np.ndarray, v: np.ndarray, vol: np.ndarray, tau: float = TAU, convergence: float = CONVERGENCE) -> np.ndarray:
+    """
+    Step 5 of glicko2 (the Illinois iteration of glicko2_update) for many players at once.
+    Every player iterates exactly like the scalar version, converged players are masked out.
+
+    :param delta: Estimated improvement of each player (step 4).
+    :param phi: Scaled rating deviation of each player.
+    :param v: Estimated variance of each player's rating from the game outcomes (step 3).
+    :param vol: Volatility of each player.
+    :param tau: Global scale parameter that impacts how "fast" ratings and their deviations change.
+    :param convergence: Tolerance of the volatility iteration.
+    :return: The new volatility of each player.
     """
-    games = games_to_process()
+    a = np.log(vol**2)
+    A = a.copy()
+    B = np.empty_like(a)
 
-    to_process = len(games)
-    print(f"Need to process {to_process} instances.")
+    large = (delta**2) > (phi**2 + v)
+    B[large] = np.log(delta[large]**2 - phi[large]**2 - v[large])
 
-    with tqdm(total=to_process, desc="Processing") as pbar:
-        i = 0
-        while i < to_process:
-            game_details = get_game_details(games[i])
+    k = np.ones_like(a)
+    todo = np.flatnonzero(~large)
+    while len(todo) > 0:
+        negative = f_of_x(a[todo] - k[todo]*tau, delta[todo], phi[todo], v[todo], a[todo], tau) < 0
+        todo = todo[negative]
+        k[todo] += 1
+    B[~large] = a[~large] - k[~large]*tau
 
-            gamma_multipliers(game_details)
+    Fa = f_of_x(A, delta, phi, v, a, tau)
+    Fb = f_of_x(B, delta, phi, v, a, tau)
+    todo = np.flatnonzero(np.abs(B - A) > convergence)
+    while len(todo) > 0:
+        C = A[todo] + (((A[todo] - B[todo]) * Fa[todo]) / (Fb[todo] - Fa[todo]))
+        Fc = f_of_x(C, delta[todo], phi[todo], v[todo], a[todo], tau)
+        flip = Fb[todo] * Fc <= 0
+        A[todo[flip]] = B[todo[flip]]
+        Fa[todo[flip]] = Fb[todo[flip]]
+        Fa[todo[~flip]] = Fa[todo[~flip]] / 2
+        B[todo] = C
+        Fb[todo] = Fc
+        todo = todo[np.abs(B[todo] - A[todo]) > convergence]
+
+    return np.exp(A / 2)
+
+
+def period_ids(arrays: Dict[str, np.ndarray], period: str = '1D') -> np.ndarray:
+    """
+    Groups games into rating periods by start time. Games without a start form the last period.
 
-            args = format_args(game_details)
+    :param arrays: The games, see game_arrays.
+    :param period: A fixed pandas frequency, eg '1D' or '12h'.
+    :return: The period of each game, non decreasing (np.ndarray of int64).
+    """
+    begin_at = pd.to_datetime(pd.Series(arrays['begin_at'])).dt.floor(period)
+    codes = pd.factorize(begin_at, use_na_sentinel=True)[0].astype(np.int64)
+    codes[~arrays['dated']] = codes.max(initial=-1) + 1
+    return codes
 
-            compute_glicko2_pool(args, num_processes)
 
-            # Update the progress bar manually
-            pbar.update(1)
-            i += 1
+def game_pairs(arrays: Dict[str, np.ndarray], gamma: float = GAMMA) -> Dict[str, np.ndarray]:
+    """
+    Every (player row, opposing player row) pair of every game, and the tdp multiplier of every player row.
+    Pairs of game i are pair_offsets[i]:pair_offsets[i + 1].
 
+    :param arrays: The games, see game_arrays.
+    :param gamma: Gamma parameter of the tdp multipliers.
+    :return: Arrays row, opponent, pair_offsets and multiplier.
+    """
+    offsets = arrays['offsets']
+    rows, opponents, counts = [], [], []
+    multipliers = np.ones(len(arrays['team']))
+
+    for position in range(len(offsets) - 1):
+        start, end = offsets[position], offsets[position + 1]
+        team = arrays['team'][start:end]
+        winners = start + np.flatnonzero(team == TEAM_WINNER)
+        losers = start + np.flatnonzero(team == TEAM_LOSER)
+        multipliers[start:end] = team_multipliers(arrays['tdp'][start:end], team, gamma)
+
+        rows += [np.repeat(winners, len(losers)), np.repeat(losers, len(winners))]
+        opponents += [np.tile(losers, len(winners)), np.tile(winners, len(losers))]
+        counts.append(2 * len(winners) * len(losers))
+
+    return {
+        'row': np.concatenate(rows).astype(np.int64) if rows else np.empty(0, dtype=np.int64),
+        'opponent': np.concatenate(opponents).astype(np.int64) if opponents else np.empty(0, dtype=np.int64),
+        'pair_offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'multiplier': multipliers,
+    }
 
-def format_args(game_details: dict) -> List[Tuple[dict, dict]]:
+
+def replay_glicko2_periods(arrays: Dict[str, np.ndarray], state: GlickoState, periods: np.ndarray, tau: float = TAU, gamma: float = GAMMA,
+                           convergence: float = CONVERGENCE, progress: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rates games in rating periods: every player active in a period is updated once from all their games in it,
+    against the opponents' ratings at the start of the period, with array operations over all active players.
+    Players with no game in a period are left as they are, like in replay_glicko2. With one game per period both match, see check_period_mode.
+
+    :param arrays: The games, see game_arrays.
+    :param state: The ratings before the first game, updated in place.
+    :param periods: The period of each game, non decreasing, see period_ids.
+    :param tau: Global scale parameter that impacts how "fast" ratings and their deviations change.
+    :param gamma: Gamma parameter of the tdp multipliers.
+    :param convergence: Tolerance of the volatility iteration.
+    :param progress: Show a progress bar.
+    :return: The (rating, deviation, vol) of every player row before and after its period, both (player rows x 3).
     """
-    Format game details into a list of player-opponent team tuples for Glicko-2 calculation.
+    offsets = arrays['offsets']
+    index = state.index(arrays['player_id'])
+    pairs = game_pairs(arrays, gamma)
+    game_scores = np.column_stack([arrays['winner_score'], arrays['loser_score']])
+    row_scores = game_scores[np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)), np.maximum(arrays['team'], 0)]
+
+    pre = np.empty((len(index), 3))
+    post = np.empty((len(index), 3))
+
+    boundaries = np.concatenate([[0], np.flatnonzero(np.diff(periods)) + 1, [len(periods)]]) if len(periods) > 0 else np.zeros(1, dtype=np.int64)
+    for first, last in tqdm(zip(boundaries[:-1], boundaries[1:]), total=len(boundaries) - 1, desc="Processing", disable=not progress):
+        start, end = offsets[first], offsets[last]
+        players, inverse = np.unique(index[start:end], return_inverse=True)
+
+        pre[start:end] = np.column_stack([state.rating[index[start:end]], state.deviation[index[start:end]], state.vol[index[start:end]]])
+        post[start:end] = pre[start:end]
+
+        pair_rows = pairs['row'][pairs['pair_offsets'][first]:pairs['pair_offsets'][last]]
+        if len(pair_rows) == 0:
+            continue
+        pair_opponents = index[pairs['opponent'][pairs['pair_offsets'][first]:pairs['pair_offsets'][last]]]
+        player = inverse[pair_rows - start]
+
+        #Step 2
+        mu = (state.rating[players] - 1500) / SCALE
+        phi = state.deviation[players] / SCALE
+
+        #Step 3
+        opp_phis = state.deviation[pair_opponents] / SCALE
+        opp_mus = (state.rating[pair_opponents] - 1500) / SCALE
+        g = get_g(opp_phis)
+        E = get_E(mu[player], opp_mus, opp_phis)
+
+        active = np.bincount(player, minlength=len(players)) > 0
+        v = 1 / np.bincount(player, (g**2) * E * (1 - E), minlength=len(players))[active]
+
+        #Step 4
+        gains = g * (row_scores[pair_rows] - E)
+        improvement = np.bincount(player, gains, minlength=len(players))[active]
+        weighted_improvement = np.bincount(player, pairs['multiplier'][pair_rows] * gains, minlength=len(players))[active]
+        delta = improvement * v
 
-    :param game_details: A dictionary containing details of a game, including winner and loser teams.
-    :type game_details: dict
+        #Step 5
+        sigma_prime = solve_volatility(delta, phi[active], v, state.vol[players][active], tau, convergence)
 
-    :return: A list of tuples, each containing a player dictionary and an opponent team dictionary.
-    :rtype: List[Tuple[dict, dict]]
+        #Step 6
+        phi_star = np.sqrt(phi[active]**2 + sigma_prime**2)
+
+        #Step 7
+        phi_prime = 1 / np.sqrt((1 / phi_star**2) + (1 / v))
+        mu_prime = mu[active] + (phi_prime**2 * weighted_improvement)
+
+        #Step 8
+        updated = np.column_stack([(SCALE * mu_prime) + 1500, SCALE * phi_prime, sigma_prime])
+        rated = np.zeros(end - start, dtype=bool)
+        rated[pair_rows - start] = True
+        position = np.full(len(players), -1)
+        position[active] = np.arange(active.sum())
+        post[start:end][rated] = updated[position[inverse[rated]]]
+
+        if arrays['dated'][first]:
+            state.rating[players[active]], state.deviation[players[active]], state.vol[players[active]] = updated.T
+
+    return pre, post
+
+
+def check_period_mode(arrays: Dict[str, np.ndarray], state: GlickoState, tolerance: float = CHECK_TOLERANCE) -> float:
     """
-    formatted_data = []
+    Regression check of replay_glicko2_periods: with one game per period it must give the ratings of replay_glicko2.
 
-    winner_team = game_details['winner']
-    loser_team = game_details['loser']
+    :param arrays: The games, see game_arrays.
+    :param state: The ratings before the first game (not modified).
+    :param tolerance: The largest accepted difference.
+    :return: The largest difference between the two replays.
+    """
+    pre, post = replay_glicko2(arrays, state.copy())
+    period_pre, period_post = replay_glicko2_periods(arrays, state.copy(), np.arange(len(arrays['game_id'])))
 
-    for player in winner_team['players']:
-        formatted_data.append((player, loser_team))
+    difference = max(np.abs(pre - period_pre).max(initial=0), np.abs(post - period_post).max(initial=0))
+    assert difference <= tolerance, f"Period mode differs from per game mode by {difference}"
+    return difference
 
-    for player in loser_team['players']:
-        formatted_data.append((player, winner_team))
 
-    return formatted_data
+def glicko_rows(arrays: Dict[str, np.ndarray], pre: np.ndarray, post: np.ndarray, start: int = 0, end: int = None) -> List[dict]:
+    """
+    Turns replayed ratings into PlayerGlicko rows.
+
+    :param arrays: The games, see game_arrays.
+    :param pre: Ratings before the games, see replay_glicko2.
+    :param post: Ratings after the games, see replay_glicko2.
+    :param start: First game (position in arrays).
+    :param end: Last game (exclusive). Default is all games.
+    :return: The rows as dicts.
+    """
+    offsets = arrays['offsets']
+    end = len(offsets) - 1 if end is None else end
+
+    rows = []
+    for position in range(start, end):
+        begin_at = arrays['begin_at'][position]
+        begin_at = None if pd.isna(begin_at) else pd.Timestamp(begin_at).to_pydatetime()
+        for row in range(offsets[position], offsets[position + 1]):
+            rows.append({
+                'game_id': int(arrays['game_id'][position]), 'player_id': int(arrays['player_id'][row]), 'begin_at': begin_at,
+                'rating_pre': float(pre[row, 0]), 'deviation_pre': float(pre[row, 1]), 'vol_pre': float(pre[row, 2]),
+                'rating_post': float(post[row, 0]), 'deviation_post': float(post[row, 1]), 'vol_post': float(post[row, 2]),
+            })
+    return rows
+
+
+def compute_glicko2(games_per_commit: int = GAMES_PER_COMMIT, period: str = None) -> None:
+    """
+    Calculate Glicko-2 ratings for every game without ratings.
+
+    The pending games and their players are loaded once, the ratings are computed in memory in game order starting
+    from every player's PlayerRatingState, and the PlayerGlicko rows are bulk inserted games_per_commit games at a time,
+    each batch in one transaction with the update of the players' PlayerRatingState.
+
+    :param games_per_commit: The number of games written per commit.
+    :type games_per_commit: int, optional
+
+    :param period: Rate in rating periods of this pandas frequency (eg '1D'), see replay_glicko2_periods. Default is game by game.
+    :type period: str, optional
+
+    :return: None
+    """
+    session = Session()
+    try:
+        ensure_rating_state(session) #also when nothing is pending, line pricing reads the ratings from PlayerRatingState
+
+        games, players = load_games(session)
+        print(f"Need to process {len(games.index)} instances.")
+        if len(games.index) == 0:
+            return
+
+        arrays = game_arrays(games, players)
+        state = GlickoState(arrays['player_id']).load(load_rating_state(session))
+        if period is None:
+            pre, post = replay_glicko2(arrays, state, progress=True)
+        else:
+            pre, post = replay_glicko2_periods(arrays, state, period_ids(arrays, period), progress=True)
+
+        for start in range(0, len(arrays['game_id']), games_per_commit):
+            rows = glicko_rows(arrays, pre, post, start, min(start + games_per_commit, len(arrays['game_id'])))
+            session.bulk_insert_mappings(PlayerGlicko, rows)
+            update_rating_state(session, rows)
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def rerate_all(games_per_commit: int = GAMES_PER_COMMIT, period: str = None) -> None:
+    """
+    Delete every PlayerGlicko row and rate the full history again, eg after a rating parameter changed.
+
+    :param games_per_commit: The number of games written per commit.
+    :param period: Rating period frequency, see compute_glicko2. Default is game by game.
+    :return: None
+    """
+    session = Session()
+    session.query(PlayerRatingState).delete(synchronize_session=False)
+    session.query(PlayerGlicko).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+    compute_glicko2(games_per_commit, period)
+
+
+def check_all_games() -> float:
+    """
+    Runs check_period_mode over the full game history (read only).
+
+    :return: The largest difference between the two replays.
+    """
+    session = Session()
+    games, players = load_games(session, rateable_games(session))
+    session.close()
+
+    arrays = game_arrays(games, players)
+    return check_period_mode(arrays, GlickoState(arrays['player_id']))
 
 
 def glicko2_win_prob(p1_Rating, p1_RD, p2_Rating, p2_RD) -> Float:
@@ -418,15 +662,14 @@ def glicko2_win_prob(p1_Rating, p1_RD, p2_Rating, p2_RD) -> Float:
 
 
 if __name__ == "__main__":
+    #usage: python bo3_stats/glicko.py [--rerate] [--period 1D] [--check]
     init_db()
 
-    '''session = Session()
-    PlayerGlicko.__table__.drop(session.bind) #remove
-    session.close()''' #CODE FOR DELETING TABLE OF STATS
-
+    period = sys.argv[sys.argv.index("--period") + 1] if "--period" in sys.argv else None
 
-    compute_glicko2() #change back to defailt later
-    
-
-    
-        
\ No newline at end of file
+    if "--check" in sys.argv:
+        print(f"Max difference between per game and period mode: {check_all_games()}")
+    elif "--rerate" in sys.argv:
+        rerate_all(period=period)
+    else:
+        compute_glicko2(period=period)
@@ -0,0 +1,195 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+from bo3_stats.glicko import *
+import itertools
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool, shared_memory
+from typing import Dict, List, Tuple
+from tqdm import tqdm
+
+
+SWEEP_ARRAYS = ['offsets', 'player_id', 'team', 'tdp', 'winner_score', 'loser_score', 'dated'] #game_arrays a replay reads
+WARMUP = 0.2 #share of the earliest games that is replayed but not scored (every rating starts at the default)
+REPORT_PATH = "datasets/glicko_sweep.csv"
+
+DEFAULT_GRID = {
+    'tau': [0.3, 0.5, 0.8, 1.2],
+    'gamma': [0, 0.5, 1, 2],
+    'convergence': [CONVERGENCE],
+    'rating': [DEFAULT_RATING],
+    'deviation': [250, DEFAULT_DEVIATION],
+    'vol': [DEFAULT_VOL],
+    'period': [None],
+}
+
+
+def parameter_grid(grid: Dict[str, list] = DEFAULT_GRID) -> List[dict]:
+    """
+    Every combination of the values of a grid.
+
+    :param grid: Parameter name -> values to try. Parameters missing from the grid keep their default.
+    :return: The parameter sets (List[dict]).
+    """
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+class SharedArrays():
+    """
+    Read only game arrays placed in shared memory once, so every sweep worker maps the same copy instead of
+    receiving its own (works with fork and spawn start methods).
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.blocks = []
+        self.specs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+_blocks = []
+_arrays = {}
+
+
+def attach_arrays(specs: Dict[str, Tuple[str, tuple, str]]) -> None:
+    """
+    Pool initializer: maps the shared game arrays of a SharedArrays into the worker.
+
+    :param specs: SharedArrays.specs.
+    :return: None
+    """
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        _blocks.append(block)
+        _arrays[name] = array
+
+
+def sweep_arrays(arrays: Dict[str, np.ndarray], periods: List[str]) -> Dict[str, np.ndarray]:
+    """
+    The game arrays a sweep shares with its workers, with the rating period ids of every period in the grid precomputed.
+
+    :param arrays: The games, see game_arrays.
+    :param periods: The rating period frequencies of the grid (None for game by game).
+    :return: The arrays to share.
+    """
+    shared = {name: arrays[name] for name in SWEEP_ARRAYS}
+    for period in periods:
+        if period is not None:
+            shared[f'period_{period}'] = period_ids(arrays, period)
+    return shared
+
+
+def score_replay(arrays: Dict[str, np.ndarray], pre: np.ndarray, warmup: float = WARMUP) -> Dict[str, float]:
+    """
+    Scores the ratings of a replay by how well they predict each game: the win probability of the winning team
+    from the mean rating and deviation of both teams before the game, see glicko2_win_prob.
+
+    :param arrays: The games, see game_arrays.
+    :param pre: The ratings before each game, see replay_glicko2.
+    :param warmup: Share of the earliest games that is not scored.
+    :return: log_loss, brier, accuracy and the number of games scored.
+    """
+    offsets = arrays['offsets']
+    num_games = len(offsets) - 1
+    game = np.repeat(np.arange(num_games), np.diff(offsets))
+
+    playing = arrays['team'] >= 0
+    key = game[playing] * 2 + arrays['team'][playing]
+    counts = np.bincount(key, minlength=2 * num_games)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratings = np.bincount(key, pre[playing, 0], minlength=2 * num_games) / counts
+        deviations = np.bincount(key, pre[playing, 1], minlength=2 * num_games) / counts
+
+    scored = (counts[TEAM_WINNER::2] > 0) & (counts[TEAM_LOSER::2] > 0) & np.asarray(arrays['dated'], dtype=bool)
+    scored &= np.arange(num_games) >= int(warmup * num_games)
+
+    p = glicko2_win_prob(ratings[TEAM_WINNER::2][scored], deviations[TEAM_WINNER::2][scored], ratings[TEAM_LOSER::2][scored], deviations[TEAM_LOSER::2][scored])
+    p = np.clip(p, 1e-15, 1 - 1e-15)
+
+    return {
+        'log_loss': float(-np.mean(np.log(p))) if len(p) > 0 else np.nan,
+        'brier': float(np.mean((1 - p) ** 2)) if len(p) > 0 else np.nan,
+        'accuracy': float(np.mean(p > 0.5)) if len(p) > 0 else np.nan,
+        'games': int(len(p)),
+    }
+
+
+def evaluate(params: dict) -> dict:
+    """
+    Replays the shared game history with one parameter set and scores it. Runs in a sweep worker.
+
+    :param params: A parameter set, see parameter_grid.
+    :return: The parameter set with its scores.
+    """
+    state = GlickoState(_arrays['player_id'], params.get('rating', DEFAULT_RATING), params.get('deviation', DEFAULT_DEVIATION), params.get('vol', DEFAULT_VOL))
+    tau = params.get('tau', TAU)
+    gamma = params.get('gamma', GAMMA)
+    convergence = params.get('convergence', CONVERGENCE)
+
+    try:
+        if params.get('period') is None:
+            pre, _ = replay_glicko2(_arrays, state, tau, gamma, convergence)
+        else:
+            pre, _ = replay_glicko2_periods(_arrays, state, _arrays[f"period_{params['period']}"], tau, gamma, convergence)
+    except (RuntimeWarning, FloatingPointError) as e: #the parameter set diverged (overflow), ranked last
+        return {**params, 'log_loss': np.nan, 'brier': np.nan, 'accuracy': np.nan, 'games': 0, 'error': str(e)}
+
+    return {**params, **score_replay(_arrays, pre)}
+
+
+def sweep(grid: Dict[str, list] = DEFAULT_GRID, num_processes: int = 8, arrays: Dict[str, np.ndarray] = None) -> pd.DataFrame:
+    """
+    Replays the full game history in memory for every parameter set of a grid, in parallel, without touching PlayerGlicko.
+    The games are loaded once and shared read only with the workers.
+
+    :param grid: Parameter name -> values, see DEFAULT_GRID.
+    :param num_processes: The number of parallel processes.
+    :param arrays: The games to replay, see game_arrays. Default is every rateable game in the database.
+    :return: One row per parameter set ranked by log loss (best first).
+    """
+    if arrays is None:
+        session = Session()
+        games, players = load_games(session, rateable_games(session))
+        session.close()
+        arrays = game_arrays(games, players)
+
+    params = parameter_grid(grid)
+    shared = SharedArrays(sweep_arrays(arrays, {param.get('period') for param in params}))
+    try:
+        with Pool(processes=num_processes, initializer=attach_arrays, initargs=(shared.specs,)) as pool:
+            results = list(tqdm(pool.imap_unordered(evaluate, params), total=len(params), desc="Sweeping"))
+    finally:
+        shared.close()
+
+    report = pd.DataFrame(results).sort_values(['log_loss', 'brier'], kind='mergesort', na_position='last').reset_index(drop=True)
+    report.index.name = 'rank'
+    return report
+
+
+if __name__ == "__main__":
+    #usage: python bo3_stats/glicko_sweep.py [num_processes]
+    init_db()
+
+    num_processes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+    report = sweep(num_processes=num_processes)
+    report.to_csv(REPORT_PATH)
+    print(report.to_string())
@@ -0,0 +1,193 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects.postgresql import insert
+from typing import List, Union
+from scraper.bulk_writer import MAX_PARAMS
+from bo3_stats.feature_store import AsOfIndex, unix_seconds
+
+
+STATE_COLUMNS = ['player_id', 'rating', 'deviation', 'vol', 'last_game_id', 'last_game_time']
+STATE_CHUNK_SIZE = MAX_PARAMS // len(STATE_COLUMNS) #rows per upsert statement
+
+DEFAULT_RATING = 1500
+DEFAULT_DEVIATION = 350
+DEFAULT_VOL = 0.06
+
+
+def glicko_history(session: Session, player_ids: List[int] = None) -> pd.DataFrame:
+    """
+    Reads the post game ratings of every dated PlayerGlicko row in one query, ordered by player, begin_at and id.
+
+    :param session: An SQLAlchemy session object.
+    :param player_ids: Only these players. Default is every player.
+    :return: Columns player_id, rating, deviation, vol, last_game_id and last_game_time (one row per player and game).
+    """
+    query = session.query(
+            PlayerGlicko.player_id,
+            PlayerGlicko.rating_post.label('rating'),
+            PlayerGlicko.deviation_post.label('deviation'),
+            PlayerGlicko.vol_post.label('vol'),
+            PlayerGlicko.game_id.label('last_game_id'),
+            PlayerGlicko.begin_at.label('last_game_time')
+        )\
+        .filter(PlayerGlicko.begin_at != None, PlayerGlicko.player_id != None)\
+        .order_by(PlayerGlicko.player_id.asc(), PlayerGlicko.begin_at.asc(), PlayerGlicko.id.asc())
+
+    if player_ids is not None:
+        query = query.filter(PlayerGlicko.player_id.in_(player_ids))
+
+    return pd.read_sql(query.statement, session.bind)
+
+
+def latest_states(history: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param history: Rating rows in time order within each player, see glicko_history.
+    :return: The last row of every player.
+    """
+    return history.drop_duplicates('player_id', keep='last').reset_index(drop=True)
+
+
+def state_rows(states: pd.DataFrame) -> List[dict]:
+    """
+    :return: PlayerRatingState rows as plain python dicts.
+    """
+    rows = []
+    for state in states[STATE_COLUMNS].itertuples(index=False):
+        rows.append({
+            'player_id': int(state.player_id), 'rating': float(state.rating), 'deviation': float(state.deviation), 'vol': float(state.vol),
+            'last_game_id': int(state.last_game_id), 'last_game_time': pd.Timestamp(state.last_game_time).to_pydatetime(),
+        })
+    return rows
+
+
+def upsert_states(session: Session, states: pd.DataFrame) -> None:
+    """
+    Writes player states, keeping a stored state whose last game started later (a game that arrived late does not
+    replace the latest rating). Does not commit, so the states land in the same transaction as their PlayerGlicko rows.
+
+    :param session: An SQLAlchemy session object.
+    :param states: Columns of STATE_COLUMNS, one row per player.
+    :return: None
+    """
+    rows = state_rows(states)
+    table = PlayerRatingState.__table__
+    for start in range(0, len(rows), STATE_CHUNK_SIZE):
+        stmt = insert(table).values(rows[start:start + STATE_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['player_id'],
+            set_={column: stmt.excluded[column] for column in STATE_COLUMNS if column != 'player_id'},
+            where=(table.c.last_game_time == None) | (stmt.excluded.last_game_time >= table.c.last_game_time),
+        )
+        session.execute(stmt)
+
+
+def update_rating_state(session: Session, glicko_rows: List[dict]) -> None:
+    """
+    Moves the state of the players of newly written PlayerGlicko rows forward. Call before committing the rows.
+
+    :param session: An SQLAlchemy session object.
+    :param glicko_rows: The PlayerGlicko rows as dicts, in rating order.
+    :return: None
+    """
+    rows = pd.DataFrame(glicko_rows)
+    if len(rows.index) == 0:
+        return
+
+    rows = rows[rows['begin_at'].notna() & rows['player_id'].notna()]
+    rows = rows.rename(columns={'rating_post': 'rating', 'deviation_post': 'deviation', 'vol_post': 'vol', 'game_id': 'last_game_id', 'begin_at': 'last_game_time'})
+    rows = rows.assign(order=np.arange(len(rows.index))).sort_values(['player_id', 'last_game_time', 'order'], kind='mergesort')
+    upsert_states(session, latest_states(rows))
+
+
+def rebuild_rating_state(session: Session) -> int:
+    """
+    Rebuilds PlayerRatingState from the PlayerGlicko table and commits.
+
+    :param session: An SQLAlchemy session object.
+    :return: The number of players.
+    """
+    states = latest_states(glicko_history(session))
+
+    session.query(PlayerRatingState).delete(synchronize_session=False)
+    upsert_states(session, states)
+    session.commit()
+    return len(states.index)
+
+
+def ensure_rating_state(session: Session) -> None:
+    """
+    Builds PlayerRatingState once if PlayerGlicko has ratings the state was never filled with (eg the first run after an upgrade).
+
+    :param session: An SQLAlchemy session object.
+    :return: None
+    """
+    if session.query(PlayerRatingState.player_id).first() is None and session.query(PlayerGlicko.id).first() is not None:
+        rebuild_rating_state(session)
+
+
+def load_rating_state(session: Session, player_ids: List[int] = None) -> pd.DataFrame:
+    """
+    Reads the current rating of players.
+
+    :param session: An SQLAlchemy session object.
+    :param player_ids: Only these players. Default is every player.
+    :return: Columns of STATE_COLUMNS, players that were never rated are missing.
+    """
+    query = session.query(*[getattr(PlayerRatingState, column) for column in STATE_COLUMNS])
+    if player_ids is not None:
+        query = query.filter(PlayerRatingState.player_id.in_([int(player_id) for player_id in player_ids]))
+    return pd.read_sql(query.statement, session.bind)
+
+
+class RatingHistory():
+    """
+    Every player's ratings after each of their games in time order, so the rating as of a moment is a binary search.
+    """
+
+    def __init__(self, history: pd.DataFrame):
+        """
+        :param history: Rating rows ordered by player then time, see glicko_history.
+        """
+        self.game_ids = history['last_game_id'].to_numpy(dtype=np.int64)
+        self.ratings = history[['rating', 'deviation', 'vol']].to_numpy(dtype=np.float64)
+        self.index = AsOfIndex.from_rows(history['player_id'].to_numpy(dtype=np.int64), unix_seconds(history['last_game_time']) if len(history.index) > 0 else np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def load(cls, session: Session, player_ids: List[int] = None) -> 'RatingHistory':
+        """
+        Reads the history of players in one query.
+
+        :param session: An SQLAlchemy session object.
+        :param player_ids: Only these players. Default is every player.
+        """
+        return cls(glicko_history(session, player_ids))
+
+    def as_of(self, player_ids: List[int], before=None, inclusive: bool = False) -> np.ndarray:
+        """
+        The ratings of players as they were at a moment, eg before a game.
+
+        :param player_ids: The player of each lookup.
+        :param before: The moment of each lookup (one for all or one per player), anything pd.to_datetime accepts. Default is the latest rating.
+        :param inclusive: Also count games starting exactly at the moment. Default is games strictly before it.
+        :return: (players x 3) rating, rating deviation and volatility, the defaults for players without a game before the moment.
+        """
+        rows = self.index.rows_as_of(player_ids, before, inclusive)
+        ratings = np.tile([DEFAULT_RATING, DEFAULT_DEVIATION, DEFAULT_VOL], (len(rows), 1)).astype(np.float64)
+        ratings[rows >= 0] = self.ratings[rows[rows >= 0]]
+        return ratings
+
+
+if __name__ == "__main__":
+    #usage: python bo3_stats/rating_state.py
+    init_db()
+
+    session = Session()
+    print(f"Rebuilt the rating state of {rebuild_rating_state(session)} players")
+    session.close()
@@ -0,0 +1,302 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import re
+import numpy as np
+from sqlalchemy import Column, Float, Integer
+from typing import Dict, List, Tuple
+
+
+'''
+Single registry of the custom player stats.
+
+A stat is a ratio of two expressions over the per game sums of round counters, eg kpr = kills / rounds.
+Everything else is generated from STATS: the columnar aggregation in format_stats, the stat columns of
+CustomPlayerStatsGame and CustomStatsMA, the min round cutoff of the moving averages and the live feature lookups.
+
+Adding a stat is one StatDefinition below (plus a round counter if it needs a field that is not summed yet),
+then `python bo3_stats/format_stats.py --reformat` after the columns are added to the database.
+'''
+
+
+SIDES = {'': None, '_T': 'T', '_CT': 'CT'} #column suffix -> RoundPlayerStats.team_side (None is every round)
+ALL_SIDES = tuple(SIDES)
+GENERAL_ONLY = ('',)
+
+MIN_ROUNDS = 13 #games with fewer rounds (eg forfeits) are left out of moving averages and live features
+
+#RoundPlayerStats columns that are summed per (game, player), None counts as 0
+ROUND_FIELDS = [
+    'kills', 'death', 'assists', 'damage', 'first_kills', 'first_death', 'headshots', 'kast_score', 'win',
+    'multikills_2k', 'multikills_3k', 'multikills_4k', 'multikills_5k',
+    'clutches', 'clutch_attempts', 'clutches_1v1', 'clutches_1v2', 'clutches_1v3', 'clutches_1v4', 'clutches_1v5',
+    'trade_kills', 'traded_death', 'shots', 'hits', 'money_spent', 'money_save', 'flash_assists', 'grenades_damage',
+    'clutches_vs', 'clutch_attempts_vs', 'bomb_plants', 'bomb_plant_attempts', 'bomb_defuses', 'bomb_defuse_attempts',
+    'got_damage',
+]
+
+#RoundTeamStats columns of the player's own team round, as loaded by format_stats.load_rounds
+TEAM_ROUND_FIELDS = ['team_damage', 'equipment_value', 'enemy_equipment_value']
+
+
+def round_ei(fields: Dict[str, np.ndarray]) -> np.ndarray:
+    '''
+    Economic efficiency of every round: damage scaled by the enemy / own equipment value when both are known.
+
+    :param fields: Round fields as float arrays, NaN where the value is None.
+
+    :return: The ei of every round (np.ndarray).
+    '''
+    damage = np.nan_to_num(fields['damage'])
+    equipment_value = fields['equipment_value']
+    enemy_equipment_value = fields['enemy_equipment_value']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        has_equipment = ~np.isnan(enemy_equipment_value) & (equipment_value > 0)
+        return np.where(has_equipment, enemy_equipment_value / equipment_value * damage, damage)
+
+
+def round_mis(fields: Dict[str, np.ndarray]) -> np.ndarray:
+    '''
+    Multikill index score of every round: kills + kills^(sqrt(kills/5)) - 1.
+
+    :param fields: Round fields as float arrays, NaN where the value is None.
+
+    :return: The mis of every round (np.ndarray).
+    '''
+    kills = fields['kills']
+    with np.errstate(invalid='ignore'):
+        valid_kills = kills >= 0 #False for None
+        safe_kills = np.where(valid_kills, kills, 0)
+        return np.where(valid_kills, safe_kills + safe_kills**np.sqrt(safe_kills/5) - 1, 0)
+
+
+#Per round counters derived from several fields, summed per (game, player) like ROUND_FIELDS
+ROUND_COUNTERS = {
+    'rounds': lambda fields: np.ones(len(fields['kills'])),
+    'team_damage': lambda fields: np.nan_to_num(fields['team_damage']),
+    'ei': round_ei,
+    'mis': round_mis,
+}
+
+COUNTERS = ROUND_FIELDS + list(ROUND_COUNTERS)
+
+KERNEL_GLOBALS = {'__builtins__': {}, 'np': np}
+
+
+class StatDefinition():
+    '''
+    A custom player stat: numerator / denominator over the summed counters of a game (NaN, stored as None, where the
+    denominator is not positive or the condition does not hold).
+
+    The expressions are compiled once into a single kernel that is evaluated over whole arrays of games.
+    '''
+
+    def __init__(self, name: str, numerator: str, denominator: str, comment: str, sides: Tuple[str, ...] = ALL_SIDES,
+                 condition: str = None, min_rounds: int = MIN_ROUNDS, side_comment: str = None):
+        '''
+        :param name: The column name of the general stat, side columns add _T / _CT.
+        :param numerator: Expression over COUNTERS.
+        :param denominator: Expression over COUNTERS.
+        :param comment: The column comment.
+        :param sides: The column suffixes the stat is stored for (ALL_SIDES or GENERAL_ONLY).
+        :param condition: Extra expression over COUNTERS that must hold for the stat to be defined (optional).
+        :param min_rounds: Games with fewer rounds are left out of the stat's moving averages (optional).
+        :param side_comment: The comment of the side columns before the side, defaults to comment (optional).
+        '''
+        self.name = name
+        self.numerator = numerator
+        self.denominator = denominator
+        self.condition = condition
+        self.comment = comment
+        self.side_comment = side_comment or comment
+        self.sides = sides
+        self.min_rounds = min_rounds
+
+        source = f"({numerator}, {denominator}, {condition or 'True'})"
+        self.kernel = compile(source, f"<stat {name}>", 'eval')
+        self.counters = [counter for counter in self.kernel.co_names if counter != 'np']
+
+        unknown = set(self.counters) - set(COUNTERS)
+        if unknown:
+            raise ValueError(f"Stat {name} uses unknown counters {sorted(unknown)}")
+
+    def compute(self, counters: Dict[str, np.ndarray]) -> np.ndarray:
+        '''
+        Evaluate the stat over the summed counters of many games at once.
+
+        :param counters: Summed counters as float arrays of equal length.
+
+        :return: The stat of every game, NaN where it is undefined (np.ndarray).
+        '''
+        numerator, denominator, condition = eval(self.kernel, KERNEL_GLOBALS, {counter: counters[counter] for counter in self.counters})
+        numerator = np.asarray(numerator, dtype=np.float64)
+        denominator = np.asarray(denominator, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where((denominator > 0) & condition, numerator / denominator, np.nan)
+
+    def column_comment(self, suffix: str) -> str:
+        return self.comment if suffix == '' else f"{self.side_comment} ({SIDES[suffix]} side)"
+
+
+STATS = [
+    StatDefinition('kpr', 'kills', 'rounds', "Kill per round"),
+    StatDefinition('tdp', 'damage', 'team_damage', "% Share of team damage"),
+    StatDefinition('kdr', 'kills', 'death', "Kill Death Ratio"),
+    StatDefinition('spr', 'rounds - death', 'rounds', "Survival per round"),
+    StatDefinition('dpr', 'death', 'rounds', "Death per round"),
+    StatDefinition('adr', 'damage', 'rounds', "Average Damage per round"),
+    StatDefinition('apr', 'assists', 'rounds', "Assist per round"),
+    StatDefinition('fkr', 'first_kills', 'rounds', "First kills per round"),
+    StatDefinition('fdr', 'first_death', 'rounds', "First deaths per round"),
+    StatDefinition('odpr', 'first_death + first_kills', 'rounds', "Opening Duel per round"),
+    StatDefinition('odwr', 'first_kills', 'first_kills + first_death', "Opening Duel Win Rate"),
+    StatDefinition('hsp', 'headshots', 'kills', "Headshot Percentage"),
+    StatDefinition('kast', 'kast_score', 'rounds', "Average KAST per round"),
+    StatDefinition('rwpr', 'win', 'rounds', "Conversion [round win] per round"),
+    StatDefinition('kpr2', 'multikills_2k', 'rounds', "Average double kills per round"),
+    StatDefinition('kpr3', 'multikills_3k', 'rounds', "Average triple kills per round"),
+    StatDefinition('kpr4', 'multikills_4k', 'rounds', "Average quad kills per round"),
+    StatDefinition('kpr5', 'multikills_5k', 'rounds', "Average penta kills per round"),
+    StatDefinition('cr', 'clutches', 'clutch_attempts', "Clutch Rate", side_comment="Clutch rate (per attempt)"),
+    StatDefinition('wcr', 'clutches_1v1 + 2.25*clutches_1v2 + 3.375*clutches_1v3 + 5.0625*clutches_1v4 + 7.59375*clutches_1v5', 'clutch_attempts', "Weighted Clutch Rate"), #uses 1.5**num kills
+    StatDefinition('tkpr', 'trade_kills', 'rounds', "Trade kills per round"),
+    StatDefinition('tkr', 'trade_kills', 'kills', "Trade kills rate"),
+    StatDefinition('nkr', 'kills - trade_kills', 'kills', "normal kills rate", side_comment="Normal kills rate"),
+    StatDefinition('tddr', 'traded_death', 'death', "Traded death per death"),
+    StatDefinition('ei', 'ei', 'rounds', "Economic Efficiency"),
+    StatDefinition('mis', 'mis', 'rounds', "Multikill index score", side_comment="Multiplier for multikills"),
+    StatDefinition('ac', 'hits', 'shots', "Accuracy"),
+    StatDefinition('cpd', 'money_spent', 'damage', "Cost Per damage"),
+    StatDefinition('evspr', 'money_save', 'rounds', "Equipment Value Saved per Round"),
+    StatDefinition('evsos', 'money_save', 'money_spent', "Equipment Value Saved over spent"),
+    StatDefinition('bpk', 'shots', 'kills', "Bullets per Kill", condition='shots > 0'),
+    StatDefinition('fapr', 'flash_assists', 'rounds', "Flash Assists per Round"),
+    StatDefinition('udpr', 'grenades_damage', 'rounds', "Utility Damage per Round"),
+    StatDefinition('udpi', 'grenades_damage', 'money_spent', "Utility Damage per Investment"),
+    StatDefinition('cv', 'clutches_vs', 'clutch_attempts_vs', "clutches given up", side_comment="Lost Clutches per Attempt"),
+    StatDefinition('dtpr', 'got_damage', 'rounds', "Damage Taken per Round"),
+    StatDefinition('bppa', 'bomb_plants', 'bomb_plant_attempts', "Bomb Plants per Attempt", sides=GENERAL_ONLY),
+    StatDefinition('bdpa', 'bomb_defuses', 'bomb_defuse_attempts', "Bomb Defuse per Attempt", sides=GENERAL_ONLY),
+]
+
+#Side columns that lead their block in the existing tables, kept so create_all and datasets built from __table__.columns keep their layout
+SIDE_LEADING_COLUMNS = {'': [], '_T': ['kpr', 'kdr', 'tdp'], '_CT': ['kpr', 'kdr', 'spr', 'tdp']}
+
+
+def side_stats(suffix: str) -> List[StatDefinition]:
+    '''
+    The stats stored for a side, in column order.
+
+    :param suffix: '', '_T' or '_CT'.
+
+    :return: The stat definitions (List[StatDefinition]).
+    '''
+    stats = [stat for stat in STATS if suffix in stat.sides]
+    leading = [STATS_BY_NAME[name] for name in SIDE_LEADING_COLUMNS[suffix]]
+    return leading + [stat for stat in stats if stat not in leading]
+
+
+STATS_BY_NAME = {stat.name: stat for stat in STATS}
+
+#column name -> (stat, side suffix), in table column order
+STAT_COLUMNS = {stat.name + suffix: (stat, suffix) for suffix in SIDES for stat in side_stats(suffix)}
+
+
+def compute_stats(counters: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    '''
+    Compute every stat column from the summed counters of each side.
+
+    :param counters: Side suffix -> counter name -> summed counter of every game (float arrays of equal length).
+
+    :return: Column name -> stat of every game, NaN where undefined (Dict[str, np.ndarray]).
+    '''
+    return {column: stat.compute(counters[suffix]) for column, (stat, suffix) in STAT_COLUMNS.items()}
+
+
+def min_rounds(column: str) -> int:
+    '''
+    The min round cutoff of a stat column (value or _N column).
+
+    :param column: The column name, eg 'kdr_CT'.
+
+    :return: Games with fewer rounds are left out of the column's averages (int).
+    '''
+    stat, _ = STAT_COLUMNS[column[:-2] if column.endswith('_N') else column]
+    return stat.min_rounds
+
+
+def game_stat_columns() -> Dict[str, Column]:
+    '''
+    The stat columns of CustomPlayerStatsGame.
+
+    :return: Column name -> Column, in table order (Dict[str, Column]).
+    '''
+    return {column: Column(Float, comment=stat.column_comment(suffix)) for column, (stat, suffix) in STAT_COLUMNS.items()}
+
+
+def moving_average_columns() -> Dict[str, Column]:
+    '''
+    The stat columns of CustomStatsMA: every stat column, then its count of non NaN values in the window (_N).
+
+    :return: Column name -> Column, in table order (Dict[str, Column]).
+    '''
+    columns = game_stat_columns()
+    for column, (stat, suffix) in STAT_COLUMNS.items():
+        columns[column + '_N'] = Column(Integer, comment=f"{stat.column_comment(suffix)} (includes amount of non NaN values in period)")
+    return columns
+
+
+FEATURE_COMPONENT = re.compile(r'^(\d+|inf)_(\w+)$') #window_statcolumn, eg inf_kdr_CT
+FEATURE_PREFIXES = ['percent_diff_', 'delta_', 'ratio_', 'z_'] #features on one component of both teams
+FEATURE_SIDE_PREFIXES = ['OD_', 'DO_'] #features on the T and CT component of a stat
+
+
+def split_component(component: str) -> Tuple[str, str]:
+    '''
+    Split a feature component into its moving average window and stat column.
+
+    :param component: The component, eg '30_kdr' or 'inf_mis_T'.
+
+    :return: The window ('30', 'inf', ...) and the stat column (Tuple[str, str]).
+    '''
+    match = FEATURE_COMPONENT.match(component)
+    if match is None or match.group(2) not in STAT_COLUMNS:
+        raise ValueError(f"{component} is not a window_stat feature component")
+    return match.group(1), match.group(2)
+
+
+def feature_components(features: List[str]) -> List[str]:
+    '''
+    The window_stat averages a list of model features is built from.
+
+    :param features: Model feature names, eg ['A_glicko_win_prob', 'z_inf_kdr_CT', 'OD_inf_mis'].
+
+    :return: The sorted components, eg ['inf_kdr_CT', 'inf_mis_CT', 'inf_mis_T'] (List[str]).
+    '''
+    components = set()
+    for feature in features:
+        for prefix in FEATURE_PREFIXES:
+            if feature.startswith(prefix):
+                components.add(feature[len(prefix):])
+        for prefix in FEATURE_SIDE_PREFIXES:
+            if feature.startswith(prefix):
+                components.update([feature[len(prefix):] + '_T', feature[len(prefix):] + '_CT'])
+
+    for component in components:
+        split_component(component)
+    return sorted(components)
+
+
+def feature_stat_columns(features: List[str]) -> List[str]:
+    '''
+    The CustomPlayerStatsGame columns a list of model features needs.
+
+    :param features: Model feature names.
+
+    :return: The stat columns in table order (List[str]).
+    '''
+    needed = {split_component(component)[1] for component in feature_components(features)}
+    return [column for column in STAT_COLUMNS if column in needed]
@@ -6,6 +6,7 @@ sys.path.append(current_directory_str)
 
 from models.models import * 
 import numpy as np
+import pandas as pd
 from sqlalchemy import select, and_, text
 from typing import List, Dict, Union, Tuple
 from multiprocessing import Pool
@@ -13,166 +14,391 @@ from sqlalchemy.sql import exists, func
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.expression import case
 from scraper.constants import WINDOWS
+from bo3_stats.stat_definitions import STAT_COLUMNS, min_rounds
+from bo3_stats.format_stats import stats_rows
 from tqdm import tqdm
 
 
-def averages_player(player_id: int) -> None:
+STAT_COLUMN_NAMES = list(STAT_COLUMNS)
+MA_KEYS = ['game_id', 'player_id', 'num_rounds'] #CustomPlayerStatsGame columns copied to every CustomStatsMA row
+
+
+def window_size(window: Union[int, str]) -> Union[int, None]:
     """
-    Calculate moving averages for a player's stats and update the database.
+    Number of games in a moving average window.
 
+    :param Union[int, str] window: A window of WINDOWS, 'inf' for all history.
+    :return: The window size, None for 'inf'.
+    """
+    return None if str(window) == 'inf' else int(window)
+
+
+def stat_matrix(games: pd.DataFrame, columns: List[str] = STAT_COLUMN_NAMES) -> np.ndarray:
+    """
+    Build the (games x stats) matrix the moving averages run over, NaN where a stat is None or the game
+    has fewer rounds than the stat's cutoff.
+
+    :param pd.DataFrame games: A player's CustomPlayerStatsGame rows, ordered by game start.
+    :param List[str] columns: The stat columns.
+    :return: The stat values as floats.
+    """
+    values = games[columns].astype(object).astype(np.float64).to_numpy(copy=True)
+    num_rounds = games['num_rounds'].astype(object).astype(np.float64).to_numpy()
+    cutoffs = np.array([min_rounds(column) for column in columns], dtype=np.float64)
+
+    with np.errstate(invalid='ignore'):
+        excluded = ~(num_rounds[:, None] >= cutoffs[None, :]) #also excludes games with num_rounds None
+    values[excluded] = np.nan
+    return values
+
+
+def rolling_averages(values: np.ndarray, windows: List[Union[int, str]] = WINDOWS, starts: np.ndarray = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Moving averages of every stat over every window for all games of a player at once, ignoring NaN.
+
+    One cumulative sum of the values and of the non NaN counts, every window is the difference of two rows of it.
+
+    :param np.ndarray values: The (games x stats) matrix, see stat_matrix.
+    :param List[Union[int, str]] windows: The window sizes, 'inf' for all history.
+    :param np.ndarray starts: For several players stacked in values, the first row of each row's player. Default is one player.
+    :return: Window -> (averages, non NaN counts), both (games x stats). Averages are NaN where the count is 0.
+    """
+    valid = ~np.isnan(values)
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.vstack([zeros, np.cumsum(np.where(valid, values, 0), axis=0)])
+    counts = np.vstack([zeros, np.cumsum(valid, axis=0)]).astype(np.int64)
+
+    end = np.arange(1, len(values) + 1)
+    first = np.zeros_like(end) if starts is None else np.asarray(starts, dtype=end.dtype)
+    averages = {}
+    for window in windows:
+        size = window_size(window)
+        start = first if size is None else np.maximum(end - size, first)
+
+        window_sums = sums[end] - sums[start]
+        window_counts = counts[end] - counts[start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages[str(window)] = (np.where(window_counts > 0, window_sums / window_counts, np.nan), window_counts)
+    return averages
+
+
+class RollingState():
+    """
+    Running sums and counts of a player's stats for every window, so a new game is averaged in
+    O(windows x stats) without reading the player's history again.
+    """
+
+    def __init__(self, columns: List[str] = STAT_COLUMN_NAMES, windows: List[Union[int, str]] = WINDOWS):
+        self.columns = columns
+        self.windows = [str(window) for window in windows]
+        self.sizes = {str(window): window_size(window) for window in windows}
+        self.buffer_size = max([size for size in self.sizes.values() if size is not None], default=0)
+
+        self.recent = np.empty((0, len(columns))) #last buffer_size games, NaN where excluded
+        self.sums = {window: np.zeros(len(columns)) for window in self.windows}
+        self.counts = {window: np.zeros(len(columns), dtype=np.int64) for window in self.windows}
+
+    @classmethod
+    def from_history(cls, values: np.ndarray, columns: List[str] = STAT_COLUMN_NAMES, windows: List[Union[int, str]] = WINDOWS) -> 'RollingState':
+        """
+        Build the state after a player's history.
+
+        :param np.ndarray values: The (games x stats) matrix of the history, see stat_matrix.
+        :param List[str] columns: The stat columns of values.
+        :param List[Union[int, str]] windows: The window sizes.
+        :return: The state, ready to append the next game.
+        """
+        state = cls(columns, windows)
+        valid = ~np.isnan(values)
+        for window, size in state.sizes.items():
+            tail = values if size is None else values[len(values) - min(size, len(values)):]
+            tail_valid = valid if size is None else valid[len(valid) - len(tail):]
+            state.sums[window] = np.where(tail_valid, tail, 0).sum(axis=0)
+            state.counts[window] = tail_valid.sum(axis=0)
+        state.recent = values[len(values) - min(state.buffer_size, len(values)):].copy()
+        return state
+
+    def append(self, row: np.ndarray) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Add the next game of the player.
+
+        :param np.ndarray row: The game's stats (one row of stat_matrix).
+        :return: Window -> (averages, non NaN counts) including the new game.
+        """
+        row = np.asarray(row, dtype=np.float64)
+        valid = ~np.isnan(row)
+
+        averages = {}
+        for window, size in self.sizes.items():
+            self.sums[window] = self.sums[window] + np.where(valid, row, 0)
+            self.counts[window] = self.counts[window] + valid
+
+            if size is not None and len(self.recent) >= size: #the oldest game of the window drops out
+                leaving = self.recent[len(self.recent) - size]
+                leaving_valid = ~np.isnan(leaving)
+                self.sums[window] = self.sums[window] - np.where(leaving_valid, leaving, 0)
+                self.counts[window] = self.counts[window] - leaving_valid
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                averages[window] = (np.where(self.counts[window] > 0, self.sums[window] / self.counts[window], np.nan), self.counts[window].copy())
+
+        if self.buffer_size > 0:
+            self.recent = np.vstack([self.recent, row[None, :]])[-self.buffer_size:]
+        return averages
+
+
+def player_games(session: Session, player_id: int, processed: bool = None, limit: int = None) -> pd.DataFrame:
+    """
+    Load a player's CustomPlayerStatsGame rows ordered by game start, in one columnar query.
+
+    :param Session session: A SQLAlchemy session object.
     :param int player_id: The unique identifier of the player.
-    :return: None
+    :param bool processed: Only games that already have (True) or do not have yet (False) CustomStatsMA rows. Default is all games.
+    :param int limit: Only the latest limit games. Default is all games.
+    :return: One row per game with the MA_KEYS and every stat column.
     """
-    session = Session()
+    has_averages = exists().where(
+        (CustomStatsMA.game_id == CustomPlayerStatsGame.game_id) &
+        (CustomStatsMA.player_id == CustomPlayerStatsGame.player_id)
+    )
 
-    # Construct the query
-    subquery = aliased(CustomStatsMA)
-    result = (
-        session.query(CustomPlayerStatsGame)
-        .filter(CustomPlayerStatsGame.player_id == player_id)
+    query = (
+        session.query(*[getattr(CustomPlayerStatsGame, column) for column in MA_KEYS + STAT_COLUMN_NAMES], Games.begin_at)
         .join(Games, Games.id == CustomPlayerStatsGame.game_id)
-        .order_by(Games.begin_at.asc())
-        .all()
+        .filter(CustomPlayerStatsGame.player_id == player_id)
     )
 
+    if processed is not None:
+        query = query.filter(has_averages if processed else ~has_averages)
+
+    if limit is not None:
+        query = query.order_by(Games.begin_at.desc().nulls_first(), CustomPlayerStatsGame.game_id.desc()).limit(limit)
+        return pd.read_sql(query.statement, session.bind).iloc[::-1].reset_index(drop=True)
+
+    query = query.order_by(Games.begin_at.asc().nulls_last(), CustomPlayerStatsGame.game_id.asc())
+    return pd.read_sql(query.statement, session.bind)
+
+
+def game_order_key(begin_at, game_id: int) -> tuple:
+    """
+    Sort key of a game in a player's history (begin_at, then game id, games without a start last).
+    """
+    begin_at = None if pd.isna(begin_at) else pd.Timestamp(begin_at)
+    return (begin_at is None, begin_at or pd.Timestamp.min, game_id)
+
+
+def last_inf_average(session: Session, player_id: int) -> Union[CustomStatsMA, None]:
+    """
+    The 'inf' CustomStatsMA row of the latest processed game of a player.
+
+    :param Session session: A SQLAlchemy session object.
+    :param int player_id: The unique identifier of the player.
+    :return: The row (with its game's begin_at as begin_at), None if the player has no averages yet.
+    """
+    result = (
+        session.query(CustomStatsMA, Games.begin_at)
+        .join(Games, Games.id == CustomStatsMA.game_id)
+        .filter(CustomStatsMA.player_id == player_id, CustomStatsMA.ma == 'inf')
+        .order_by(Games.begin_at.desc().nulls_first(), CustomStatsMA.game_id.desc(), CustomStatsMA.id.desc())
+        .first()
+    )
+    if result is None:
+        return None
+
+    last, begin_at = result
+    last.begin_at = begin_at
+    return last
+
+
+def resume_state(session: Session, player_id: int, last: CustomStatsMA, windows: List[Union[int, str]] = WINDOWS) -> RollingState:
+    """
+    Rebuild a player's RollingState after their latest processed game without reading their whole history:
+    finite windows from the last processed games, the 'inf' window from the stored averages and counts of the last row.
+
+    :param Session session: A SQLAlchemy session object.
+    :param int player_id: The unique identifier of the player.
+    :param CustomStatsMA last: The player's latest 'inf' row, see last_inf_average.
+    :param List[Union[int, str]] windows: The window sizes.
+    :return: The state, ready to append the player's next game.
+    """
+    state = RollingState(STAT_COLUMN_NAMES, windows)
+    tail = player_games(session, player_id, processed=True, limit=state.buffer_size) if state.buffer_size > 0 else None
+    if tail is not None:
+        state = RollingState.from_history(stat_matrix(tail), STAT_COLUMN_NAMES, windows)
+
+    counts = np.array([getattr(last, column + '_N') or 0 for column in STAT_COLUMN_NAMES], dtype=np.int64)
+    means = np.array([getattr(last, column) if getattr(last, column) is not None else 0 for column in STAT_COLUMN_NAMES], dtype=np.float64)
+    for window, size in state.sizes.items():
+        if size is None:
+            state.sums[window] = np.where(counts > 0, means * counts, 0)
+            state.counts[window] = counts
+    return state
+
+
+def averages_player(player_id: int) -> None:
+    """
+    Recalculate moving averages for a player's whole history, replacing any averages already stored.
+
+    :param int player_id: The unique identifier of the player.
+    :return: None
+    """
+    session = Session()
+
+    games = player_games(session, player_id)
 
     # Check if no games are found
-    if not result:
+    if len(games.index) == 0:
+        session.close()
         return
 
-    # Convert the result to a list of dictionaries for easier processing
-    games_data = [{column: getattr(row, column) for column in row.__table__.columns.keys()} for row in result]
-
-    moving_averages(games_data, session)
+    session.query(CustomStatsMA).filter(CustomStatsMA.player_id == player_id).delete(synchronize_session=False)
+    moving_averages(games, session)
 
     session.close()
 
 
-def moving_averages(data: List[Dict[str, Union[int, float, None]]], session: Session, windows: List[Union[int, str]] = WINDOWS) -> None:
+def update_player_averages(player_id: int, windows: List[Union[int, str]] = WINDOWS) -> int:
     """
-    Calculate moving averages over specified window sizes for player's game data and update the database.
+    Add moving averages for the games of a player that have none yet, resuming from the last stored CustomStatsMA row.
+    Runs in O(new games). If a new game started before the latest processed one, the player's history is recalculated.
 
-    :param List[Dict[str, Union[int, float, None]]] data: A list of dictionaries where each dictionary contains player's game stats.
-    :param Session session: A SQLAlchemy session object to interact with the database.
-    :param List[Union[int, str]] windows: A list of window sizes for which to calculate moving averages. 'inf' can be used for infinite window size.
-    :return: None
+    :param int player_id: The unique identifier of the player.
+    :param List[Union[int, str]] windows: The window sizes.
+    :return: The number of games added.
+    """
+    session = Session()
+    try:
+        new_games = player_games(session, player_id, processed=False)
+        if len(new_games.index) == 0:
+            return 0
+
+        last = last_inf_average(session, player_id)
+        if last is not None:
+            last_key = game_order_key(last.begin_at, last.game_id)
+            if any(game_order_key(begin_at, game_id) < last_key for begin_at, game_id in zip(new_games['begin_at'], new_games['game_id'])):
+                session.close()
+                averages_player(player_id) #a game arrived out of order
+                return len(new_games.index)
+
+        state = resume_state(session, player_id, last, windows) if last is not None else RollingState(STAT_COLUMN_NAMES, windows)
+
+        appended = {window: ([], []) for window in state.windows}
+        for row in stat_matrix(new_games):
+            for window, (means, counts) in state.append(row).items():
+                appended[window][0].append(means)
+                appended[window][1].append(counts)
+
+        averages = {window: (np.vstack(means), np.vstack(counts)) for window, (means, counts) in appended.items()}
+        session.bulk_insert_mappings(CustomStatsMA, moving_average_rows(new_games, averages))
+        session.commit()
+        return len(new_games.index)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def update_averages(player_ids: List[int]) -> int:
+    """
+    Add the missing moving averages of a few players in process, eg right after their match finished.
+
+    :param List[int] player_ids: The players to update.
+    :return: The number of games added.
     """
-    exclude_keys = {'id', 'game_id', 'player_id', 'num_rounds'}
-    windows = list(windows) 
-    
-    # Iterate over each dictionary in the input data
-    for i in range(len(data)): #each game
-
-        # Iterate over each window size
-        for window in windows:
-
-            # Initialize dictionaries to store moving averages and non-NaN counts
-            results = {key: [] for key in data[0] if key not in exclude_keys}
-
-            # Calculate moving average for each key
-            for key in results:
-                # Handle infinite window size as a special case
-                if window == 'inf':
-                    values = [d[key] for d in data[:i+1] if d[key] is not None and d['num_rounds'] > 12]
-                else:
-                    values = [d[key] for d in data[max(0, i-int(window)+1):i+1] if d[key] is not None and d['num_rounds'] > 12]
-                
-                # Calculate the moving average and non-NaN count
-                if values:
-                    mean_val = np.mean(values)
-                    non_nan_count = len(values)
-                    results[key].append((mean_val, non_nan_count))
-                else:
-                    results[key].append((None, 0))
-
-            for ex_key in exclude_keys:
-                if ex_key == "id":
-                    continue
-                results[ex_key] = data[i][ex_key]
-            
-            add_data_to_custom_stats_ma(results, session, str(window))
-
-
-def add_data_to_custom_stats_ma(data_dict: Dict[str, Union[List[Tuple[Union[int, float, None], int]], Union[int, float, str, None]]], session: Session, window: str) -> None:
-    """
-    Add player's game stats and moving averages to the CustomStatsMA table in the database.
-
-    :param Dict[str, Union[List[Tuple[Union[int, float, None], int]], Union[int, float, str, None]]] data_dict: 
-        A dictionary containing player's game stats and moving averages. The values can be a list of tuples (for moving averages and counts) 
-        or single values (for other game stats).
+    return sum(update_player_averages(player_id) for player_id in player_ids)
+
+
+def moving_average_rows(games: pd.DataFrame, averages: Dict[str, Tuple[np.ndarray, np.ndarray]], columns: List[str] = STAT_COLUMN_NAMES) -> List[dict]:
+    """
+    Turn moving averages into CustomStatsMA rows, one per game and window (game major, like the table was always filled).
+
+    :param pd.DataFrame games: The games the averages were computed for (MA_KEYS columns).
+    :param Dict[str, Tuple[np.ndarray, np.ndarray]] averages: Window -> (averages, counts), see rolling_averages.
+    :param List[str] columns: The stat columns of the averages.
+    :return: The rows as dicts (NaN averages become None).
+    """
+    count_columns = [column + '_N' for column in columns]
+    game_order = np.arange(len(games.index))
+
+    frames = []
+    for order, (window, (means, counts)) in enumerate(averages.items()):
+        frame = {key: games[key].to_numpy() for key in MA_KEYS}
+        frame['ma'] = window
+        frame.update(zip(columns, means.T))
+        frame.update(zip(count_columns, counts.T))
+        frame['game_order'] = game_order
+        frame['window_order'] = order
+        frames.append(pd.DataFrame(frame))
+
+    rows = pd.concat(frames, ignore_index=True).sort_values(['game_order', 'window_order'], kind='mergesort')
+    return stats_rows(rows.drop(columns=['game_order', 'window_order']))
+
+
+def moving_averages(games: pd.DataFrame, session: Session, windows: List[Union[int, str]] = WINDOWS) -> None:
+    """
+    Calculate moving averages over specified window sizes for player's game data and bulk write them to the database.
+
+    :param pd.DataFrame games: A player's CustomPlayerStatsGame rows ordered by game start, see player_games.
     :param Session session: A SQLAlchemy session object to interact with the database.
-    :param str window: A string representing the window size for moving averages.
+    :param List[Union[int, str]] windows: A list of window sizes for which to calculate moving averages. 'inf' can be used for infinite window size.
     :return: None
     """
-    # Preparing the data for creating an instance of CustomStatsMA
-    prepared_data = {'ma': window}
-
-    for key, value in data_dict.items():
-        if isinstance(value, list) and len(value) == 1 and len(value[0]) == 2:
-            prepared_data[key] = value[0][0]
-            prepared_data[key + '_N'] = value[0][1]
-        else:
-            prepared_data[key] = value
-
-    # Creating an instance of CustomStatsMA
-    custom_stats_ma_instance = CustomStatsMA(**prepared_data)
-    
-    # Adding and committing the instance to the database
-    session.add(custom_stats_ma_instance)
+    averages = rolling_averages(stat_matrix(games), windows)
+
+    session.bulk_insert_mappings(CustomStatsMA, moving_average_rows(games, averages))
     session.commit()
 
 
-def calculate_averages(args: List[int], num_processes: int) -> None:
+def calculate_averages(args: List[int], num_processes: int, chunksize: int = 10) -> None:
     """
-    Calculate moving averages for multiple players in parallel.
+    Add the missing moving averages of multiple players in parallel.
 
     :param List[int] args: A list of player IDs for whom to calculate moving averages.
     :param int num_processes: The number of parallel processes to use for calculation.
+    :param int chunksize: The number of players handed to a process at a time.
     :return: None
     """
     with Pool(processes=num_processes) as pool:
-        pool.map(averages_player, [player_id for player_id in args])
+        for _ in tqdm(pool.imap_unordered(update_player_averages, args, chunksize=chunksize), total=len(args), desc="Processing"):
+            pass
 
 
-def calculate_all_averages(window: int = 10, num_processes: int = 8) -> None:
+def players_with_new_games(session: Session) -> List[int]:
     """
-    Calculate moving averages for all players in the database, processing them in chunks.
+    Find the players that have CustomPlayerStatsGame rows without moving averages.
 
-    :param int window: The number of players to process in each chunk. Default is 100.
-    :param int num_processes: The number of parallel processes to use for calculations. Default is 8.
-    :return: None
+    :param Session session: A SQLAlchemy session object.
+    :return: The player IDs.
     """
-    session = Session()
-    subquery = aliased(CustomStatsMA)
     result = (
-        session.query(
-            CustomPlayerStatsGame.player_id,
-            Games.begin_at,
-            func.array_agg(CustomPlayerStatsGame.game_id).over(
-                partition_by=CustomPlayerStatsGame.player_id,
-                order_by=Games.begin_at.asc()
-            ).label('game_ids_ordered')
-        )
-        .join(Games, Games.id == CustomPlayerStatsGame.game_id)
+        session.query(CustomPlayerStatsGame.player_id)
+        .filter(CustomPlayerStatsGame.player_id != None)
         .filter(~exists().where(
-            (subquery.game_id == CustomPlayerStatsGame.game_id) &
-            (subquery.player_id == CustomPlayerStatsGame.player_id)
+            (CustomStatsMA.game_id == CustomPlayerStatsGame.game_id) &
+            (CustomStatsMA.player_id == CustomPlayerStatsGame.player_id)
         ))
-        .order_by(CustomPlayerStatsGame.player_id, Games.begin_at.asc())
+        .distinct()
         .all()
     )
-    player_ids = list(set([player_id for player_id, date, games in result]))
+    return [player_id for (player_id,) in result]
+
+
+def calculate_all_averages(window: int = 10, num_processes: int = 8) -> None:
+    """
+    Add the missing moving averages of all players in the database. Only games without averages are processed.
+
+    :param int window: The number of players handed to a process at a time. Default is 10.
+    :param int num_processes: The number of parallel processes to use for calculations. Default is 8.
+    :return: None
+    """
+    session = Session()
+    player_ids = players_with_new_games(session)
     session.close()
 
-    to_process = len(player_ids)
+    print(f"Need to process {len(player_ids)} instances.")
 
-    print(f"Need to process {to_process} instances.")
-    
-    for i in tqdm(range(0, to_process, window), desc="Processing"):
-        if (i+window) < to_process:
-            calculate_averages(player_ids[i:i+window], num_processes)
-        else:
-            calculate_averages(player_ids[i:to_process], num_processes)
+    calculate_averages(player_ids, num_processes, window)
 
 
 def weighted_mean(stats: np.ndarray, Ns: np.ndarray) -> float:
@@ -275,11 +501,3 @@ if __name__ == "__main__":
     session.close()''' #CODE FOR DELETING TABLE OF STATS
 
     calculate_all_averages()
-
-
-    '''
-    TODO this file is broken live
-
-    Worked for creating dataset but when live trading i will likely calculate necessary values at run time
-    
-    '''
\ No newline at end of file
@@ -0,0 +1,355 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+import hashlib
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from typing import Dict, List, Tuple, Union
+from scraper.bulk_writer import MAX_PARAMS
+from scraper.constants import WINDOWS
+from bo3_stats.stats_over_time import STAT_COLUMN_NAMES, RollingState, stat_matrix
+
+
+SUMMARY_COLUMNS = ['player_id', 'max_stats_id', 'num_games', 'last_game_id', 'last_game_time', 'layout', 'sums', 'counts']
+SUMMARY_CHUNK_SIZE = MAX_PARAMS // len(SUMMARY_COLUMNS) #rows per upsert statement
+PLAYERS_PER_BATCH = 1000 #players loaded and summarized together
+
+
+def layout_key(windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> str:
+    """
+    Identifies the windows and stat columns a summary was written with, so summaries are rebuilt when either changes.
+    """
+    layout = "|".join([",".join(str(window) for window in windows), ",".join(columns)])
+    return hashlib.sha1(layout.encode()).hexdigest()[:16]
+
+
+class TailSummary():
+    """
+    A player's running sums and non NaN counts of every stat over every window, after their latest game.
+    The moving averages of any window and stat are one division, and the summary moves forward with new games
+    without reading the player's whole history (see update_tail_summaries).
+    """
+
+    def __init__(self, player_id: int, max_stats_id: int, num_games: int, last_game_id: int, last_game_time, sums: np.ndarray, counts: np.ndarray):
+        """
+        :param int player_id: The player.
+        :param int max_stats_id: Highest CustomPlayerStatsGame id summed in.
+        :param int num_games: Number of games summed in.
+        :param int last_game_id: The player's latest game.
+        :param last_game_time: begin_at of the latest game.
+        :param np.ndarray sums: (windows x stats) sums of the non NaN values.
+        :param np.ndarray counts: (windows x stats) non NaN counts.
+        """
+        self.player_id = player_id
+        self.max_stats_id = max_stats_id
+        self.num_games = num_games
+        self.last_game_id = last_game_id
+        self.last_game_time = last_game_time
+        self.sums = sums
+        self.counts = counts
+
+    @classmethod
+    def from_games(cls, player_id: int, games: pd.DataFrame, windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> 'TailSummary':
+        """
+        Summarizes a player's history.
+
+        :param int player_id: The player.
+        :param pd.DataFrame games: The player's games in time order, see load_games.
+        :param List[Union[int, str]] windows: The window sizes.
+        :param List[str] columns: The stat columns.
+        :return: The summary.
+        """
+        state = RollingState.from_history(stat_matrix(games, columns), columns, windows)
+        last = games.iloc[-1] if len(games.index) > 0 else None
+        return cls(
+            player_id,
+            int(games['id'].max()) if last is not None else -1,
+            len(games.index),
+            int(last['game_id']) if last is not None else None,
+            last['begin_at'] if last is not None else None,
+            np.vstack([state.sums[window] for window in state.windows]),
+            np.vstack([state.counts[window] for window in state.windows]),
+        )
+
+    @classmethod
+    def from_row(cls, row, windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> 'TailSummary':
+        """
+        :param row: A PlayerTailSummary row written with the same layout.
+        """
+        shape = (len(windows), len(columns))
+        return cls(
+            row.player_id, row.max_stats_id, row.num_games, row.last_game_id, row.last_game_time,
+            np.frombuffer(row.sums, dtype='<f8').reshape(shape).copy(),
+            np.frombuffer(row.counts, dtype='<i4').reshape(shape).astype(np.int64),
+        )
+
+    def to_row(self, layout: str) -> dict:
+        """
+        :return: The PlayerTailSummary row as a plain python dict.
+        """
+        return {
+            'player_id': int(self.player_id), 'max_stats_id': int(self.max_stats_id), 'num_games': int(self.num_games),
+            'last_game_id': int(self.last_game_id), 'last_game_time': pd.Timestamp(self.last_game_time).to_pydatetime(), 'layout': layout,
+            'sums': np.ascontiguousarray(self.sums, dtype='<f8').tobytes(),
+            'counts': np.ascontiguousarray(self.counts, dtype='<i4').tobytes(),
+        }
+
+    def add_games(self, new_games: pd.DataFrame, tail: pd.DataFrame, windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> None:
+        """
+        Moves the summary forward with games not summed in yet. The 'inf' window adds the new games to the stored sums,
+        the finite windows are summed again from the player's latest games (which already include the new ones),
+        so a new game that started before the latest summarized one is placed correctly too.
+
+        :param pd.DataFrame new_games: The games not summed in yet, see load_games.
+        :param pd.DataFrame tail: The player's latest max(finite windows) games in time order, see load_games.
+        :param List[Union[int, str]] windows: The window sizes.
+        :param List[str] columns: The stat columns.
+        :return: None
+        """
+        latest = TailSummary.from_games(self.player_id, tail, windows, columns)
+        values = stat_matrix(new_games, columns)
+        valid = ~np.isnan(values)
+
+        for position, window in enumerate(windows):
+            if str(window) == 'inf':
+                self.sums[position] = self.sums[position] + np.where(valid, values, 0).sum(axis=0)
+                self.counts[position] = self.counts[position] + valid.sum(axis=0)
+            else:
+                self.sums[position] = latest.sums[position]
+                self.counts[position] = latest.counts[position]
+
+        self.max_stats_id = max(self.max_stats_id, int(new_games['id'].max()))
+        self.num_games += len(new_games.index)
+        self.last_game_id = latest.last_game_id
+        self.last_game_time = latest.last_game_time
+
+
+def load_games(session: Session, player_ids: List[int], after_summary: bool = False, last: int = None, columns: List[str] = STAT_COLUMN_NAMES) -> pd.DataFrame:
+    """
+    Loads CustomPlayerStatsGame rows of players with a game start in one query, ordered by player, begin_at and game id
+    (the order of the moving averages).
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[int] player_ids: The players.
+    :param bool after_summary: Only rows not summed into the player's PlayerTailSummary yet (all rows of players without one).
+    :param int last: Only the latest last games of each player. Default is all games.
+    :param List[str] columns: The stat columns to load.
+    :return: One row per player and game with id, player_id, game_id, begin_at, num_rounds and the stat columns.
+    """
+    query = session.query(
+            CustomPlayerStatsGame.id, CustomPlayerStatsGame.player_id, CustomPlayerStatsGame.game_id, Games.begin_at, CustomPlayerStatsGame.num_rounds,
+            *[getattr(CustomPlayerStatsGame, column) for column in columns])\
+        .join(Games, Games.id == CustomPlayerStatsGame.game_id)\
+        .filter(CustomPlayerStatsGame.player_id.in_([int(player_id) for player_id in player_ids]), Games.begin_at != None)
+
+    if after_summary:
+        query = query.outerjoin(PlayerTailSummary, PlayerTailSummary.player_id == CustomPlayerStatsGame.player_id)\
+            .filter(CustomPlayerStatsGame.id > func.coalesce(PlayerTailSummary.max_stats_id, -1))
+
+    if last is not None:
+        ranked = query.add_columns(
+            func.row_number().over(
+                partition_by=CustomPlayerStatsGame.player_id,
+                order_by=(Games.begin_at.desc(), CustomPlayerStatsGame.game_id.desc())).label('recency'))\
+            .subquery()
+        query = session.query(*[ranked.c[column] for column in ['id', 'player_id', 'game_id', 'begin_at', 'num_rounds'] + columns])\
+            .filter(ranked.c.recency <= last)
+
+    games = pd.read_sql(query.statement, session.bind)
+    return games.sort_values(['player_id', 'begin_at', 'game_id'], kind='mergesort').reset_index(drop=True)
+
+
+def stats_fingerprints(session: Session, player_ids: List[int] = None) -> pd.DataFrame:
+    """
+    The highest CustomPlayerStatsGame id and the number of games with a start of players, in one grouped query.
+    A summary is current when both match.
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[int] player_ids: Only these players. Default is every player.
+    :return: Columns player_id, max_stats_id and num_games, one row per player with games.
+    """
+    query = session.query(
+            CustomPlayerStatsGame.player_id,
+            func.max(CustomPlayerStatsGame.id).label('max_stats_id'),
+            func.count(CustomPlayerStatsGame.id).label('num_games'))\
+        .join(Games, Games.id == CustomPlayerStatsGame.game_id)\
+        .filter(CustomPlayerStatsGame.player_id != None, Games.begin_at != None)\
+        .group_by(CustomPlayerStatsGame.player_id)
+
+    if player_ids is not None:
+        query = query.filter(CustomPlayerStatsGame.player_id.in_([int(player_id) for player_id in player_ids]))
+
+    return pd.read_sql(query.statement, session.bind)
+
+
+def load_tail_summaries(session: Session, player_ids: List[int] = None, windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> Dict[int, TailSummary]:
+    """
+    Reads the summaries of players in one query. Summaries written with other windows or stat columns are left out.
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[int] player_ids: Only these players. Default is every player.
+    :return: Player ID -> summary.
+    """
+    query = session.query(PlayerTailSummary).filter(PlayerTailSummary.layout == layout_key(windows, columns))
+    if player_ids is not None:
+        query = query.filter(PlayerTailSummary.player_id.in_([int(player_id) for player_id in set(player_ids)]))
+    return {row.player_id: TailSummary.from_row(row, windows, columns) for row in query.all()}
+
+
+def current_tail_summaries(session: Session, player_ids: List[int], windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> Tuple[List[Union[TailSummary, None]], np.ndarray]:
+    """
+    Reads the summaries of players and checks them against the players' games, in two queries.
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[int] player_ids: The players (may repeat).
+    :return: The summary of each player (None if there is none) and whether it covers every game of the player
+             (also true for players without games and summary).
+    """
+    summaries = load_tail_summaries(session, player_ids, windows, columns)
+    fingerprints = stats_fingerprints(session, list(set(player_ids))).set_index('player_id')
+    fingerprints = dict(zip(fingerprints.index, fingerprints[['max_stats_id', 'num_games']].itertuples(index=False, name=None)))
+
+    current = np.array([
+        (summaries[player_id].max_stats_id, summaries[player_id].num_games) == fingerprints.get(player_id) if player_id in summaries else player_id not in fingerprints
+        for player_id in player_ids
+    ], dtype=bool)
+    return [summaries.get(player_id) for player_id in player_ids], current
+
+
+def upsert_summaries(session: Session, summaries: List[TailSummary], layout: str) -> None:
+    """
+    Writes summaries, replacing stored ones. Does not commit.
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[TailSummary] summaries: The summaries.
+    :param str layout: Their layout_key.
+    :return: None
+    """
+    rows = [summary.to_row(layout) for summary in summaries]
+    table = PlayerTailSummary.__table__
+    for start in range(0, len(rows), SUMMARY_CHUNK_SIZE):
+        stmt = insert(table).values(rows[start:start + SUMMARY_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['player_id'],
+            set_={column: stmt.excluded[column] for column in SUMMARY_COLUMNS if column != 'player_id'},
+        )
+        session.execute(stmt)
+
+
+def update_tail_summaries(session: Session, player_ids: List[int] = None, windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> int:
+    """
+    Brings PlayerTailSummary up to date with CustomPlayerStatsGame and commits, eg right after new games were formatted.
+    A summary with new games is moved forward from its stored sums, the new games and the player's latest games.
+    A player without a summary, or whose games were replaced or deleted since it was written, is summarized from their whole history.
+
+    :param Session session: A SQLAlchemy session object.
+    :param List[int] player_ids: Only these players. Default is every player.
+    :param List[Union[int, str]] windows: The window sizes.
+    :param List[str] columns: The stat columns.
+    :return: The number of summaries written.
+    """
+    layout = layout_key(windows, columns)
+    tail_size = max([int(window) for window in windows if str(window) != 'inf'], default=0)
+
+    fingerprints = stats_fingerprints(session, player_ids).set_index('player_id')
+    summaries = load_tail_summaries(session, player_ids, windows, columns)
+
+    changed = [
+        player_id for player_id, (max_stats_id, num_games) in zip(fingerprints.index, fingerprints[['max_stats_id', 'num_games']].itertuples(index=False))
+        if player_id not in summaries or (summaries[player_id].max_stats_id, summaries[player_id].num_games) != (max_stats_id, num_games)
+    ]
+
+    # Summaries of players without games any more
+    stored = session.query(PlayerTailSummary.player_id)
+    if player_ids is not None:
+        stored = stored.filter(PlayerTailSummary.player_id.in_([int(player_id) for player_id in player_ids]))
+    gone = [player_id for (player_id,) in stored.all() if player_id not in fingerprints.index]
+    if len(gone) > 0:
+        session.query(PlayerTailSummary).filter(PlayerTailSummary.player_id.in_(gone)).delete(synchronize_session=False)
+
+    written = 0
+    for start in range(0, len(changed), PLAYERS_PER_BATCH):
+        batch = changed[start:start + PLAYERS_PER_BATCH]
+        summarized = [player_id for player_id in batch if player_id in summaries]
+        new_games = dict(list(load_games(session, summarized, after_summary=True, columns=columns).groupby('player_id', sort=False))) if summarized else {}
+
+        # Summaries that only miss new games move forward, the others (eg games were reformatted) are summarized again
+        incremental = {
+            player_id for player_id in summarized
+            if player_id in new_games and summaries[player_id].num_games + len(new_games[player_id].index) == fingerprints.at[player_id, 'num_games']
+        }
+        rebuild = [player_id for player_id in batch if player_id not in incremental]
+
+        tails = dict(list(load_games(session, list(incremental), last=tail_size, columns=columns).groupby('player_id', sort=False))) if incremental else {}
+        histories = dict(list(load_games(session, rebuild, columns=columns).groupby('player_id', sort=False))) if rebuild else {}
+
+        updated = []
+        for player_id in batch:
+            if player_id in incremental:
+                summary = summaries[player_id]
+                summary.add_games(new_games[player_id], tails[player_id], windows, columns)
+            else:
+                summary = TailSummary.from_games(player_id, histories[player_id], windows, columns)
+            updated.append(summary)
+
+        upsert_summaries(session, updated, layout)
+        written += len(updated)
+
+    session.commit()
+    return written
+
+
+def rebuild_tail_summaries(session: Session) -> int:
+    """
+    Deletes every summary and summarizes every player's history again, eg after the windows or stat columns changed.
+
+    :param Session session: A SQLAlchemy session object.
+    :return: The number of summaries written.
+    """
+    session.query(PlayerTailSummary).delete(synchronize_session=False)
+    session.commit()
+    return update_tail_summaries(session)
+
+
+def tail_averages(summaries: List[Union[TailSummary, None]], components: List[Tuple[str, str]], windows: List[Union[int, str]] = WINDOWS, columns: List[str] = STAT_COLUMN_NAMES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads moving averages of many players from their summaries with one gather and one division.
+
+    :param List[Union[TailSummary, None]] summaries: One summary per player, None for players without games.
+    :param List[Tuple[str, str]] components: (window, stat column) pairs, eg [('30', 'dpr'), ('inf', 'kdr_CT')].
+    :param List[Union[int, str]] windows: The windows of the summaries.
+    :param List[str] columns: The stat columns of the summaries.
+    :return: (averages, counts), both (players x components). NaN and 0 where there are no games.
+    """
+    window_index = {str(window): position for position, window in enumerate(windows)}
+    column_index = {column: position for position, column in enumerate(columns)}
+    rows = np.array([window_index[str(window)] for window, _ in components], dtype=np.int64)
+    cols = np.array([column_index[column] for _, column in components], dtype=np.int64)
+
+    sums = np.zeros((len(summaries), len(components)))
+    counts = np.zeros((len(summaries), len(components)), dtype=np.int64)
+    present = [position for position, summary in enumerate(summaries) if summary is not None]
+    if len(present) > 0:
+        sums[present] = np.stack([summaries[position].sums for position in present])[:, rows, cols]
+        counts[present] = np.stack([summaries[position].counts for position in present])[:, rows, cols]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan), counts
+
+
+if __name__ == "__main__":
+    #usage: python bo3_stats/tail_summary.py [--rebuild]
+    init_db()
+
+    session = Session()
+    if "--rebuild" in sys.argv:
+        print(f"Rebuilt {rebuild_tail_summaries(session)} tail summaries")
+    else:
+        print(f"Updated {update_tail_summaries(session)} tail summaries")
+    session.close()
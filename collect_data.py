@@ -14,6 +14,10 @@ def collect_data():
     subprocess.run(['python', current_directory_str + '/bo3_stats/format_stats.py']) #format stats into features and store in db
     log("Player Stats updated.")
 
+    log("Updating Player Tail Summaries")
+    subprocess.run(['python', current_directory_str + '/bo3_stats/tail_summary.py']) #move the live moving averages forward with the new games
+    log("Tail summaries updated.")
+
     log("Updating Player Glicko")
     subprocess.run(['python', current_directory_str + '/bo3_stats/glicko.py']) #update glicko ratings
     log("Glicko ratings updated.")
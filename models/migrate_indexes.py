@@ -0,0 +1,204 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+from sqlalchemy import desc, inspect, or_, text
+from sqlalchemy.engine import Engine
+from datetime import datetime
+import statistics
+from typing import Callable, Dict, List
+
+
+BENCHMARK_RUNS = 5 #EXPLAIN ANALYZE runs per query, the median is reported
+
+
+def declared_indexes() -> List[Index]:
+    """
+    Collects the secondary indexes declared in __table_args__ of every model.
+
+    :return: The declared indexes (List[Index]).
+    """
+    return [index for table in Base.metadata.sorted_tables for index in sorted(table.indexes, key=lambda index: index.name)]
+
+
+def index_ddl(engine: Engine, index: Index) -> str:
+    """
+    Builds the CREATE INDEX CONCURRENTLY statement of a declared index.
+
+    :param engine: The SQLAlchemy engine (Engine).
+    :param index: The declared index (Index).
+
+    :return: The DDL statement (str).
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    columns = ", ".join(quote(column.name) for column in index.columns)
+    return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(index.name)} ON {quote(index.table.name)} ({columns})"
+
+
+def invalid_indexes(connection) -> set:
+    """
+    Finds indexes left invalid by an interrupted CREATE INDEX CONCURRENTLY. They exist but are never used by the planner.
+
+    :param connection: An autocommit connection.
+
+    :return: The names of the invalid indexes (set).
+    """
+    rows = connection.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    ))
+    return {row[0] for row in rows}
+
+
+def migrate_indexes(engine: Engine = engine) -> List[str]:
+    """
+    Builds every declared index that is missing on an existing database without locking out writes.
+
+    CREATE INDEX CONCURRENTLY cannot run inside a transaction, so the statements run on an autocommit connection,
+    one index at a time. Invalid leftovers of an interrupted build are dropped and rebuilt.
+
+    :param engine: The SQLAlchemy engine (Engine, optional).
+
+    :return: The names of the indexes that were built (List[str]).
+    """
+    built = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        inspector = inspect(connection)
+        invalid = invalid_indexes(connection)
+
+        for index in declared_indexes():
+            if not inspector.has_table(index.table.name):
+                continue #create_all builds the indexes of new tables
+
+            existing = {existing_index['name'] for existing_index in inspector.get_indexes(index.table.name)}
+            if index.name in existing and index.name not in invalid:
+                continue
+
+            if index.name in invalid:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {engine.dialect.identifier_preparer.quote(index.name)}"))
+
+            print(f"Building {index.name} on {index.table.name}")
+            connection.execute(text(index_ddl(engine, index)))
+            built.append(index.name)
+
+        for table in {index.table.name for index in declared_indexes() if index.name in built}:
+            connection.execute(text(f"ANALYZE {engine.dialect.identifier_preparer.quote(table)}"))
+
+    return built
+
+
+def sample_parameters(session: Session) -> dict:
+    """
+    Picks real ids from the database to benchmark with: the latest game that has per round player stats and one of its players.
+
+    :param session: An SQLAlchemy session object.
+
+    :return: A dict with keys game_id, player_id, team_id, player_slug and begin_at.
+    """
+    row = session.query(RoundPlayerStats.game_id, RoundPlayerStats.player_id, RoundPlayerStats.team_id)\
+        .order_by(desc(RoundPlayerStats.id))\
+        .first()
+
+    if row is None:
+        return {'game_id': -1, 'player_id': -1, 'team_id': -1, 'player_slug': '', 'begin_at': datetime(2012, 1, 1)}
+
+    player = session.query(Players).filter(Players.id == row.player_id).first()
+    begin_at = session.query(Games.begin_at).filter(Games.id == row.game_id).scalar()
+
+    return {
+        'game_id': row.game_id,
+        'player_id': row.player_id,
+        'team_id': row.team_id,
+        'player_slug': player.slug if player else '',
+        'begin_at': begin_at or datetime(2012, 1, 1),
+    }
+
+
+# The query shapes of the hot paths (format_stats, stats_over_time, glicko, line_api, build_dataset)
+BENCHMARK_QUERIES: Dict[str, Callable] = {
+    'round_player_stats(game_id, player_id)': lambda session, p: session.query(RoundPlayerStats)
+        .filter(RoundPlayerStats.player_id == p['player_id'], RoundPlayerStats.game_id == p['game_id']),
+    'round_team_stats(game_id)': lambda session, p: session.query(RoundTeamStats)
+        .filter(RoundTeamStats.game_id == p['game_id']),
+    'custom_player_stats_game(player_id, game_id)': lambda session, p: session.query(CustomPlayerStatsGame)
+        .filter(CustomPlayerStatsGame.player_id == p['player_id'], CustomPlayerStatsGame.game_id == p['game_id']),
+    'player_glicko(player_id, begin_at)': lambda session, p: session.query(PlayerGlicko)
+        .filter(PlayerGlicko.player_id == p['player_id'], PlayerGlicko.begin_at != None)
+        .order_by(PlayerGlicko.begin_at.desc()).limit(1),
+    'custom_stats_ma(player_id, game_id, ma)': lambda session, p: session.query(CustomStatsMA)
+        .filter(CustomStatsMA.player_id == p['player_id'], CustomStatsMA.game_id == p['game_id'], CustomStatsMA.ma == 'inf'),
+    'game_player_stats(game_id)': lambda session, p: session.query(GamePlayerStats.game_id, GamePlayerStats.player_id, GamePlayerStats.team_id)
+        .filter(GamePlayerStats.game_id == p['game_id']),
+    'games(begin_at)': lambda session, p: session.query(Games)
+        .filter(Games.begin_at < p['begin_at']).order_by(desc(Games.begin_at)).limit(1),
+    'matches(team_id, start_date)': lambda session, p: session.query(Matches)
+        .filter(or_(Matches.home_team_id == p['team_id'], Matches.away_team_id == p['team_id']))
+        .order_by(desc(Matches.start_date)).limit(1),
+    'players(slug)': lambda session, p: session.query(Players)
+        .filter(Players.slug == p['player_slug']).limit(1),
+}
+
+
+def explain_analyze(session: Session, query, runs: int = BENCHMARK_RUNS) -> float:
+    """
+    Runs EXPLAIN ANALYZE on a query several times.
+
+    :param session: An SQLAlchemy session object.
+    :param query: The SQLAlchemy query to time.
+    :param runs: Number of runs (int, optional).
+
+    :return: The median execution time in milliseconds as reported by postgres (float).
+    """
+    compiled = query.statement.compile(dialect=session.bind.dialect)
+    connection = session.connection()
+
+    times = []
+    for _ in range(runs):
+        plan = connection.exec_driver_sql("EXPLAIN (ANALYZE, FORMAT JSON) " + str(compiled), compiled.params).scalar()
+        times.append(plan[0]['Execution Time'])
+    return statistics.median(times)
+
+
+def benchmark(params: dict = None, runs: int = BENCHMARK_RUNS) -> Dict[str, float]:
+    """
+    Times every query shape of BENCHMARK_QUERIES.
+
+    :param params: Sample parameters, see sample_parameters (dict, optional).
+    :param runs: EXPLAIN ANALYZE runs per query (int, optional).
+
+    :return: A dict mapping query shape to its median execution time in milliseconds (Dict[str, float]).
+    """
+    session = Session()
+    try:
+        params = params or sample_parameters(session)
+        return {name: explain_analyze(session, build(session, params), runs) for name, build in BENCHMARK_QUERIES.items()}
+    finally:
+        session.rollback()
+        session.close()
+
+
+def print_report(before: Dict[str, float], after: Dict[str, float]) -> None:
+    print(f"{'query':<48}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in before:
+        speedup = before[name] / after[name] if after[name] > 0 else float('inf')
+        print(f"{name:<48}{before[name]:>12.3f}{after[name]:>12.3f}{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    #usage: python models/migrate_indexes.py [--no-benchmark]
+    init_db()
+
+    if "--no-benchmark" in sys.argv:
+        migrate_indexes()
+    else:
+        session = Session()
+        params = sample_parameters(session)
+        session.close()
+
+        before = benchmark(params)
+        migrate_indexes()
+        after = benchmark(params)
+
+        print_report(before, after)
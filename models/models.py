@@ -4,10 +4,11 @@ current_directory_str = str(current_directory).replace('\\', '/')
 import sys
 sys.path.append(current_directory_str)
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, BigInteger, ForeignKey, Date, Boolean, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Float, BigInteger, ForeignKey, Date, Boolean, DateTime, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from scraper.constants import DATABASE_URL
+from bo3_stats.stat_definitions import game_stat_columns, moving_average_columns
 
 
 Base = declarative_base()
@@ -135,6 +136,10 @@ class Teams(Base):
 
 class Matches(Base):
     __tablename__ = 'matches'
+    __table_args__ = (
+        Index('ix_matches_home_team_id_start_date', 'home_team_id', 'start_date'), #last match of a team (line_api)
+        Index('ix_matches_away_team_id_start_date', 'away_team_id', 'start_date'),
+    )
     
     #Columns
     id = Column(BigInteger, primary_key=True)
@@ -179,6 +184,9 @@ class Matches(Base):
 
 class Games(Base):
     __tablename__ = 'games'
+    __table_args__ = (
+        Index('ix_games_begin_at', 'begin_at'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     match_id = Column(BigInteger, ForeignKey('matches.id'))
@@ -255,6 +263,9 @@ class Rounds(Base):
 
 class Players(Base):
     __tablename__ = 'players'
+    __table_args__ = (
+        Index('ix_players_slug', 'slug'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     slug = Column(String)
@@ -278,6 +289,10 @@ class Players(Base):
 
 class GamePlayerStats(Base):
     __tablename__ = 'game_player_stats'
+    __table_args__ = (
+        Index('ix_game_player_stats_game_id', 'game_id'),
+        Index('ix_game_player_stats_player_id_game_id', 'player_id', 'game_id'), #previous game of a player (build_dataset)
+    )
 
     id = Column(BigInteger, primary_key=True)
     game_id = Column(BigInteger, ForeignKey('games.id'))
@@ -345,6 +360,9 @@ class GamePlayerStats(Base):
 
 class RoundTeamStats(Base):
     __tablename__ = 'round_team_stats'
+    __table_args__ = (
+        Index('ix_round_team_stats_game_id', 'game_id'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     team_side = Column(String)
@@ -460,6 +478,9 @@ class RoundTeamStats(Base):
 
 class RoundPlayerStats(Base):
     __tablename__ = 'round_player_stats'
+    __table_args__ = (
+        Index('ix_round_player_stats_game_id_player_id', 'game_id', 'player_id'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     round_number = Column(Integer)
@@ -605,8 +626,22 @@ class RoundPlayerStats(Base):
 
 #CUSTOM PLAYER STATS & GLICKO
 
+def add_columns(model, columns: dict) -> None:
+    '''
+    add_columns adds generated columns to a declared model, in order, before the tables are created
+
+    :param model: the declarative model class
+    :param columns: column name -> Column
+    '''
+    for name, column in columns.items():
+        setattr(model, name, column)
+
+
 class CustomPlayerStatsGame(Base):
     __tablename__ = 'custom_player_stats_game'
+    __table_args__ = (
+        Index('ix_custom_player_stats_game_player_id_game_id', 'player_id', 'game_id'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     game_id = Column(BigInteger, ForeignKey('games.id'))
@@ -622,128 +657,17 @@ class CustomPlayerStatsGame(Base):
     >Historical Performance Stat (ie track how players did vs other players)
     '''
 
-    # General stats
-    kpr = Column(Float, comment="Kill per round")
-    tdp = Column(Float, comment="% Share of team damage")
-    kdr = Column(Float, comment="Kill Death Ratio")
-    spr = Column(Float, comment="Survival per round")
-    dpr = Column(Float, comment="Death per round")
-    adr = Column(Float, comment="Average Damage per round")
-    apr = Column(Float, comment="Assist per round")
-    fkr = Column(Float, comment="First kills per round")
-    fdr = Column(Float, comment="First deaths per round")
-    odpr = Column(Float, comment="Opening Duel per round")
-    odwr = Column(Float, comment="Opening Duel Win Rate")
-    hsp = Column(Float, comment="Headshot Percentage")
-    kast = Column(Float, comment="Average KAST per round")
-    rwpr = Column(Float, comment="Conversion [round win] per round")
-    kpr2 = Column(Float, comment="Average double kills per round")
-    kpr3 = Column(Float, comment="Average triple kills per round")
-    kpr4 = Column(Float, comment="Average quad kills per round")
-    kpr5 = Column(Float, comment="Average penta kills per round")
-    cr = Column(Float, comment="Clutch Rate")
-    wcr = Column(Float, comment="Weighted Clutch Rate")
-    tkpr = Column(Float, comment="Trade kills per round")
-    tkr = Column(Float, comment="Trade kills rate")
-    nkr = Column(Float, comment="normal kills rate")
-    tddr = Column(Float, comment="Traded death per death")
-    ei = Column(Float, comment="Economic Efficiency")
-    mis = Column(Float, comment="Multikill index score")
-    ac = Column(Float, comment="Accuracy")
-    cpd = Column(Float, comment="Cost Per damage")
-    evspr = Column(Float, comment="Equipment Value Saved per Round")
-    evsos = Column(Float, comment="Equipment Value Saved over spent")
-    bpk = Column(Float, comment="Bullets per Kill")
-    fapr = Column(Float, comment="Flash Assists per Round")
-    udpr = Column(Float, comment="Utility Damage per Round")
-    udpi = Column(Float, comment="Utility Damage per Investment")
-    cv = Column(Float, comment="clutches given up")
-    dtpr = Column(Float, comment="Damage Taken per Round") #BELOW are game stats only
-    bppa = Column(Float, comment="Bomb Plants per Attempt")
-    bdpa = Column(Float, comment="Bomb Defuse per Attempt")
-    '''act = Column(Float, comment="Average Cohesion Time")
-    hthr = Column(Float, comment="heasd to head rounds (A + rounds_won / A + rounds_lost)")
-    time_since_last_match = Column(Float, comment="Time Since Last Match")
-    maps_played_last_30d = Column(Integer, comment="Matches Played in Last 30 Days")''' #Not sure how to implement this (will come back if need to refine model)
-
-    # T-side stats
-    kpr_T = Column(Float, comment="Kill per round (T side)")
-    kdr_T = Column(Float, comment="Kill Death Ratio (T side)")
-    tdp_T = Column(Float, comment="% Share of team damage")
-    spr_T = Column(Float, comment="Survival per round (T side)")
-    dpr_T = Column(Float, comment="Death per round (T side)")
-    adr_T = Column(Float, comment="Average Damage per round (T side)")
-    apr_T = Column(Float, comment="Assist per round (T side)")
-    fkr_T = Column(Float, comment="First kills per round (T side)")
-    fdr_T = Column(Float, comment="First deaths per round (T side)")
-    odpr_T = Column(Float, comment="Opening Duel per rate (T side)")
-    odwr_T = Column(Float, comment="Opening Duel Win Rate (T side)")
-    hsp_T = Column(Float, comment="Headshot Percentage (T side)")
-    kast_T = Column(Float, comment="Average KAST per round (T side)")
-    rwpr_T = Column(Float, comment="Conversion [round win] per round (T side)")
-    kpr2_T = Column(Float, comment="Average double kills per round (T side)")
-    kpr3_T = Column(Float, comment="Average triple kills per round (T side)")
-    kpr4_T = Column(Float, comment="Average quad kills per round (T side)")
-    kpr5_T = Column(Float, comment="Average penta kills per round (T side)")
-    cr_T = Column(Float, comment="Clutch rate (per attempt) (T side)")
-    wcr_T = Column(Float, comment="Weighted Clutch Rate")
-    tkpr_T = Column(Float, comment="Trade kills per round (T side)")
-    tkr_T = Column(Float, comment="Trade kills rate (T side)")
-    nkr_T = Column(Float, comment="Normal kills rate (T side)")
-    tddr_T = Column(Float, comment="Traded death per death (T side)")
-    ei_T = Column(Float, comment="Economic Efficiency (T side)")
-    mis_T = Column(Float, comment="Multiplier for multikills (T side)")
-    ac_T = Column(Float, comment="Accuracy (T side)")
-    cpd_T = Column(Float, comment="Cost Per damage (T side)")
-    evspr_T = Column(Float, comment="Equipment Value Saved per Round (T side)")
-    evsos_T = Column(Float, comment="Equipment Value Saved over spent")
-    bpk_T = Column(Float, comment="Bullets per Kill (T side)")
-    fapr_T = Column(Float, comment="Flash Assists per Round (T side)")
-    udpr_T = Column(Float, comment="Utility Damage per Round (T side)")
-    udpi_T = Column(Float, comment="Utility Damage per Investment (T side)")
-    cv_T = Column(Float, comment="Lost Clutches per Attempt (T side)")
-    dtpr_T = Column(Float, comment="Damage Taken per Round (T side)")
-
-    # CT-side stats
-    kpr_CT = Column(Float, comment="Kill per round (CT side)")
-    kdr_CT = Column(Float, comment="Kill Death Ratio (CT side)")
-    spr_CT = Column(Float, comment="Survival per round (CT side)")
-    tdp_CT = Column(Float, comment="% Share of team damage")
-    dpr_CT = Column(Float, comment="Death per round (CT side)")
-    adr_CT = Column(Float, comment="Average Damage per round (CT side)")
-    apr_CT = Column(Float, comment="Assist per round (CT side)")
-    fkr_CT = Column(Float, comment="First kills per round (CT side)")
-    fdr_CT = Column(Float, comment="First deaths per round (CT side)")
-    odpr_CT = Column(Float, comment="Opening Duel per round (CT side)")
-    odwr_CT = Column(Float, comment="Opening Duel Win Rate (CT side)")
-    hsp_CT = Column(Float, comment="Headshot Percentage (CT side)")
-    kast_CT = Column(Float, comment="Average KAST per round (CT side)")
-    rwpr_CT = Column(Float, comment="Conversion [round win] per round (CT side)")
-    kpr2_CT = Column(Float, comment="Average double kills per round (CT side)")
-    kpr3_CT = Column(Float, comment="Average triple kills per round (CT side)")
-    kpr4_CT = Column(Float, comment="Average quad kills per round (CT side)")
-    kpr5_CT = Column(Float, comment="Average penta kills per round (CT side)")
-    cr_CT = Column(Float, comment="Clutch rate (per attempt) (CT side)")
-    wcr_CT = Column(Float, comment="Weighted Clutch Rate")
-    tkpr_CT = Column(Float, comment="Trade kills per round (CT side)")
-    tkr_CT = Column(Float, comment="Trade kills rate (CT side)")
-    nkr_CT = Column(Float, comment="Normal kills rate (CT side)")
-    tddr_CT = Column(Float, comment="Traded death per death (CT side)")
-    ei_CT = Column(Float, comment="Economic Efficiency (CT side)")
-    mis_CT = Column(Float, comment="Multiplier for multikills (CT side)")
-    ac_CT = Column(Float, comment="Accuracy  (CT side)")
-    cpd_CT = Column(Float, comment="Cost Per damage (CT side)")
-    evspr_CT = Column(Float, comment="Equipment Value Saved per Round (CT side)")
-    evsos_CT = Column(Float, comment="Equipment Value Saved over spent")
-    bpk_CT = Column(Float, comment="Bullets per Kill (CT side)")
-    fapr_CT = Column(Float, comment="Flash Assists per Round (CT side)")
-    udpr_CT = Column(Float, comment="Utility Damage per Round (CT side)")
-    udpi_CT = Column(Float, comment="Utility Damage per Investment (CT side)")
-    cv_CT = Column(Float, comment="Lost Clutches per Attempt (CT side)")
-    dtpr_CT = Column(Float, comment="Damage Taken per Round (CT side)")
+    #stat columns are generated from bo3_stats/stat_definitions.py, see below
+
+
+add_columns(CustomPlayerStatsGame, game_stat_columns())
+
 
 class CustomStatsMA(Base):
     __tablename__ = 'custom_stats_ma'
+    __table_args__ = (
+        Index('ix_custom_stats_ma_player_id_game_id_ma', 'player_id', 'game_id', 'ma'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     game_id = Column(BigInteger, ForeignKey('games.id'))
@@ -753,240 +677,18 @@ class CustomStatsMA(Base):
     #IDENTIFERS
     ma = Column(String, comment="How long is MA")
 
-    # General stats
-    kpr = Column(Float, comment="Kill per round")
-    tdp = Column(Float, comment="% Share of team damage")
-    kdr = Column(Float, comment="Kill Death Ratio")
-    spr = Column(Float, comment="Survival per round")
-    dpr = Column(Float, comment="Death per round")
-    adr = Column(Float, comment="Average Damage per round")
-    apr = Column(Float, comment="Assist per round")
-    fkr = Column(Float, comment="First kills per round")
-    fdr = Column(Float, comment="First deaths per round")
-    odpr = Column(Float, comment="Opening Duel per round")
-    odwr = Column(Float, comment="Opening Duel Win Rate")
-    hsp = Column(Float, comment="Headshot Percentage")
-    kast = Column(Float, comment="Average KAST per round")
-    rwpr = Column(Float, comment="Conversion [round win] per round")
-    kpr2 = Column(Float, comment="Average double kills per round")
-    kpr3 = Column(Float, comment="Average triple kills per round")
-    kpr4 = Column(Float, comment="Average quad kills per round")
-    kpr5 = Column(Float, comment="Average penta kills per round")
-    cr = Column(Float, comment="Clutch Rate")
-    wcr = Column(Float, comment="Weighted Clutch Rate")
-    tkpr = Column(Float, comment="Trade kills per round")
-    tkr = Column(Float, comment="Trade kills rate")
-    nkr = Column(Float, comment="normal kills rate")
-    tddr = Column(Float, comment="Traded death per death")
-    ei = Column(Float, comment="Economic Efficiency")
-    mis = Column(Float, comment="Multikill index score")
-    ac = Column(Float, comment="Accuracy")
-    cpd = Column(Float, comment="Cost Per damage")
-    evspr = Column(Float, comment="Equipment Value Saved per Round")
-    evsos = Column(Float, comment="Equipment Value Saved over spent")
-    bpk = Column(Float, comment="Bullets per Kill")
-    fapr = Column(Float, comment="Flash Assists per Round")
-    udpr = Column(Float, comment="Utility Damage per Round")
-    udpi = Column(Float, comment="Utility Damage per Investment")
-    cv = Column(Float, comment="clutches given up")
-    dtpr = Column(Float, comment="Damage Taken per Round") #BELOW are game stats only
-    bppa = Column(Float, comment="Bomb Plants per Attempt")
-    bdpa = Column(Float, comment="Bomb Defuse per Attempt")
-
-    # T-side stats
-    kpr_T = Column(Float, comment="Kill per round (T side)")
-    kdr_T = Column(Float, comment="Kill Death Ratio (T side)")
-    tdp_T = Column(Float, comment="% Share of team damage")
-    spr_T = Column(Float, comment="Survival per round (T side)")
-    dpr_T = Column(Float, comment="Death per round (T side)")
-    adr_T = Column(Float, comment="Average Damage per round (T side)")
-    apr_T = Column(Float, comment="Assist per round (T side)")
-    fkr_T = Column(Float, comment="First kills per round (T side)")
-    fdr_T = Column(Float, comment="First deaths per round (T side)")
-    odpr_T = Column(Float, comment="Opening Duel per rate (T side)")
-    odwr_T = Column(Float, comment="Opening Duel Win Rate (T side)")
-    hsp_T = Column(Float, comment="Headshot Percentage (T side)")
-    kast_T = Column(Float, comment="Average KAST per round (T side)")
-    rwpr_T = Column(Float, comment="Conversion [round win] per round (T side)")
-    kpr2_T = Column(Float, comment="Average double kills per round (T side)")
-    kpr3_T = Column(Float, comment="Average triple kills per round (T side)")
-    kpr4_T = Column(Float, comment="Average quad kills per round (T side)")
-    kpr5_T = Column(Float, comment="Average penta kills per round (T side)")
-    cr_T = Column(Float, comment="Clutch rate (per attempt) (T side)")
-    wcr_T = Column(Float, comment="Weighted Clutch Rate")
-    tkpr_T = Column(Float, comment="Trade kills per round (T side)")
-    tkr_T = Column(Float, comment="Trade kills rate (T side)")
-    nkr_T = Column(Float, comment="Normal kills rate (T side)")
-    tddr_T = Column(Float, comment="Traded death per death (T side)")
-    ei_T = Column(Float, comment="Economic Efficiency (T side)")
-    mis_T = Column(Float, comment="Multiplier for multikills (T side)")
-    ac_T = Column(Float, comment="Accuracy (T side)")
-    cpd_T = Column(Float, comment="Cost Per damage (T side)")
-    evspr_T = Column(Float, comment="Equipment Value Saved per Round (T side)")
-    evsos_T = Column(Float, comment="Equipment Value Saved over spent")
-    bpk_T = Column(Float, comment="Bullets per Kill (T side)")
-    fapr_T = Column(Float, comment="Flash Assists per Round (T side)")
-    udpr_T = Column(Float, comment="Utility Damage per Round (T side)")
-    udpi_T = Column(Float, comment="Utility Damage per Investment (T side)")
-    cv_T = Column(Float, comment="Lost Clutches per Attempt (T side)")
-    dtpr_T = Column(Float, comment="Damage Taken per Round (T side)")
-
-    # CT-side stats
-    kpr_CT = Column(Float, comment="Kill per round (CT side)")
-    kdr_CT = Column(Float, comment="Kill Death Ratio (CT side)")
-    spr_CT = Column(Float, comment="Survival per round (CT side)")
-    tdp_CT = Column(Float, comment="% Share of team damage")
-    dpr_CT = Column(Float, comment="Death per round (CT side)")
-    adr_CT = Column(Float, comment="Average Damage per round (CT side)")
-    apr_CT = Column(Float, comment="Assist per round (CT side)")
-    fkr_CT = Column(Float, comment="First kills per round (CT side)")
-    fdr_CT = Column(Float, comment="First deaths per round (CT side)")
-    odpr_CT = Column(Float, comment="Opening Duel per round (CT side)")
-    odwr_CT = Column(Float, comment="Opening Duel Win Rate (CT side)")
-    hsp_CT = Column(Float, comment="Headshot Percentage (CT side)")
-    kast_CT = Column(Float, comment="Average KAST per round (CT side)")
-    rwpr_CT = Column(Float, comment="Conversion [round win] per round (CT side)")
-    kpr2_CT = Column(Float, comment="Average double kills per round (CT side)")
-    kpr3_CT = Column(Float, comment="Average triple kills per round (CT side)")
-    kpr4_CT = Column(Float, comment="Average quad kills per round (CT side)")
-    kpr5_CT = Column(Float, comment="Average penta kills per round (CT side)")
-    cr_CT = Column(Float, comment="Clutch rate (per attempt) (CT side)")
-    wcr_CT = Column(Float, comment="Weighted Clutch Rate")
-    tkpr_CT = Column(Float, comment="Trade kills per round (CT side)")
-    tkr_CT = Column(Float, comment="Trade kills rate (CT side)")
-    nkr_CT = Column(Float, comment="Normal kills rate (CT side)")
-    tddr_CT = Column(Float, comment="Traded death per death (CT side)")
-    ei_CT = Column(Float, comment="Economic Efficiency (CT side)")
-    mis_CT = Column(Float, comment="Multiplier for multikills (CT side)")
-    ac_CT = Column(Float, comment="Accuracy  (CT side)")
-    cpd_CT = Column(Float, comment="Cost Per damage (CT side)")
-    evspr_CT = Column(Float, comment="Equipment Value Saved per Round (CT side)")
-    evsos_CT = Column(Float, comment="Equipment Value Saved over spent")
-    bpk_CT = Column(Float, comment="Bullets per Kill (CT side)")
-    fapr_CT = Column(Float, comment="Flash Assists per Round (CT side)")
-    udpr_CT = Column(Float, comment="Utility Damage per Round (CT side)")
-    udpi_CT = Column(Float, comment="Utility Damage per Investment (CT side)")
-    cv_CT = Column(Float, comment="Lost Clutches per Attempt (CT side)")
-    dtpr_CT = Column(Float, comment="Damage Taken per Round (CT side)")
-
-    # General stats
-    kpr_N = Column(Integer, comment="Kill per round (includes amount of non NaN values in period)")
-    tdp_N = Column(Integer, comment="% Share of team damage (includes amount of non NaN values in period)")
-    kdr_N = Column(Integer, comment="Kill Death Ratio (includes amount of non NaN values in period)")
-    spr_N = Column(Integer, comment="Survival per round (includes amount of non NaN values in period)")
-    dpr_N = Column(Integer, comment="Death per round (includes amount of non NaN values in period)")
-    adr_N = Column(Integer, comment="Average Damage per round (includes amount of non NaN values in period)")
-    apr_N = Column(Integer, comment="Assist per round (includes amount of non NaN values in period)")
-    fkr_N = Column(Integer, comment="First kills per round (includes amount of non NaN values in period)")
-    fdr_N = Column(Integer, comment="First deaths per round (includes amount of non NaN values in period)")
-    odpr_N = Column(Integer, comment="Opening Duel per round (includes amount of non NaN values in period)")
-    odwr_N = Column(Integer, comment="Opening Duel Win Rate (includes amount of non NaN values in period)")
-    hsp_N = Column(Integer, comment="Headshot Percentage (includes amount of non NaN values in period)")
-    kast_N = Column(Integer, comment="Average KAST per round (includes amount of non NaN values in period)")
-    rwpr_N = Column(Integer, comment="Conversion [round win] per round (includes amount of non NaN values in period)")
-    kpr2_N = Column(Integer, comment="Average double kills per round (includes amount of non NaN values in period)")
-    kpr3_N = Column(Integer, comment="Average triple kills per round (includes amount of non NaN values in period)")
-    kpr4_N = Column(Integer, comment="Average quad kills per round (includes amount of non NaN values in period)")
-    kpr5_N = Column(Integer, comment="Average penta kills per round (includes amount of non NaN values in period)")
-    cr_N = Column(Integer, comment="Clutch Rate (includes amount of non NaN values in period)")
-    wcr_N = Column(Integer, comment="Weighted Clutch Rate (includes amount of non NaN values in period)")
-    tkpr_N = Column(Integer, comment="Trade kills per round (includes amount of non NaN values in period)")
-    tkr_N = Column(Integer, comment="Trade kills rate (includes amount of non NaN values in period)")
-    nkr_N = Column(Integer, comment="normal kills rate (includes amount of non NaN values in period)")
-    tddr_N = Column(Integer, comment="Traded death per death (includes amount of non NaN values in period)")
-    ei_N = Column(Integer, comment="Economic Efficiency (includes amount of non NaN values in period)")
-    mis_N = Column(Integer, comment="Multikill index score (includes amount of non NaN values in period)")
-    ac_N = Column(Integer, comment="Accuracy (includes amount of non NaN values in period)")
-    cpd_N = Column(Integer, comment="Cost Per damage (includes amount of non NaN values in period)")
-    evspr_N = Column(Integer, comment="Equipment Value Saved per Round (includes amount of non NaN values in period)")
-    evsos_N = Column(Integer, comment="Equipment Value Saved over spent (includes amount of non NaN values in period)")
-    bpk_N = Column(Integer, comment="Bullets per Kill (includes amount of non NaN values in period)")
-    fapr_N = Column(Integer, comment="Flash Assists per Round (includes amount of non NaN values in period)")
-    udpr_N = Column(Integer, comment="Utility Damage per Round (includes amount of non NaN values in period)")
-    udpi_N = Column(Integer, comment="Utility Damage per Investment (includes amount of non NaN values in period)")
-    cv_N = Column(Integer, comment="clutches given up (includes amount of non NaN values in period)")
-    dtpr_N = Column(Integer, comment="Damage Taken per Round (includes amount of non NaN values in period)")
-    bppa_N = Column(Integer, comment="Bomb Plants per Attempt (includes amount of non NaN values in period)")
-    bdpa_N = Column(Integer, comment="Bomb Defuse per Attempt (includes amount of non NaN values in period)")
-
-    # T-side stats
-    kpr_T_N = Column(Integer, comment="Kill per round (T side) (includes amount of non NaN values in period)")
-    kdr_T_N = Column(Integer, comment="Kill Death Ratio (T side) (includes amount of non NaN values in period)")
-    tdp_T_N = Column(Integer, comment="% Share of team damage (T side) (includes amount of non NaN values in period)")
-    spr_T_N = Column(Integer, comment="Survival per round (T side) (includes amount of non NaN values in period)")
-    dpr_T_N = Column(Integer, comment="Death per round (T side) (includes amount of non NaN values in period)")
-    adr_T_N = Column(Integer, comment="Average Damage per round (T side) (includes amount of non NaN values in period)")
-    apr_T_N = Column(Integer, comment="Assist per round (T side) (includes amount of non NaN values in period)")
-    fkr_T_N = Column(Integer, comment="First kills per round (T side) (includes amount of non NaN values in period)")
-    fdr_T_N = Column(Integer, comment="First deaths per round (T side) (includes amount of non NaN values in period)")
-    odpr_T_N = Column(Integer, comment="Opening Duel per rate (T side) (includes amount of non NaN values in period)")
-    odwr_T_N = Column(Integer, comment="Opening Duel Win Rate (T side) (includes amount of non NaN values in period)")
-    hsp_T_N = Column(Integer, comment="Headshot Percentage (T side) (includes amount of non NaN values in period)")
-    kast_T_N = Column(Integer, comment="Average KAST per round (T side) (includes amount of non NaN values in period)")
-    rwpr_T_N = Column(Integer, comment="Conversion [round win] per round (T side) (includes amount of non NaN values in period)")
-    kpr2_T_N = Column(Integer, comment="Average double kills per round (T side) (includes amount of non NaN values in period)")
-    kpr3_T_N = Column(Integer, comment="Average triple kills per round (T side) (includes amount of non NaN values in period)")
-    kpr4_T_N = Column(Integer, comment="Average quad kills per round (T side) (includes amount of non NaN values in period)")
-    kpr5_T_N = Column(Integer, comment="Average penta kills per round (T side) (includes amount of non NaN values in period)")
-    cr_T_N = Column(Integer, comment="Clutch rate (per attempt) (T side) (includes amount of non NaN values in period)")
-    wcr_T_N = Column(Integer, comment="Weighted Clutch Rate (T side) (includes amount of non NaN values in period)")
-    tkpr_T_N = Column(Integer, comment="Trade kills per round (T side) (includes amount of non NaN values in period)")
-    tkr_T_N = Column(Integer, comment="Trade kills rate (T side) (includes amount of non NaN values in period)")
-    nkr_T_N = Column(Integer, comment="normal kills rate (T side) (includes amount of non NaN values in period)")
-    tddr_T_N = Column(Integer, comment="Traded death per death (T side) (includes amount of non NaN values in period)")
-    ei_T_N = Column(Integer, comment="Economic Efficiency (T side) (includes amount of non NaN values in period)")
-    mis_T_N = Column(Integer, comment="Multikill index score (T side) (includes amount of non NaN values in period)")
-    ac_T_N = Column(Integer, comment="Accuracy (T side) (includes amount of non NaN values in period)")
-    cpd_T_N = Column(Integer, comment="Cost Per damage (T side) (includes amount of non NaN values in period)")
-    evspr_T_N = Column(Integer, comment="Equipment Value Saved per Round (T side) (includes amount of non NaN values in period)")
-    evsos_T_N = Column(Integer, comment="Equipment Value Saved over spent (T side) (includes amount of non NaN values in period)")
-    bpk_T_N = Column(Integer, comment="Bullets per Kill (T side) (includes amount of non NaN values in period)")
-    fapr_T_N = Column(Integer, comment="Flash Assists per Round (T side) (includes amount of non NaN values in period)")
-    udpr_T_N = Column(Integer, comment="Utility Damage per Round (T side) (includes amount of non NaN values in period)")
-    udpi_T_N = Column(Integer, comment="Utility Damage per Investment (T side) (includes amount of non NaN values in period)")
-    cv_T_N = Column(Integer, comment="clutches given up (T side) (includes amount of non NaN values in period)")
-    dtpr_T_N = Column(Integer, comment="Damage Taken per Round (T side) (includes amount of non NaN values in period)")
-
-    # CT-side stats
-    kpr_CT_N = Column(Integer, comment="Kill per round (CT side) (includes amount of non NaN values in period)")
-    kdr_CT_N = Column(Integer, comment="Kill Death Ratio (CT side) (includes amount of non NaN values in period)")
-    tdp_CT_N = Column(Integer, comment="% Share of team damage (CT side) (includes amount of non NaN values in period)")
-    spr_CT_N = Column(Integer, comment="Survival per round (CT side) (includes amount of non NaN values in period)")
-    dpr_CT_N = Column(Integer, comment="Death per round (CT side) (includes amount of non NaN values in period)")
-    adr_CT_N = Column(Integer, comment="Average Damage per round (CT side) (includes amount of non NaN values in period)")
-    apr_CT_N = Column(Integer, comment="Assist per round (CT side) (includes amount of non NaN values in period)")
-    fkr_CT_N = Column(Integer, comment="First kills per round (CT side) (includes amount of non NaN values in period)")
-    fdr_CT_N = Column(Integer, comment="First deaths per round (CT side) (includes amount of non NaN values in period)")
-    odpr_CT_N = Column(Integer, comment="Opening Duel per rate (CT side) (includes amount of non NaN values in period)")
-    odwr_CT_N = Column(Integer, comment="Opening Duel Win Rate (CT side) (includes amount of non NaN values in period)")
-    hsp_CT_N = Column(Integer, comment="Headshot Percentage (CT side) (includes amount of non NaN values in period)")
-    kast_CT_N = Column(Integer, comment="Average KAST per round (CT side) (includes amount of non NaN values in period)")
-    rwpr_CT_N = Column(Integer, comment="Conversion [round win] per round (CT side) (includes amount of non NaN values in period)")
-    kpr2_CT_N = Column(Integer, comment="Average double kills per round (CT side) (includes amount of non NaN values in period)")
-    kpr3_CT_N = Column(Integer, comment="Average triple kills per round (CT side) (includes amount of non NaN values in period)")
-    kpr4_CT_N = Column(Integer, comment="Average quad kills per round (CT side) (includes amount of non NaN values in period)")
-    kpr5_CT_N = Column(Integer, comment="Average penta kills per round (CT side) (includes amount of non NaN values in period)")
-    cr_CT_N = Column(Integer, comment="Clutch rate (per attempt) (CT side) (includes amount of non NaN values in period)")
-    wcr_CT_N = Column(Integer, comment="Weighted Clutch Rate (CT side) (includes amount of non NaN values in period)")
-    tkpr_CT_N = Column(Integer, comment="Trade kills per round (CT side) (includes amount of non NaN values in period)")
-    tkr_CT_N = Column(Integer, comment="Trade kills rate (CT side) (includes amount of non NaN values in period)")
-    nkr_CT_N = Column(Integer, comment="normal kills rate (CT side) (includes amount of non NaN values in period)")
-    tddr_CT_N = Column(Integer, comment="Traded death per death (CT side) (includes amount of non NaN values in period)")
-    ei_CT_N = Column(Integer, comment="Economic Efficiency (CT side) (includes amount of non NaN values in period)")
-    mis_CT_N = Column(Integer, comment="Multikill index score (CT side) (includes amount of non NaN values in period)")
-    ac_CT_N = Column(Integer, comment="Accuracy (CT side) (includes amount of non NaN values in period)")
-    cpd_CT_N = Column(Integer, comment="Cost Per damage (CT side) (includes amount of non NaN values in period)")
-    evspr_CT_N = Column(Integer, comment="Equipment Value Saved per Round (CT side) (includes amount of non NaN values in period)")
-    evsos_CT_N = Column(Integer, comment="Equipment Value Saved over spent (CT side) (includes amount of non NaN values in period)")
-    bpk_CT_N = Column(Integer, comment="Bullets per Kill (CT side) (includes amount of non NaN values in period)")
-    fapr_CT_N = Column(Integer, comment="Flash Assists per Round (CT side) (includes amount of non NaN values in period)")
-    udpr_CT_N = Column(Integer, comment="Utility Damage per Round (CT side) (includes amount of non NaN values in period)")
-    udpi_CT_N = Column(Integer, comment="Utility Damage per Investment (CT side) (includes amount of non NaN values in period)")
-    cv_CT_N = Column(Integer, comment="clutches given up (CT side) (includes amount of non NaN values in period)")
-    dtpr_CT_N = Column(Integer, comment="Damage Taken per Round (CT side) (includes amount of non NaN values in period)")
+    #stat columns and their _N counts are generated from bo3_stats/stat_definitions.py, see below
+
+
+add_columns(CustomStatsMA, moving_average_columns())
+
 
 class PlayerGlicko(Base):
     __tablename__ = 'player_glicko'
+    __table_args__ = (
+        Index('ix_player_glicko_player_id_begin_at', 'player_id', 'begin_at'), #latest rating of a player (line_api)
+        Index('ix_player_glicko_game_id', 'game_id'),
+    )
 
     id = Column(BigInteger, primary_key=True)
     game_id = Column(BigInteger, ForeignKey('games.id'))
@@ -1002,6 +704,46 @@ class PlayerGlicko(Base):
     vol_post = Column(Float)
 
 
+class PlayerRatingState(Base):
+    __tablename__ = 'player_rating_state' #latest PlayerGlicko rating of every player, updated with every glicko run
+
+    player_id = Column(BigInteger, ForeignKey('players.id'), primary_key=True)
+    rating = Column(Float)
+    deviation = Column(Float)
+    vol = Column(Float)
+    last_game_id = Column(BigInteger, ForeignKey('games.id'))
+    last_game_time = Column(DateTime) #begin_at of the last rated game
+
+
+class PlayerTailSummary(Base):
+    __tablename__ = 'player_tail_summary' #running sums and counts of every player's stats per window, updated after every stats run
+
+    player_id = Column(BigInteger, ForeignKey('players.id'), primary_key=True)
+    max_stats_id = Column(BigInteger) #highest CustomPlayerStatsGame id summed in
+    num_games = Column(Integer)
+    last_game_id = Column(BigInteger, ForeignKey('games.id'))
+    last_game_time = Column(DateTime)
+    layout = Column(String, comment="Windows and stat columns of sums and counts")
+    sums = Column(LargeBinary, comment="(windows x stats) float64 sums of the non NaN values")
+    counts = Column(LargeBinary, comment="(windows x stats) int32 non NaN counts")
+
+
+class CrawlState(Base):
+    __tablename__ = 'crawl_state'
+    __table_args__ = (
+        Index('ix_crawl_state_entity_parent_id', 'entity', 'parent_id'), #games of a match (load_child_states)
+    )
+
+    entity = Column(String, primary_key=True) #event, match, game
+    entity_id = Column(BigInteger, primary_key=True)
+    parent_id = Column(BigInteger) #event id of a match, match id of a game
+    stage = Column(String) #fetched, parsed, persisted
+    fingerprint = Column(String) #hash of the remote status fields, a change means the entity has to be crawled again
+    attempts = Column(Integer) #consecutive failures with the current fingerprint
+    last_error = Column(String)
+    updated_at = Column(DateTime)
+
+
 #ODDS TABLES
 
 class PinnacleMoneylines(Base):
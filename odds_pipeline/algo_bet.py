@@ -6,13 +6,15 @@ sys.path.append(current_directory_str)
 
 from models.models import *
 from odds_pipeline.pinnacle_api import PinnyAPI, get_line_info
-from odds_pipeline.line_api import get_bo1_prob, compute_moneyline_prob
+from odds_pipeline.line_api import get_bo1_probs, compute_moneyline_prob
 from odds_pipeline.async_input import KBHit
 import time
 from collect_data import collect_data
 from datetime import datetime
 from odds_pipeline.capital_manager import get_adjusted_bet_size, get_bet_dollars, store_bet_db, close_bet_db
 from odds_pipeline.log import log, LEVEL_ERROR, LEVEL_WARNING
+from odds_pipeline.model_registry import get_registry
+from odds_pipeline.lineup_service import get_lineup_service
 
 
 class AlgoBet():
@@ -24,6 +26,9 @@ class AlgoBet():
 
         self.kb = KBHit()
 
+        #load the model once, it stays resident (and reloads if the file changes)
+        get_registry().load()
+
         log("Program Starting.")
 
         #Bet loop
@@ -46,10 +51,17 @@ class AlgoBet():
             log("Getting line info.")
             self.line_dicts = get_line_info(self.pinny_api)
 
+            log("Prefetching lineups.")
+            get_lineup_service().prefetch(self.line_dicts) #every matched line's lineup resolved concurrently
+
             #New bet loop
             log(f"Beginning loop through lines. {len(self.line_dicts)} Lines to process.")
-            for line in self.line_dicts:
-                away_bo1_prob, _ = get_bo1_prob(line)
+            bo1_probs = get_bo1_probs(self.line_dicts) #every line priced in one batch
+            for line, line_probs in zip(self.line_dicts, bo1_probs):
+                if line_probs is None:
+                    continue
+
+                away_bo1_prob, _ = line_probs
                 away, draw, home = self.compute_moneylines(away_bo1_prob, line['bo_type'])
                 away, draw, home = self.benter_boost(away, draw, home, line)
                 value_line_side, value_line = self.check_for_value(away, draw, home, line)
@@ -107,7 +119,8 @@ class AlgoBet():
         if len(moneylines) == 2:
             return 1/float(moneylines[0]), None, 1/float(moneylines[1])
         
-        return [1/float(x) for x in moneylines]
+        win, loss, draw = moneylines
+        return 1/float(win), 1/float(draw), 1/float(loss)
 
     def check_for_value(self, away, draw, home, line):
         away_ev = self.calc_ev(1/away if away is not None and away > 0 else None, line['away_line'])
@@ -9,15 +9,16 @@ from models.models import *
 from odds_pipeline.pinnacle_api import get_line_info
 from resources import feature_moments
 import pandas as pd
-import re
 import numpy as np
-import requests
-from bs4 import BeautifulSoup
 from bo3_stats.glicko import glicko2_win_prob
-import pickle
-from math import comb
-from scipy.stats import binom
-from sqlalchemy import desc, or_
+from bo3_stats.stat_definitions import feature_components, feature_stat_columns, split_component
+from bo3_stats.tail_summary import TailSummary, current_tail_summaries, load_games, tail_averages
+from bo3_stats.rating_state import DEFAULT_DEVIATION, DEFAULT_RATING, load_rating_state
+from odds_pipeline.model_registry import predict_proba
+from odds_pipeline.lineup_service import get_lineup_service
+from odds_pipeline.series_prob import score_probability, series_probs
+from sqlalchemy import desc, func, union_all
+from odds_pipeline.log import log, LEVEL_WARNING
 from datetime import datetime
 from typing import Union, Tuple
 
@@ -86,223 +87,134 @@ def bayes_shrink(value: float, N: int, stat: str, module, A: int = 10) -> float:
     return (A * prior + N * value) / (A + N)  # Compute the weighted average of the value and the prior.
 
 
-def fetch_stats_for_player(player_slug: str, session) -> dict:
+def bayes_shrink_matrix(means: np.ndarray, counts: np.ndarray, stats: list, module, A: int = 10) -> np.ndarray:
     """
-    Fetches statistical data for a player identified by their slug.
+    Applies bayes_shrink to a matrix of averages at once.
 
-    This function retrieves player-specific statistics from a database using SQLAlchemy. It first identifies
-    the player's ID, then fetches their latest Glicko rating and deviation. It also gathers a range of 
-    custom player statistics from games they have participated in.
+    :param means: (players x stats) observed averages, NaN where there are no observations.
+    :param counts: (players x stats) number of observations of each average.
+    :param stats: The stat of each column, used to find the priors in the module.
+    :param module: A module or object that contains the prior statistics, accessed using getattr.
+    :param A: The weight given to the prior. Defaults to 10.
+    :return: The adjusted averages (players x stats).
+    """
+    priors = np.array([getattr(module, stat + "_mean") for stat in stats], dtype=np.float64)
+    values = np.where(counts == 0, 0, means)  # Reset the value to 0 where there are no observations.
+    return (A * priors + counts * values) / (A + counts)
 
-    :param player_slug: Unique identifier (slug) for the player.
-    :param session: SQLAlchemy session for database queries. The exact type depends on the SQLAlchemy setup.
-    :return: A dictionary containing averaged statistics and Glicko rating information for the player.
+
+def player_ids_by_slug(player_slugs: list, session) -> np.ndarray:
     """
-    # Retrieve the player ID from the Players table using the provided slug.
-    player_id = session.query(Players)\
-        .filter(Players.slug == player_slug)\
-        .first()
-    
-    # Set player_id to the ID if found, else -1. (impossible id value)
-    if player_id != None:
-        player_id = player_id.id
-    else:
-        player_id = -1
-
-    #get rating + rd
-    latest_entry = session.query(PlayerGlicko)\
-        .filter(PlayerGlicko.player_id == player_id)\
-        .filter(PlayerGlicko.begin_at != None)\
-        .order_by(PlayerGlicko.begin_at.desc())\
-        .first()
-
-    rating = 1500
-    RD = 350
-    if latest_entry:
-        rating = latest_entry.rating_post
-        RD = latest_entry.deviation_post
-
-    #Get most recent stats from customplayerstats for player
-    result = session.query(CustomPlayerStatsGame)\
-        .join(Games, CustomPlayerStatsGame.game_id == Games.id)\
-        .filter(CustomPlayerStatsGame.player_id == player_id)\
-        .filter(Games.begin_at != None)\
-        .with_entities(
-            CustomPlayerStatsGame.num_rounds, 
-            CustomPlayerStatsGame.rwpr, 
-            CustomPlayerStatsGame.kdr_CT, 
-            CustomPlayerStatsGame.tdp, 
-            CustomPlayerStatsGame.mis_T, 
-            CustomPlayerStatsGame.kpr, 
-            CustomPlayerStatsGame.rwpr_CT, 
-            CustomPlayerStatsGame.mis, 
-            CustomPlayerStatsGame.dpr, 
-            CustomPlayerStatsGame.kdr, 
-            CustomPlayerStatsGame.mis_CT, 
-            CustomPlayerStatsGame.spr, 
-            CustomPlayerStatsGame.kast_CT, 
-            CustomPlayerStatsGame.adr_CT, 
-            CustomPlayerStatsGame.adr, 
-            CustomPlayerStatsGame.tdp_CT, 
-            CustomPlayerStatsGame.kast, 
-            CustomPlayerStatsGame.evspr, 
-            CustomPlayerStatsGame.spr_CT, 
-            CustomPlayerStatsGame.dpr_CT, 
-            CustomPlayerStatsGame.kpr_CT, 
-            CustomPlayerStatsGame.evspr_CT, 
-            CustomPlayerStatsGame.rwpr_T, 
-            CustomPlayerStatsGame.evsos, 
-            CustomPlayerStatsGame.spr_T, 
-            CustomPlayerStatsGame.odwr)\
-        .order_by(Games.begin_at.asc())\
-        .all()
-
-    # List of feature components to be used in calculating averages.
-    feature_components = [
-        '20_spr',
-        '25_spr',
-        '25_tdp',
-        '30_dpr',
-        '30_kdr',
-        '30_rwpr',
-        '30_spr',
-        '30_tdp',
-        'inf_adr',
-        'inf_adr_CT',
-        'inf_dpr',
-        'inf_dpr_CT',
-        'inf_evsos',
-        'inf_evspr',
-        'inf_evspr_CT',
-        'inf_kast',
-        'inf_kast_CT',
-        'inf_kdr',
-        'inf_kdr_CT',
-        'inf_kpr',
-        'inf_kpr_CT',
-        'inf_mis',
-        'inf_mis_CT',
-        'inf_mis_T',
-        'inf_odwr',
-        'inf_rwpr',
-        'inf_rwpr_CT',
-        'inf_rwpr_T',
-        'inf_spr',
-        'inf_spr_CT',
-        'inf_spr_T',
-        'inf_tdp',
-        'inf_tdp_CT'
-    ]
-
-    # Convert the query result to a pandas DataFrame.
-    df = pd.DataFrame(result, columns=[
-        'num_rounds', 'rwpr', 'kdr_CT', 'tdp', 'mis_T', 'kpr', 'rwpr_CT', 'mis', 'dpr', 'kdr',
-        'mis_CT', 'spr', 'kast_CT', 'adr_CT', 'adr', 'tdp_CT', 'kast', 'evspr', 'dpr_CT',
-        'spr_CT', 'kpr_CT', 'evspr_CT', 'rwpr_T', 'evsos', 'spr_T', 'odwr'
-    ])
-
-    # Calculate averages of the player's statistics.
-    averages = calculate_averages(df, feature_components)
-
-    # Add Glicko rating and RD to the averages dictionary.
-    averages['Rating'] = rating
-    averages['RD'] = RD
-
-    return averages
-
-
-def calculate_averages(df: pd.DataFrame, columns: list) -> dict:
-    """
-    Calculates the moving averages for specified columns in a DataFrame, applying Bayesian shrinkage.
-
-    This function iterates over a list of column names, each potentially prefixed with a number 
-    indicating the window size for a moving average, or 'inf' for considering all available data.
-    It calculates the moving average for each column and applies Bayesian shrinkage to adjust the values.
-
-    :param df: DataFrame containing the data from which averages need to be calculated.
-    :param columns: A list of strings representing the column names in the DataFrame. Each string 
-                    can have a prefix like '30_' or 'inf_' indicating the window size for the moving average.
-    :return: A dictionary with keys as column names and values as the calculated averages.
-    """
-    averages = {}
-
-    # Replace values with NaN where num_rounds <= 12
-    for col in columns:
-        match = re.match(r'(\d+|inf)_(\w+)', col)
-        if match:
-            _, base_stat = match.groups()
-            if base_stat in df.columns:
-                df.loc[df['num_rounds'] <= 12, base_stat] = np.nan
-
-
-    for col in columns:
-        # Remove prefixes and extract window size
-        match = re.match(r'(\d+|inf)_(\w+)', col)
-        if match:
-            window, base_stat = match.groups()
-            window_size = len(df) if window == 'inf' else int(window)
-
-        # Calculate moving average
-        if base_stat in df.columns:
-            # Select the appropriate window of data.
-            if window_size == 'inf':
-                series = df[base_stat].iloc[0:]
-            else:
-                series = df[base_stat].iloc[max(0, len(df[base_stat])-window_size):len(df[base_stat])]
-
-            # Calculate non-null count and moving average.
-            non_null_count = len(series) - series.isna().sum()
-            moving_avg = series.mean()
-
-            # Apply Bayesian shrinkage and add to averages.
-            averages[col] = bayes_shrink(moving_avg, non_null_count, base_stat, feature_moments)
-        else:
-            averages[col] = None
+    Finds the IDs of players from their slugs in one query.
 
-    return averages
+    :param player_slugs: Player slugs (may repeat).
+    :param session: SQLAlchemy session for database queries.
+    :return: The ID of each slug, -1 (impossible id value) for unknown players.
+    """
+    found = dict(session.query(Players.slug, Players.id)
+        .filter(Players.slug.in_(list(set(player_slugs))))
+        .all())
+
+    return np.array([found.get(slug, -1) for slug in player_slugs], dtype=np.int64)
 
 
-def fetch_match_info(match_slug: str) -> Union[dict, None]:
+def summary_averages(summaries: list, columns: list) -> np.ndarray:
     """
-    Fetches information about a match identified by its slug.
+    Reads players' moving averages from their tail summaries, applying Bayesian shrinkage.
 
-    This function makes an HTTP GET request to a specific URL constructed using the match_slug.
-    It then parses the HTML response to extract player information for both the away and home teams.
+    :param summaries: One TailSummary per player, None for players without games.
+    :param columns: Window_stat components, eg ['30_dpr', 'inf_kdr_CT'].
+    :return: The averages (players x columns).
+    """
+    components = [split_component(col) for col in columns]
+    means, counts = tail_averages(summaries, components)
+    return bayes_shrink_matrix(means, counts, [base_stat for _, base_stat in components], feature_moments)
 
-    :param match_slug: The slug identifying the match. Used to construct the URL for the GET request.
-    :return: A dictionary with keys 'away' and 'home', each containing a list of player slugs for the respective teams.
-             Returns None if the HTTP request fails or if the response status is not 200.
+
+def database_averages(player_ids: np.ndarray, columns: list, session) -> np.ndarray:
     """
-    # Make an HTTP GET request to the specified URL.
-    response = requests.get(f"https://bo3.gg/matches/{match_slug}")  # Use the session to make requests
+    Calculates players' moving averages from their CustomPlayerStatsGame history in one query, applying Bayesian shrinkage.
+    Used for players whose tail summary is not current.
 
-    if response.status_code != 200:
-        return None
-    
-    match_html = BeautifulSoup(response.content, 'html.parser')
+    :param player_ids: The players' IDs.
+    :param columns: Window_stat components, eg ['30_dpr', 'inf_kdr_CT'].
+    :param session: SQLAlchemy session for database queries.
+    :return: The averages (players x columns).
+    """
+    stat_columns = feature_stat_columns(FEATURES)
+    games = dict(list(load_games(session, list(set(player_ids)), columns=stat_columns).groupby('player_id', sort=False)))
+    summaries = {player_id: TailSummary.from_games(player_id, player_games, columns=stat_columns) for player_id, player_games in games.items()}
+
+    components = [split_component(col) for col in columns]
+    means, counts = tail_averages([summaries.get(player_id) for player_id in player_ids], components, columns=stat_columns)
+    return bayes_shrink_matrix(means, counts, [base_stat for _, base_stat in components], feature_moments)
+
+
+def fetch_stats_for_players(player_slugs: list, session) -> pd.DataFrame:
+    """
+    Fetches statistical data for many players identified by their slugs, with a fixed number of queries.
+
+    The players' IDs, Glicko ratings and deviations are read in one query each. Averages come from the players'
+    tail summaries (see bo3_stats/tail_summary.py), and from their CustomPlayerStatsGame history if a summary is behind.
+
+    :param player_slugs: Unique identifiers (slugs) of the players (may repeat).
+    :param session: SQLAlchemy session for database queries.
+    :return: One row per slug with the averaged statistics and the Glicko rating ('Rating') and deviation ('RD').
+    """
+    columns = feature_components(FEATURES)
+    player_ids = player_ids_by_slug(player_slugs, session)
+
+    #get rating + rd (1500 / 350 if never rated)
+    states = load_rating_state(session, list(set(player_ids))).set_index('player_id')
+    states = states.reindex(player_ids)
+    ratings = states['rating'].fillna(DEFAULT_RATING).to_numpy(dtype=np.float64)
+    deviations = states['deviation'].fillna(DEFAULT_DEVIATION).to_numpy(dtype=np.float64)
 
-    # Efficiently find both away and home divs
-    lineups = match_html.select(".c-widget-match-lineup--a, .c-widget-match-lineup--b")
+    #Read the averages from the players' tail summaries, or their games if a summary is behind
+    averages = np.empty((len(player_ids), len(columns)))
+    summaries, current = current_tail_summaries(session, player_ids)
+    if current.any():
+        averages[current] = summary_averages([summary for summary, is_current in zip(summaries, current) if is_current], columns)
+    if (~current).any():
+        averages[~current] = database_averages(player_ids[~current], columns, session)
 
-    # Extract player links for away and home teams using list comprehensions
-    away_players = [link['href'].split('/')[-1] for link in lineups[0].find_all('a', class_="player-info", href=True)]
-    home_players = [link['href'].split('/')[-1] for link in lineups[1].find_all('a', class_="player-info", href=True)]
+    stats = pd.DataFrame(averages, columns=columns)
+    stats['Rating'] = ratings
+    stats['RD'] = deviations
+    return stats
+
+
+def fetch_stats_for_player(player_slug: str, session) -> dict:
+    """
+    Fetches statistical data for a player identified by their slug, see fetch_stats_for_players.
 
-    return {'away': away_players, 'home': home_players}
+    :param player_slug: Unique identifier (slug) for the player.
+    :param session: SQLAlchemy session for database queries.
+    :return: A dictionary containing averaged statistics and Glicko rating information for the player.
+    """
+    return fetch_stats_for_players([player_slug], session).iloc[0].to_dict()
 
 
-def create_features(away: dict, home: dict) -> pd.DataFrame:
+def create_features(away: Union[dict, pd.Series, pd.DataFrame], home: Union[dict, pd.Series, pd.DataFrame]) -> pd.DataFrame:
     """
     Creates a feature set for a model based on statistics of two teams, 'away' and 'home'.
 
     The function calculates different types of features like win probability, percent differences, 
     deltas, ratios, z-scores, and others based on the statistics provided in the 'away' and 'home' dictionaries. 
     It uses predefined feature names from the global FEATURES list to determine what calculations to perform.
+    Every feature is computed for all rows at once, so the features of many matches are built in one pass.
 
-    :param away: A dictionary containing statistics for the away team.
-    :param home: A dictionary containing statistics for the home team.
-    :return: A pandas DataFrame with a single row containing the calculated features.
+    :param away: Statistics for the away team (dict or pd.Series), or one row per match (pd.DataFrame).
+    :param home: Statistics for the home team, in the same form and row order as away.
+    :return: A pandas DataFrame with one row per match containing the calculated features.
     """
+    if not isinstance(away, pd.DataFrame):
+        away = pd.DataFrame([away])
+    if not isinstance(home, pd.DataFrame):
+        home = pd.DataFrame([home])
+    away = {column: away[column].to_numpy(dtype=np.float64) for column in away.columns}
+    home = {column: home[column].to_numpy(dtype=np.float64) for column in home.columns}
+
     model_features = {}
 
     model_features[FEATURES[0]] = glicko2_win_prob(away['Rating'], away['RD'], home['Rating'], home['RD'])
@@ -333,74 +245,49 @@ def create_features(away: dict, home: dict) -> pd.DataFrame:
             base_stat = feature.replace("DO_", "")
             model_features[feature] = away[base_stat + "_CT"] / home[base_stat +"_T"]
 
-    return pd.DataFrame(model_features, index=[0])
+    return pd.DataFrame(model_features)
 
 
-def get_bo1_prob(line_dict: dict) -> Tuple[float, float]:
+def last_match_ids(team_ids: list, session) -> dict:
     """
-    Calculates the probability of winning for both away and home teams in a match.
-
-    This function fetches the most recent match information for both teams and then computes the win probability
-    for each team. It uses a pre-trained logistic regression model to predict the probabilities based on various features.
+    Finds the most recent match of teams in one query.
 
-    :param line_dict: A dictionary containing information about the match, including team IDs and match slug generated from pinnacle api.
-    :return: A tuple containing the win probabilities for the away and home teams, respectively.
+    :param team_ids: The teams' IDs.
+    :param session: SQLAlchemy session for database queries.
+    :return: Team ID -> ID of the team's most recent match (teams without a match are missing).
+    """
+    team_ids = list(set(team_ids))
+    team_matches = union_all(
+        session.query(Matches.home_team_id.label('team_id'), Matches.id.label('match_id'), Matches.start_date)
+            .filter(Matches.home_team_id.in_(team_ids)).statement,
+        session.query(Matches.away_team_id.label('team_id'), Matches.id.label('match_id'), Matches.start_date)
+            .filter(Matches.away_team_id.in_(team_ids)).statement,
+        ).subquery()
+
+    ranked = session.query(
+            team_matches.c.team_id,
+            team_matches.c.match_id,
+            func.row_number().over(partition_by=team_matches.c.team_id, order_by=desc(team_matches.c.start_date)).label('rank'))\
+        .subquery()
+
+    return dict(session.query(ranked.c.team_id, ranked.c.match_id)
+        .filter(ranked.c.rank == 1)
+        .all())
+
+
+def save_my_line(session, line_dict: dict, existing_entry: Union[MyMoneylines, None], away_last_match_id: int, home_last_match_id: int, away_prob: float, home_prob: float) -> None:
+    """
+    Adds or updates the MyMoneylines row of a priced line. Does not commit.
+
+    :param session: SQLAlchemy session for database queries.
+    :param line_dict: The line, see get_bo1_probs.
+    :param existing_entry: The line's existing row, None to add one.
+    :param away_last_match_id: The away team's most recent match when the line was priced.
+    :param home_last_match_id: The home team's most recent match when the line was priced.
+    :param away_prob: The away team's win probability.
+    :param home_prob: The home team's win probability.
+    :return: None
     """
-    session = Session()
-
-    # For the most recent match involving the away team
-    away_last_match = session.query(Matches)\
-        .filter(or_(Matches.home_team_id == line_dict['away_team_id'], 
-                    Matches.away_team_id == line_dict['away_team_id']))\
-        .order_by(desc(Matches.start_date)).first()
-
-    # For the most recent match involving the home team
-    home_last_match = session.query(Matches)\
-        .filter(or_(Matches.home_team_id == line_dict['home_team_id'], 
-                    Matches.away_team_id == line_dict['home_team_id']))\
-        .order_by(desc(Matches.start_date)).first()
-    
-    home_last_match_id = None
-    away_last_match_id = None
-
-    if home_last_match != None:
-        home_last_match_id = home_last_match.id
-    if away_last_match != None:
-        away_last_match_id = away_last_match.id
-
-    #Check if line already calucalted in db
-    my_line = session.query(MyMoneylines)\
-        .filter(
-            MyMoneylines.away_last_match_id == away_last_match_id,
-            MyMoneylines.home_last_match_id == home_last_match_id,
-            MyMoneylines.match_id == line_dict['match_id']
-            )\
-        .first()
-
-    if my_line:
-        return 1/my_line.away_line, 1/my_line.home_line
-
-    # Fetch player stats for both teams.
-    players = fetch_match_info(line_dict['match_slug'])
-    away_player_stats = pd.DataFrame([fetch_stats_for_player(p, session) for p in players['away']]).mean()
-    home_player_stats = pd.DataFrame([fetch_stats_for_player(p, session) for p in players['home']]).mean()
-
-    # Create features for the model.
-    features = create_features(away_player_stats, home_player_stats)
-    
-    # Load the pre-trained model and predict probabilities.
-    model = None
-    with open('resources/logreg.pkl', 'rb') as file:
-        model = pickle.load(file)
-    probs = model.predict_proba(features)
-
-    # Extract probabilities for away and home teams.
-    away_prob = probs[:, 1][0]  # Class 1 (win from away team's perspective) probability.
-    home_prob = probs[:, 0][0]  # Class 0 (win from home team's perspective) probability.
-
-    #Commit my line to db
-    existing_entry = session.query(MyMoneylines).filter_by(match_id=line_dict['match_id']).first()
-
     if existing_entry:
         existing_entry.home_team=line_dict['home_team_name']
         existing_entry.home_team_id=line_dict['home_team_id']  # Assuming this ID exists in your 'teams' table
@@ -432,11 +319,93 @@ def get_bo1_prob(line_dict: dict) -> Tuple[float, float]:
         )
         session.add(moneyline_instance)
 
-    session.commit()
+
+def get_bo1_probs(line_dicts: list) -> list:
+    """
+    Calculates the probability of winning for both away and home teams of many matches at once.
+
+    Lines already priced against the teams' current most recent matches are read from MyMoneylines. The players
+    of all other lines are fetched together (see fetch_stats_for_players), the features of every match are built in
+    one pass and the pre-trained logistic regression model predicts them in one call, so the number of queries does
+    not grow with the number of lines or players.
+
+    :param line_dicts: Dictionaries containing information about the matches, including team IDs and match slug generated from pinnacle api.
+    :return: For each line, a tuple containing the win probabilities for the away and home teams, respectively.
+             None for lines whose lineups could not be fetched.
+    """
+    session = Session()
+
+    # The most recent match of every team and the stored lines of every match
+    last_matches = last_match_ids([line[side + '_team_id'] for line in line_dicts for side in ('away', 'home')], session)
+    my_lines = {}
+    for my_line in session.query(MyMoneylines)\
+            .filter(MyMoneylines.match_id.in_(list({line['match_id'] for line in line_dicts})))\
+            .order_by(MyMoneylines.id.asc())\
+            .all():
+        my_lines.setdefault(my_line.match_id, []).append(my_line)
+
+    probs = [None] * len(line_dicts)
+    unpriced = []
+    for position, line_dict in enumerate(line_dicts):
+        away_last_match_id = last_matches.get(line_dict['away_team_id'])
+        home_last_match_id = last_matches.get(line_dict['home_team_id'])
+
+        #Check if line already calucalted in db
+        my_line = next((my_line for my_line in my_lines.get(line_dict['match_id'], [])
+            if my_line.away_last_match_id == away_last_match_id and my_line.home_last_match_id == home_last_match_id), None)
+
+        if my_line:
+            probs[position] = (1/my_line.away_line, 1/my_line.home_line)
+        else:
+            unpriced.append((position, away_last_match_id, home_last_match_id))
+
+    # Fetch the lineups of both teams of every unpriced line (concurrently, cached by the lineup service).
+    lineups = get_lineup_service().get_lineups([line_dicts[position] for position, _, _ in unpriced])
+
+    to_price = []
+    slugs = []
+    for (position, away_last_match_id, home_last_match_id), players in zip(unpriced, lineups):
+        if players is None or len(players['away']) == 0 or len(players['home']) == 0:
+            log(f"Could not fetch lineups of {line_dicts[position]['match_slug']}; skipping line.", LEVEL_WARNING)
+            continue
+
+        to_price.append((position, away_last_match_id, home_last_match_id))
+        slugs += [(len(to_price) - 1, side, slug) for side in ('away', 'home') for slug in players[side]]
+
+    if len(to_price) > 0:
+        # Fetch player stats of every lineup and average them per team.
+        slugs = pd.DataFrame(slugs, columns=['line', 'side', 'slug'])
+        player_stats = fetch_stats_for_players(slugs['slug'].tolist(), session)
+        team_stats = player_stats.groupby([slugs['line'], slugs['side']]).mean()
+
+        # Create features for the model and predict probabilities with the resident pre-trained model.
+        features = create_features(team_stats.xs('away', level='side'), team_stats.xs('home', level='side'))
+        line_probs = predict_proba(features)
+
+        for (position, away_last_match_id, home_last_match_id), (home_prob, away_prob) in zip(to_price, line_probs[:, :2]):
+            # Class 1 is a win from the away team's perspective, class 0 from the home team's.
+            line_dict = line_dicts[position]
+            probs[position] = (away_prob, home_prob)
+
+            #Store my line in db
+            existing_entry = my_lines.get(line_dict['match_id'], [None])[0]
+            save_my_line(session, line_dict, existing_entry, away_last_match_id, home_last_match_id, away_prob, home_prob)
+
+        session.commit()
 
     session.close()
 
-    return away_prob, home_prob
+    return probs
+
+
+def get_bo1_prob(line_dict: dict) -> Union[Tuple[float, float], None]:
+    """
+    Calculates the probability of winning for both away and home teams in a match, see get_bo1_probs.
+
+    :param line_dict: A dictionary containing information about the match, including team IDs and match slug generated from pinnacle api.
+    :return: A tuple containing the win probabilities for the away and home teams, respectively. None if the lineups could not be fetched.
+    """
+    return get_bo1_probs([line_dict])[0]
 
 
 def probability_specific_score(p: float, wins_required: int, total_games: int) -> float:
@@ -445,8 +414,8 @@ def probability_specific_score(p: float, wins_required: int, total_games: int) -
 
     This function computes the probability of a player/team winning a specific number of games 
     out of a total number of games played, given the probability of winning a single game. It 
-    considers the order of wins and losses, using the binomial coefficient to calculate the number 
-    of sequences leading to the specific score.
+    considers the order of wins and losses, using the precomputed number of sequences leading to the
+    specific score (see series_prob.score_table).
 
     Examples:
     1. (2-1) In a best-of-3 series (total_games=3) where a player needs 2 wins to win the series 
@@ -469,12 +438,8 @@ def probability_specific_score(p: float, wins_required: int, total_games: int) -
     :param total_games: Total number of games played in the series.
     :return: Probability of achieving the specific score.
     """
-    # Calculate the number of ways to achieve the specific score.
-    number_of_sequences = comb(total_games - 1, wins_required - 1)
-
-    # Calculate the probability of achieving the specific score.
-    probability = number_of_sequences * (p ** wins_required) * ((1 - p) ** (total_games - wins_required))
-    return probability
+    # The score is a final score of a best of (2 * wins_required - 1) series.
+    return float(score_probability(p, 2 * wins_required - 1, wins_required, total_games - wins_required))
 
 
 def probability_A_wins_series(p: float, n: int) -> tuple:
@@ -498,11 +463,8 @@ def probability_A_wins_series(p: float, n: int) -> tuple:
     :param n: Total number of games in the best-of-n series.
     :return: A tuple containing the probabilities of player A winning and losing the series.
     """
-    # Number of games required to win the series.
-    games_to_win = (n // 2) + 1
-
     # Calculate the probability of winning the series.
-    win_probability = sum(binom.pmf(k, n, p) for k in range(games_to_win, n+1))
+    win_probability = float(series_probs(p, n)[0])
 
     # Calculate the probability of losing the series.
     loss_probability = 1 - win_probability
@@ -526,17 +488,8 @@ def probability_A_series_with_draw(p: float, n: int) -> tuple:
     :param n: Total number of games in the best-of-n series. Must be even and at least 2.
     :return: A tuple containing the probabilities of player A winning, losing, and drawing the series.
     """
-    # Number of games required to win the series.
-    games_to_win = (n // 2) + 1
-
-    # Calculate the probability of winning the series.
-    win_probability = sum(binom.pmf(k, n, p) for k in range(games_to_win, n + 1))
-
-    # Calculate the probability of losing the series.
-    loss_probability = sum(binom.pmf(k, n, p) for k in range(games_to_win - 1))
-
-    # Calculate the probability of a draw.
-    draw_probability = binom.pmf(n // 2, n, p)
+    # Calculate the probabilities of winning, losing and drawing the series.
+    win_probability, loss_probability, draw_probability = series_probs(p, n).tolist()
 
     return win_probability, loss_probability, draw_probability
 
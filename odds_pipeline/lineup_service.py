@@ -0,0 +1,218 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import re
+import threading
+import time
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Union
+from scraper.bo3_gg_api import fetch_json_from_url
+from scraper.http_client import HttpClient
+from odds_pipeline.log import log, LEVEL_WARNING
+
+
+LINEUP_SIZE = 5 #players per team, a JSON roster of any other size is ambiguous (bench, coach) and is not used
+LINEUP_TTL = 10 * 60 #Seconds a resolved lineup is reused
+NEAR_START_TTL = 60 #Seconds a lineup is reused once the match is about to start (late stand-ins)
+NEAR_START = 30 * 60 #Seconds before the start a match counts as about to start
+TIMEOUT = 10 #Seconds per request, pricing should not wait on a slow page
+MAX_RETRIES = 1
+MAX_WORKERS = 8 #Lineups resolved in parallel by prefetch
+LINE_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000+00:00" #line_dict['date'], UTC
+ROSTER_FALLBACK = False #Use the teams' JSON rosters when the match page fails, off until the players endpoint's response is verified
+
+LINEUP_CLASS = re.compile(r"c-widget-match-lineup--[ab]") #away (a) and home (b) lineup blocks of the match page
+
+
+def roster_url(team_id: int) -> str:
+    return f"https://api.bo3.gg/api/v1/players?filter[players.team_id][eq]={team_id}"
+
+
+def match_page_url(match_slug: str) -> str:
+    return f"https://bo3.gg/matches/{match_slug}"
+
+
+def parse_roster_json(data: Union[dict, None], team_id: int) -> Union[List[str], None]:
+    """
+    Extracts the player slugs of a team from a players response.
+
+    :param data: The response of roster_url (dict), None if the request failed.
+    :param team_id: The team (int).
+
+    :return: The slugs, None unless the team has exactly LINEUP_SIZE players.
+    """
+    if not data or not isinstance(data.get('results'), list):
+        return None
+
+    slugs = [player['slug'] for player in data['results'] if player.get('team_id') == team_id and player.get('slug')]
+    return slugs if len(slugs) == LINEUP_SIZE else None
+
+
+def parse_lineup_html(html: Union[str, bytes]) -> Union[Dict[str, List[str]], None]:
+    """
+    Extracts the lineups of a match page. Only the two lineup blocks are parsed, not the whole document.
+
+    :param html: The match page (str or bytes).
+
+    :return: A dictionary with keys 'away' and 'home', each containing a list of player slugs, None if the page has no lineups.
+    """
+    lineups = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer(class_=LINEUP_CLASS)).find_all(class_=LINEUP_CLASS)
+    if len(lineups) < 2:
+        return None
+
+    away_players = [link['href'].split('/')[-1] for link in lineups[0].find_all('a', class_="player-info", href=True)]
+    home_players = [link['href'].split('/')[-1] for link in lineups[1].find_all('a', class_="player-info", href=True)]
+
+    return {'away': away_players, 'home': home_players}
+
+
+class CachedLineup():
+    def __init__(self, players: Dict[str, List[str]], source: str, fetched_at: float):
+        self.players = players
+        self.source = source #'json' or 'html'
+        self.fetched_at = fetched_at
+
+
+class LineupService():
+    """
+    Resolves the players of upcoming matches, keyed by match slug. The lineups are extracted from the match page, which
+    shows the players of this match (stand-ins included). A team's JSON roster cannot, so it is only a fallback for when
+    the page fails, and only with roster_fallback. Lineups are cached for LINEUP_TTL, and for NEAR_START_TTL once a match
+    is about to start so late roster changes are picked up before pricing.
+    """
+
+    def __init__(self, http_client: HttpClient = None, max_workers: int = MAX_WORKERS, roster_fallback: bool = ROSTER_FALLBACK):
+        self.http_client = http_client or HttpClient(pool_size=max_workers, max_retries=MAX_RETRIES, timeout=TIMEOUT)
+        self.max_workers = max_workers
+        self.roster_fallback = roster_fallback
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def ttl(self, line_dict: dict) -> int:
+        """
+        :return: How long the lineup of a line may be reused, shorter close to the match start.
+        """
+        try:
+            start = datetime.strptime(line_dict['date'], LINE_DATE_FORMAT)
+        except (KeyError, TypeError, ValueError):
+            return LINEUP_TTL
+        return NEAR_START_TTL if (start - datetime.utcnow()).total_seconds() <= NEAR_START else LINEUP_TTL
+
+    def fetch_json_lineup(self, line_dict: dict) -> Union[Dict[str, List[str]], None]:
+        """
+        :return: The lineups from the teams' JSON rosters, None if either roster is missing or ambiguous.
+        """
+        players = {}
+        for side in ('away', 'home'):
+            team_id = line_dict.get(side + '_team_id')
+            if team_id is None:
+                return None
+            players[side] = parse_roster_json(fetch_json_from_url(roster_url(team_id), http_client=self.http_client), team_id)
+            if players[side] is None:
+                return None
+        return players
+
+    def fetch_html_lineup(self, match_slug: str) -> Union[Dict[str, List[str]], None]:
+        """
+        :return: The lineups from the match page, None if the request failed or the page has no lineups.
+        """
+        try:
+            response = self.http_client.get(match_page_url(match_slug))
+        except requests.RequestException as e:
+            log(f"Failed to fetch match page {match_slug} due to: {e}", LEVEL_WARNING)
+            return None
+
+        if response.status_code != 200:
+            return None
+        return parse_lineup_html(response.content)
+
+    def resolve(self, line_dict: dict) -> Union[CachedLineup, None]:
+        """
+        Resolves a lineup without the cache, from the match page and then, with roster_fallback, the teams' JSON rosters.
+        """
+        players = self.fetch_html_lineup(line_dict['match_slug'])
+        if players is not None:
+            return CachedLineup(players, 'html', time.time())
+
+        if self.roster_fallback:
+            players = self.fetch_json_lineup(line_dict)
+            if players is not None:
+                return CachedLineup(players, 'json', time.time())
+        return None
+
+    def get_lineup(self, line_dict: dict) -> Union[Dict[str, List[str]], None]:
+        """
+        The lineups of a line's match, from the cache while they are fresh.
+        If a refresh fails the previous lineups are kept.
+
+        :param line_dict: A line matched to a bo3.gg match (match_slug, away_team_id, home_team_id and date).
+
+        :return: A dictionary with keys 'away' and 'home', each containing a list of player slugs, None if the lineups could not be resolved.
+        """
+        match_slug = line_dict['match_slug']
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(match_slug)
+        if cached is not None and now - cached.fetched_at < self.ttl(line_dict):
+            return cached.players
+
+        resolved = self.resolve(line_dict)
+        if resolved is None:
+            return cached.players if cached is not None else None
+
+        if cached is not None and resolved.players != cached.players:
+            log(f"Lineup of {match_slug} changed: {cached.players} -> {resolved.players}")
+        with self.lock:
+            self.cache[match_slug] = resolved
+        return resolved.players
+
+    def get_lineups(self, line_dicts: List[dict]) -> List[Union[Dict[str, List[str]], None]]:
+        """
+        The lineups of many lines, resolving the ones that are not cached concurrently.
+
+        :param line_dicts: Lines matched to bo3.gg matches.
+
+        :return: The lineups of each line, see get_lineup.
+        """
+        if len(line_dicts) <= 1:
+            return [self.get_lineup(line_dict) for line_dict in line_dicts]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.get_lineup, line_dicts))
+
+    def prefetch(self, line_dicts: List[dict]) -> None:
+        """
+        Resolves the lineups of every line ahead of pricing, eg at the start of a cycle, and drops matches no longer listed.
+
+        :param line_dicts: The lines of the cycle.
+
+        :return: None
+        """
+        self.get_lineups(line_dicts)
+
+        listed = {line_dict['match_slug'] for line_dict in line_dicts}
+        with self.lock:
+            self.cache = {match_slug: cached for match_slug, cached in self.cache.items() if match_slug in listed}
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_lineup_service() -> LineupService:
+    """
+    Returns the process wide LineupService, creating it on first use.
+
+    :return: The shared LineupService.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = LineupService()
+        return _service
@@ -0,0 +1,115 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import hashlib
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from typing import List, Union
+from odds_pipeline.log import log, LEVEL_WARNING
+
+
+MODEL_PATH = current_directory / "resources" / "logreg.pkl" #bo1 win probability model (class 1 = away team wins)
+
+
+class LoadedModel():
+    """
+    A model artifact in memory with the fingerprint of the file it was loaded from.
+    """
+
+    def __init__(self, model, mtime_ns: int, size: int, digest: str):
+        self.model = model
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+
+
+class ModelRegistry():
+    """
+    Keeps every model artifact resident after its first load. A model is reloaded only when its file changes:
+    the mtime and size are checked on every access (one stat call), the file is hashed only when they moved,
+    and it is unpickled again only when the hash differs.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, path: Union[str, Path] = MODEL_PATH):
+        """
+        Returns the model of an artifact, loading or reloading it if the file changed.
+        If a reload fails (eg the file is missing or half written while it is being replaced) the model already in memory is kept.
+
+        :param path: Path of the pickled model (str or Path, optional).
+
+        :return: The unpickled model.
+        """
+        path = Path(path)
+        with self.lock:
+            loaded = self.models.get(path)
+            try:
+                stat = os.stat(path)
+                if loaded is not None and loaded.mtime_ns == stat.st_mtime_ns and loaded.size == stat.st_size:
+                    return loaded.model
+
+                with open(path, 'rb') as file:
+                    data = file.read()
+                digest = hashlib.sha256(data).hexdigest()
+
+                if loaded is not None and loaded.digest == digest: #touched but not changed
+                    loaded.mtime_ns, loaded.size = stat.st_mtime_ns, stat.st_size
+                    return loaded.model
+
+                model = pickle.loads(data)
+            except Exception as e:
+                if loaded is None:
+                    raise
+                log(f"Failed to reload model {path} due to: {e}. Keeping the loaded model.", LEVEL_WARNING)
+                return loaded.model
+
+            if loaded is not None:
+                log(f"Reloaded model {path} ({digest[:12]}).")
+            self.models[path] = LoadedModel(model, stat.st_mtime_ns, stat.st_size, digest)
+            return model
+
+    def load(self, path: Union[str, Path] = MODEL_PATH) -> None:
+        """
+        Loads a model ahead of its first use, eg at process start.
+
+        :param path: Path of the pickled model (str or Path, optional).
+
+        :return: None
+        """
+        self.get(path)
+
+    def predict_proba(self, features: Union[pd.DataFrame, List[dict]], path: Union[str, Path] = MODEL_PATH) -> np.ndarray:
+        """
+        Predicts the class probabilities of a batch of feature rows with one call of the model.
+
+        :param features: One row per prediction, with the model's feature columns (pd.DataFrame or List[dict]).
+        :param path: Path of the pickled model (str or Path, optional).
+
+        :return: The probabilities, one row per feature row and one column per class (np.ndarray).
+        """
+        if not isinstance(features, pd.DataFrame):
+            features = pd.DataFrame(features)
+        return self.get(path).predict_proba(features)
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    return _registry
+
+
+def predict_proba(features: Union[pd.DataFrame, List[dict]], path: Union[str, Path] = MODEL_PATH) -> np.ndarray:
+    """
+    Predicts with the process wide registry, see ModelRegistry.predict_proba.
+    """
+    return _registry.predict_proba(features, path)
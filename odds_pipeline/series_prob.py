@@ -0,0 +1,98 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import numpy as np
+from functools import lru_cache
+from typing import List, Tuple, Union
+
+
+SERIES_FORMATS = [1, 2, 3, 4, 5] #formats with a table built at import, even formats play every map and can end in a draw
+
+
+@lru_cache(maxsize=None)
+def score_table(bo_type: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every final score of a best of n series and the number of map sequences ending in it, from a dynamic program over the
+    maps of the series. An odd series stops once a team has won a majority of the maps, an even series plays every map.
+    Built once per format, after which the probability of a score is sequences * p^maps_A * (1 - p)^maps_B.
+
+    :param bo_type: The series format (best of n, n >= 1).
+    :return: (maps won by A, maps won by B, sequences), one entry per final score, A's best score first.
+    """
+    if bo_type < 1:
+        raise ValueError(f"best of {bo_type} is not a supported series format")
+
+    maps_to_win = bo_type // 2 + 1 if bo_type % 2 == 1 else None
+    sequences = {(0, 0): 1}
+    for _ in range(bo_type):
+        next_sequences = {}
+        for (maps_a, maps_b), count in sequences.items():
+            if maps_to_win is not None and maps_to_win in (maps_a, maps_b): #series already decided
+                next_sequences[(maps_a, maps_b)] = next_sequences.get((maps_a, maps_b), 0) + count
+                continue
+            next_sequences[(maps_a + 1, maps_b)] = next_sequences.get((maps_a + 1, maps_b), 0) + count
+            next_sequences[(maps_a, maps_b + 1)] = next_sequences.get((maps_a, maps_b + 1), 0) + count
+        sequences = next_sequences
+
+    scores = sorted(sequences, key=lambda score: (score[1] - score[0], score[1]))
+    table = (
+        np.array([maps_a for maps_a, _ in scores], dtype=np.int64),
+        np.array([maps_b for _, maps_b in scores], dtype=np.int64),
+        np.array([sequences[score] for score in scores], dtype=np.float64),
+    )
+    for array in table:
+        array.flags.writeable = False
+    return table
+
+
+def score_distribution(p: Union[float, np.ndarray], bo_type: int) -> Tuple[List[Tuple[int, int]], np.ndarray]:
+    """
+    The exact distribution of the final score of a series, eg 2-0, 2-1, 1-2 and 0-2 for a best of 3.
+
+    :param p: Probability of team A winning a single map, a float or an array of them.
+    :param bo_type: The series format (best of n).
+    :return: The scores as (maps A, maps B) and their probabilities (p.shape + (scores,)).
+    """
+    maps_a, maps_b, sequences = score_table(bo_type)
+    p = np.asarray(p, dtype=np.float64)[..., None]
+    return list(zip(maps_a.tolist(), maps_b.tolist())), sequences * p ** maps_a * (1 - p) ** maps_b
+
+
+def score_probability(p: Union[float, np.ndarray], bo_type: int, maps_a: int, maps_b: int) -> Union[float, np.ndarray]:
+    """
+    The probability of one final score of a series, eg score_probability(0.6, 3, 2, 1) for A winning a best of 3 2-1.
+
+    :param p: Probability of team A winning a single map, a float or an array of them.
+    :param bo_type: The series format (best of n).
+    :param maps_a: Maps won by A.
+    :param maps_b: Maps won by B.
+    :return: The probability, 0 if the score cannot be a final score of the format.
+    """
+    scores, probs = score_distribution(p, bo_type)
+    if (maps_a, maps_b) not in scores:
+        return np.zeros(np.shape(p)) if np.ndim(p) > 0 else 0.0
+    return probs[..., scores.index((maps_a, maps_b))]
+
+
+def series_probs(p: Union[float, np.ndarray], bo_type: int) -> np.ndarray:
+    """
+    The probabilities of team A winning, losing and drawing a series.
+
+    :param p: Probability of team A winning a single map, a float or an array of them.
+    :param bo_type: The series format (best of n).
+    :return: p.shape + (3,) win, loss and draw probabilities (draw is 0 for odd formats).
+    """
+    maps_a, maps_b, _ = score_table(bo_type)
+    _, probs = score_distribution(p, bo_type)
+    return np.stack([
+        probs[..., maps_a > maps_b].sum(axis=-1),
+        probs[..., maps_a < maps_b].sum(axis=-1),
+        probs[..., maps_a == maps_b].sum(axis=-1),
+    ], axis=-1)
+
+
+for bo_type in SERIES_FORMATS:
+    score_table(bo_type)
@@ -7,16 +7,15 @@ sys.path.append(current_directory_str)
 from models.models import *
 import numpy as np
 import pandas as pd
-from sqlalchemy import asc, desc, or_
+from sqlalchemy import asc
 from scraper.constants import WINDOWS
 from multiprocessing import Pool
 import os
-import concurrent.futures
 from sklearn.model_selection import KFold
 from bo3_stats.glicko import glicko2_win_prob
 from bo3_stats.stats_over_time import get_weighted_stats
+from bo3_stats.feature_store import get_feature_store
 import importlib
-import traceback
 
 
 
@@ -130,66 +129,6 @@ def get_players_ids(game_id, session):
     return teams
 
 
-def get_previous_game_id(player_id, current_game_id, session):
-    # Get the start time of the current game
-    current_game_begin_at = (
-        session.query(Games.begin_at)
-        .filter_by(id=current_game_id)
-        .scalar()
-    )
-
-    # Check if the current game's start time was successfully retrieved
-    if current_game_begin_at is None:
-        return None
-
-    # Query for the most recent game the player participated in before the current game
-    previous_game = (
-        session.query(GamePlayerStats)
-        .join(Games, GamePlayerStats.game_id == Games.id)
-        .filter(
-            GamePlayerStats.player_id == player_id,
-            GamePlayerStats.game_id != current_game_id,
-            Games.begin_at < current_game_begin_at  # Ensure the game began before the current game
-        )
-        .order_by(desc(Games.begin_at))
-        .first()
-    )
-
-    return previous_game.game_id if previous_game else None
-
-
-def get_players_stats(player_ids, game_id, session):
-    # Retrieve previous game ids for all players
-    previous_game_ids = {
-        player_id: get_previous_game_id(player_id, game_id, session) 
-        for player_id in player_ids
-    }
-    
-    # Filter out players with no previous game id
-    previous_game_ids = {k: v for k, v in previous_game_ids.items() if v is not None}
-    
-    if not previous_game_ids:
-        return {}
-    
-    # Construct complex OR condition for all (player_id, game_id) pairs
-    conditions = or_(*[
-        (CustomStatsMA.player_id == player_id) & (CustomStatsMA.game_id == game_id) 
-        for player_id, game_id in previous_game_ids.items()
-    ])
-    
-    # Query the database once to retrieve all relevant player statistics
-    player_stats = session.query(CustomStatsMA).filter(conditions).all()
-    
-    # Organize results into a dictionary
-    stats = {}
-    for player in player_stats:
-        if player.player_id not in stats:
-            stats[player.player_id] = {}
-        stats[player.player_id][player.ma] = player
-        
-    return stats
-
-
 def bayes_shrink(value, N, stat, module, A=10):
     prior = getattr(module, stat+"_mean")
 
@@ -199,95 +138,69 @@ def bayes_shrink(value, N, stat, module, A=10):
     return (A*prior + N*value) / (A+N)
 
 
-def apply_parallel(df_grouped, func):
-    results = []
-    
-    # Counter to keep track of completed rows
-    completed_rows = 0
-    
-    def callback(future):
-        nonlocal completed_rows
-        result = future.result()
-        results.append(result)
-        completed_rows += len(result)
-        if completed_rows == len(df_grouped):
-            print(f"Processed 100.00%")
-        elif completed_rows % 100 == 0:
-            print(f"Processed {round(completed_rows / len(df_grouped) * 100, 2)}%")
-    
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(func, group) for name, group in df_grouped]
-        for future in concurrent.futures.as_completed(futures):
-            future.add_done_callback(callback)
-    
-    return pd.concat(results, ignore_index=True)
+def get_team_players(game_ids, session):
+    # Query only the necessary columns of the requested games at once
+    query = session.query(
+            GamePlayerStats.game_id,
+            GamePlayerStats.player_id,
+            GamePlayerStats.team_id
+        ).filter(
+            GamePlayerStats.game_id.in_([int(game_id) for game_id in game_ids]),
+            GamePlayerStats.player_id != None
+        )
 
+    return pd.read_sql(query.statement, session.bind).drop_duplicates()
 
-def add_stats_to_csv(df, write_filename="datasets/games_stats.csv", moments_module="feature_moments"):
-    # Create a new DataFrame to store results
-    results = df.copy()
-    
-    # Add columns for custom stats
-    columns = [col.name for col in CustomStatsMA.__table__.columns if '_N' not in col.name and col.name not in ['id', 'game_id', 'player_id', 'num_rounds', 'ma']]
 
-    new_columns = {}
-    for window in WINDOWS:
-        for stat in columns:
-            new_columns[f'loser_team_{window}_{stat}'] = None
-            new_columns[f'winner_team_{window}_{stat}'] = None
+def add_stats_to_csv(df, write_filename="datasets/games_stats.csv", moments_module="feature_moments", A=10):
+    # Moving averages of the players before each game are read from the feature store (bo3_stats/feature_store.py)
+    store = get_feature_store()
+    if store is None:
+        raise FileNotFoundError("Feature store not found, build it with python bo3_stats/feature_store.py")
 
-    # Convert the dictionary of new columns to a DataFrame
-    new_columns_df = pd.DataFrame(new_columns, index=[0])
+    # Games added after the store was built would silently get older averages
+    session = Session()
+    is_current = store.is_current(session)
+    session.close()
+    if not is_current:
+        raise RuntimeError("Feature store is out of date, rebuild it with python bo3_stats/feature_store.py")
 
-    # Concatenate all new columns to the original DataFrame at once
-    results = pd.concat([results, new_columns_df], axis=1)
+    # Create a new DataFrame to store results
+    results = df.copy().reset_index(drop=True)
+    columns = store.columns
 
     #load bayes means
     bayes_module = importlib.import_module(moments_module)
+    priors = np.array([getattr(bayes_module, stat + "_mean") for stat in columns])
 
-    
-    # Function to calculate stats
-    def calculate_stats(row):
-        session = Session()
-        try:
-            #game id
-            game_id = int(row['id'].values[0])
-
-            # Get player IDs for the teams
-            teams = get_players_ids(game_id, session)
-
-            # Get the previous game's player stats
-            winner_team_stats = get_players_stats(teams[int(row['winner_team_id'].values[0])], game_id, session)
-            loser_team_stats = get_players_stats(teams[int(row['loser_team_id'].values[0])], game_id, session)
-
-            # Calculate and store the average stats for the winning and losing teams
-            for window in WINDOWS:
-                for stat in columns:
-                    if winner_team_stats:
-                        row[f'winner_team_{window}_{stat}'] = np.mean([bayes_shrink(getattr(player[window], stat), getattr(player[window], stat + "_N"), stat, bayes_module) for player in winner_team_stats.values()])
-                    else:
-                        row[f'winner_team_{window}_{stat}'] = np.nan
-
-                    if loser_team_stats:
-                        row[f'loser_team_{window}_{stat}'] = np.mean([bayes_shrink(getattr(player[window], stat), getattr(player[window], stat + "_N"), stat, bayes_module) for player in loser_team_stats.values()])
-                    else:
-                        row[f'loser_team_{window}_{stat}'] = np.nan
-        except Exception as e:
-            print("An error occurred:", str(e))
-            print("Full traceback:")
-            traceback.print_exc()
-
-        session.close()
-
-        # Set options to display all columns and rows
-        '''pd.set_option('display.max_columns', None)
-        pd.set_option('display.max_rows', None)
-        print(row)'''
-            
-        return row
-    
-    # Apply the function to each row of the DataFrame
-    results = apply_parallel(results.groupby(results.index), calculate_stats)
+    # One lookup per player of the winning and losing team of every game
+    session = Session()
+    players = get_team_players(results['id'].astype(int).unique(), session)
+    session.close()
+
+    games = results[['id', 'begin_at', 'winner_team_id', 'loser_team_id']].reset_index(names='row')
+    lookups = games.merge(players, left_on='id', right_on='game_id')
+    lookups['team'] = np.where(lookups['team_id'] == lookups['winner_team_id'], 'winner', np.where(lookups['team_id'] == lookups['loser_team_id'], 'loser', None))
+    lookups = lookups[lookups['team'].notna()].reset_index(drop=True)
+
+    # Latest averages of each player strictly before the game started, players without a previous game are left out
+    rows = store.rows_as_of(lookups['player_id'].to_numpy(), lookups['begin_at'].to_numpy())
+    lookups = lookups[rows >= 0].reset_index(drop=True)
+    rows = rows[rows >= 0]
+
+    new_columns = {}
+    for window in WINDOWS:
+        means, counts = store.lookup(rows, window, columns)
+        shrunk = (A * priors + counts * np.where(counts == 0, 0, means)) / (A + counts)
+
+        team_means = pd.DataFrame(shrunk, columns=columns).groupby([lookups['row'], lookups['team']]).mean()
+        for stat in columns:
+            for team in ['loser', 'winner']:
+                values = team_means[stat].xs(team, level='team') if team in team_means.index.get_level_values('team') else pd.Series(dtype=np.float64)
+                new_columns[f'{team}_team_{window}_{stat}'] = values.reindex(results.index).to_numpy()
+
+    # Concatenate all new columns to the original DataFrame at once
+    results = pd.concat([results, pd.DataFrame(new_columns, index=results.index)], axis=1)
 
     # Write the results to a new CSV file
     results.to_csv(write_filename, index=False)
@@ -296,6 +209,7 @@ def add_stats_to_csv(df, write_filename="datasets/games_stats.csv", moments_modu
 
 
 
+
 if __name__ == "__main__":
     add_stats_to_csv(pd.read_csv("datasets/games_glicko.csv"))
 
@@ -0,0 +1,176 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from datetime import datetime
+import gzip
+import json
+import os
+import threading
+from typing import Iterator, List, Union
+
+
+ARCHIVE_DIR = current_directory / "archive"
+FLUSH_BYTES = 4 * 1024 * 1024 #Buffered (uncompressed) bytes before the buffer is written out
+
+STREAM_EVENTS = 'events' #raw event JSON (with tournament_prizes and matches), partitioned by event start date
+STREAM_GAMES = 'games' #{'match': match JSON, 'game': game bundle}, partitioned by game begin date
+STREAM_DIMENSIONS = 'dimensions' #{'table': table name, 'id': requested id, 'results': raw results}, partitioned by fetch date
+
+UNKNOWN_PARTITION = 'unknown'
+
+
+def partition_for_date(value: Union[str, None]) -> str:
+    """
+    Maps an ISO date or datetime string from the API to its partition name.
+
+    :param value: The date string, eg '2023-05-01' or '2023-05-01T12:00:00.000Z' (str or None).
+
+    :return: The partition, 'YYYY-MM-DD' or UNKNOWN_PARTITION (str).
+    """
+    if not value or len(value) < 10:
+        return UNKNOWN_PARTITION
+    return value[:10]
+
+
+class Archive():
+    """
+    Append only archive of raw API payloads stored as gzip compressed NDJSON, one file per stream and date:
+    archive/<stream>/date=<YYYY-MM-DD>.ndjson.gz
+
+    Every flush appends one gzip member per file, so files can be appended to forever and still read with a plain gzip reader.
+    """
+
+    def __init__(self, archive_dir: Path = ARCHIVE_DIR, enabled: bool = True, flush_bytes: int = FLUSH_BYTES):
+        self.archive_dir = Path(archive_dir)
+        self.enabled = enabled
+        self.flush_bytes = flush_bytes
+        self.buffers = {}
+        self.buffered_bytes = 0
+        self.lock = threading.Lock()
+
+    def path_for(self, stream: str, partition: str) -> Path:
+        return self.archive_dir / stream / f"date={partition}.ndjson.gz"
+
+    def append(self, stream: str, partition: str, record: dict) -> None:
+        """
+        Buffers a record, writing the buffer out once it holds flush_bytes.
+
+        :param stream: STREAM_EVENTS, STREAM_GAMES or STREAM_DIMENSIONS (str).
+        :param partition: The date partition, see partition_for_date (str).
+        :param record: The JSON serialisable record (dict).
+
+        :return: None
+        """
+        if not self.enabled:
+            return
+
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.buffers.setdefault((stream, partition), []).append(line)
+            self.buffered_bytes += len(line)
+            should_flush = self.buffered_bytes >= self.flush_bytes
+
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes every buffered record to its partition file as one gzip member per file.
+
+        :return: None
+        """
+        with self.lock:
+            buffers = self.buffers
+            self.buffers = {}
+            self.buffered_bytes = 0
+
+            for (stream, partition), lines in buffers.items():
+                path = self.path_for(stream, partition)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                data = gzip.compress(''.join(lines).encode('utf-8'))
+
+                # Single write on an O_APPEND descriptor so a member is never interleaved with another writer
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+
+    def partitions(self, stream: str, start: str = None, end: str = None) -> List[Path]:
+        """
+        Lists the partition files of a stream in date order (the unknown partition last).
+
+        :param stream: The stream name (str).
+        :param start: First partition to include, 'YYYY-MM-DD' (str, optional).
+        :param end: Last partition to include, 'YYYY-MM-DD' (str, optional).
+
+        :return: The partition file paths (List[Path]).
+        """
+        paths = []
+        for path in sorted((self.archive_dir / stream).glob("date=*.ndjson.gz")):
+            partition = path.name[len("date="):-len(".ndjson.gz")]
+            if partition != UNKNOWN_PARTITION and ((start and partition < start) or (end and partition > end)):
+                continue
+            paths.append(path)
+
+        return sorted(paths, key=lambda path: UNKNOWN_PARTITION in path.name)
+
+    def read(self, stream: str, start: str = None, end: str = None) -> Iterator[dict]:
+        """
+        Streams the records of a stream in date order, then in the order they were appended.
+
+        :param stream: The stream name (str).
+        :param start: First partition to include, 'YYYY-MM-DD' (str, optional).
+        :param end: Last partition to include, 'YYYY-MM-DD' (str, optional).
+
+        :return: An iterator of records (Iterator[dict]).
+        """
+        for path in self.partitions(stream, start, end):
+            yield from read_partition(path)
+
+    def archive_event(self, event: dict) -> None:
+        self.append(STREAM_EVENTS, partition_for_date(event.get('start_date')), event)
+
+    def archive_game(self, match: dict, game_bundle: dict) -> None:
+        self.append(STREAM_GAMES, partition_for_date(game_bundle['game'].get('begin_at')), {'match': match, 'game': game_bundle})
+
+    def archive_dimension(self, table: str, record_id: int, results: list) -> None:
+        self.append(STREAM_DIMENSIONS, datetime.utcnow().strftime("%Y-%m-%d"), {'table': table, 'id': record_id, 'results': results})
+
+
+def read_partition(path: Path) -> Iterator[dict]:
+    """
+    Streams the records of one partition file. A truncated last member (eg after a crash mid write) ends the stream.
+
+    :param path: The partition file (Path).
+
+    :return: An iterator of records (Iterator[dict]).
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        try:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, OSError, ValueError):
+            return
+
+
+_archive = Archive()
+
+
+def get_archive() -> Archive:
+    return _archive
+
+
+def set_archive_enabled(enabled: bool = True) -> None:
+    """
+    Turns archiving of raw payloads in the scraper on or off.
+
+    :param enabled: Whether to archive (bool).
+
+    :return: None
+    """
+    _archive.enabled = enabled
@@ -0,0 +1,207 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
+from urllib.parse import urlparse
+from scraper.bo3_gg_api import fetch_json_from_url
+from scraper.http_client import HttpClient, get_client
+
+
+MAX_CONCURRENCY = 16 #Max requests in flight at once
+REQUESTS_PER_SECOND = 10.0 #Per host rate limit
+
+
+def games_url(match_id: int) -> str:
+    return f"https://api.bo3.gg/api/v1/games?sort=number&filter[games.match_id][eq]={match_id}&with=winner_team_clan,loser_team_clan,game_side_results,game_rounds"
+
+
+def game_players_stats_url(game_id: int) -> str:
+    return f"https://api.bo3.gg/api/v1/games/{game_id}/players_stats"
+
+
+def round_players_stats_url(game_id: int, round_number: int) -> str:
+    return f"https://api.bo3.gg/api/v1/games/{game_id}/rounds/{round_number}/players_stats"
+
+
+def team_url(team_id: int) -> str:
+    return f"https://api.bo3.gg/api/v1/teams?&filter[teams.id][eq]={team_id}"
+
+
+def player_url(player_id: int) -> str:
+    return f"https://api.bo3.gg/api/v1/players?&filter[id][eq]={player_id}&with=country"
+
+
+def failed_match_bundle(match_id: int) -> dict:
+    """
+    The bundle of a match whose games could not be fetched, the match is counted as not persisted by the scraper.
+    """
+    return {'match_id': match_id, 'games': None}
+
+
+class HostRateLimiter():
+    """Spaces out requests to the same host so that no host sees more than `rate` requests per second."""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = {}
+        self.locks = {}
+
+    async def wait(self, url: str) -> None:
+        """
+        Sleeps until the host of the given url has a free request slot.
+
+        :param url: The url about to be requested (str).
+
+        :return: None
+        """
+        host = urlparse(url).netloc
+        lock = self.locks.setdefault(host, asyncio.Lock())
+
+        async with lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncFetcher():
+    """Fetches bo3.gg API urls concurrently with a bounded number of requests in flight and a shared connection pool."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, requests_per_second: float = REQUESTS_PER_SECOND, headers: dict = None, http_client: HttpClient = None):
+        self.max_concurrency = max_concurrency
+        self.headers = headers
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.semaphore = None
+
+        # One keep-alive pool shared by every worker thread
+        self.http_client = http_client or get_client()
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    async def fetch(self, url: str) -> Union[dict, list, None]:
+        """
+        Fetches the JSON at url once a concurrency slot and a rate limit slot are free.
+
+        :param url: The url to fetch (str).
+
+        :return: The parsed JSON, or None if the request failed (same contract as fetch_json_from_url).
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self.semaphore:
+            await self.rate_limiter.wait(url)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fetch_json_from_url, url, self.headers, self.http_client)
+
+    async def fetch_all(self, urls: List[str]) -> List[Union[dict, list, None]]:
+        """
+        Fetches every url concurrently.
+
+        :param urls: The urls to fetch (List[str]).
+
+        :return: The parsed JSON for each url, in the same order as urls.
+        """
+        return await asyncio.gather(*[self.fetch(url) for url in urls])
+
+    async def fetch_game_bundle(self, game: dict) -> dict:
+        """
+        Fetches the game level player stats and the player stats of every round of a game concurrently.
+
+        :param game: The game JSON as returned by the games endpoint (dict).
+
+        :return: A dict with keys 'game', 'players_stats' and 'rounds_players_stats' (one entry per round, in round order).
+        """
+        num_rounds = game['rounds_count'] or 0
+        urls = [game_players_stats_url(game['id'])] + [round_players_stats_url(game['id'], i) for i in range(1, num_rounds + 1)]
+        results = await self.fetch_all(urls)
+
+        return {
+            'game': game,
+            'players_stats': results[0],
+            'rounds_players_stats': results[1:] if game['rounds_count'] is not None else None,
+        }
+
+    async def fetch_match_bundle(self, match_id: int) -> dict:
+        """
+        Fetches every game of a match and all of their player and round data concurrently.
+
+        :param match_id: The ID of the match (int).
+
+        :return: A dict with keys 'match_id' and 'games' (a list of game bundles in map order, None if the match could not be fetched).
+        """
+        games = await self.fetch(games_url(match_id))
+        if not isinstance(games, dict) or not isinstance(games.get('results'), list):
+            return failed_match_bundle(match_id)
+
+        bundles = await asyncio.gather(*[self.fetch_game_bundle(game) for game in games['results']])
+
+        return {'match_id': match_id, 'games': list(bundles)}
+
+    async def fetch_match_bundles(self, match_ids: List[int]) -> Dict[int, dict]:
+        """
+        Fetches the bundles of several matches concurrently.
+
+        :param match_ids: The IDs of the matches (List[int]).
+
+        :return: A dict mapping match ID to its match bundle, a match that failed does not affect the others.
+        """
+        bundles = await asyncio.gather(*[self.fetch_match_bundle(match_id) for match_id in match_ids], return_exceptions=True)
+        return {
+            match_id: failed_match_bundle(match_id) if isinstance(bundle, Exception) else bundle
+            for match_id, bundle in zip(match_ids, bundles)
+        }
+
+
+def fetch_match_bundles(match_ids: List[int], max_concurrency: int = MAX_CONCURRENCY, requests_per_second: float = REQUESTS_PER_SECOND) -> Dict[int, dict]:
+    """
+    Synchronous entry point used by the scraper: fetches all games, game player stats and round player stats
+    of the given matches concurrently.
+
+    :param match_ids: The IDs of the matches to fetch (List[int]).
+    :param max_concurrency: Max number of requests in flight (int, optional).
+    :param requests_per_second: Max requests per second per host (float, optional).
+
+    :return: A dict mapping match ID to its match bundle (see AsyncFetcher.fetch_match_bundle).
+    """
+    if len(match_ids) == 0:
+        return {}
+
+    fetcher = AsyncFetcher(max_concurrency=max_concurrency, requests_per_second=requests_per_second)
+    try:
+        return asyncio.run(fetcher.fetch_match_bundles(match_ids))
+    finally:
+        fetcher.close()
+
+
+def fetch_urls(urls: List[str], max_concurrency: int = MAX_CONCURRENCY, requests_per_second: float = REQUESTS_PER_SECOND, headers: dict = None) -> List[Union[dict, list, None]]:
+    """
+    Synchronous entry point that fetches a list of urls concurrently (duplicates are fetched once).
+
+    :param urls: The urls to fetch (List[str]).
+    :param max_concurrency: Max number of requests in flight (int, optional).
+    :param requests_per_second: Max requests per second per host (float, optional).
+    :param headers: Request headers sent with every request (dict, optional).
+
+    :return: The parsed JSON for each unique url, in first seen order.
+    """
+    urls = list(dict.fromkeys(urls))
+    if len(urls) == 0:
+        return []
+
+    fetcher = AsyncFetcher(max_concurrency=max_concurrency, requests_per_second=requests_per_second, headers=headers)
+    try:
+        return asyncio.run(fetcher.fetch_all(urls))
+    finally:
+        fetcher.close()
@@ -10,6 +10,8 @@ import json
 import requests
 from sqlalchemy import  JSON
 from scraper.constants import *
+from scraper.http_client import HttpClient, get_client
+from scraper.response_cache import get_cache, ttl_for_url
 from typing import Union
 
 
@@ -32,11 +34,17 @@ def print_dict_to_file_pretty(dictionary: dict, filename: str = "output.json") -
         file.write(json_string)
 
 
-def fetch_json_from_url(url: str, headers: dict = None) -> Union[dict, None]:
+def fetch_json_from_url(url: str, headers: dict = None, http_client: HttpClient = None) -> Union[dict, None]:
     """
     Fetches and returns formatted JSON data from a given URL.
 
+    Requests go through a pooled keep-alive HttpClient which retries 429/5xx responses and network errors
+    with exponential backoff before giving up. bo3.gg responses are cached on disk (see response_cache.TTL_RULES);
+    fresh entries are served without a request and stale ones are revalidated with ETag / Last-Modified.
+
     :param url: The URL from which to fetch the JSON data (str).
+    :param headers: Optional request headers (dict).
+    :param http_client: Optional client to send the request with, defaults to the shared client (HttpClient).
 
     :return:
     - dict: The parsed JSON data if the request is successful.
@@ -54,15 +62,36 @@ def fetch_json_from_url(url: str, headers: dict = None) -> Union[dict, None]:
     else:
         print("Failed to fetch or parse JSON data.")
     """
+    cache = get_cache()
+    ttl = ttl_for_url(url)
+    entry = cache.load(url) if ttl is not None else None
+
+    if entry is not None and cache.is_fresh(entry, ttl):
+        return entry['body']
+
     try:
-        response = requests.get(url, headers=headers)
+        request_headers = dict(headers or {})
+        if entry is not None:
+            request_headers.update(cache.conditional_headers(entry))
+
+        response = (http_client or get_client()).get(url, headers=request_headers)
+
+        if response.status_code == 304 and entry is not None: # Not modified since cached
+            cache.touch(url, entry)
+            return entry['body']
+
         response.raise_for_status()  # Raise an exception for HTTP errors
 
         if response.headers.get('Content-Encoding', '').lower() == "br":
-            return json.loads(response.content.decode('utf-8'))
+            data = json.loads(response.content.decode('utf-8'))
+        else:
+            # Parse the JSON data
+            data = response.json() #TODO consider checks that ensure data isnt empty etc...
+
+        if ttl is not None:
+            cache.store(url, data, response.headers)
 
-        # Parse and return the JSON data
-        return response.json() #TODO consider checks that ensure data isnt empty etc...
+        return data
 
     except requests.RequestException as e:
         print(f"Network error: {e}")
@@ -0,0 +1,190 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+from sqlalchemy.dialects.postgresql import insert
+from typing import Dict, List, Type
+
+
+CHUNK_SIZE = 1000 #Max rows per INSERT statement
+MAX_PARAMS = 30000 #Keeps wide tables (round_player_stats) well under the postgres bind parameter limit
+
+# Parents before children so foreign keys are always satisfied
+FLUSH_ORDER = [
+    Regions, Countries, Teams, Players, Events, Prizes, Matches, Games,
+    Rounds, RoundTeamStats, GamePlayerStats, RoundPlayerStats,
+]
+
+BULK_WRITER_KEY = 'bulk_writer' #key of the writer in Session.info
+
+
+class BulkUpserter():
+    """
+    Buffers parsed rows per table and writes them with INSERT ... ON CONFLICT (id) DO UPDATE in chunks,
+    in foreign key order. Rows with the same id are merged, later values win (same as add_row_by_id).
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.rows = {}
+        self.columns = {}
+        self.undo = None #(table, id, previous row or None) of every change since savepoint(), None without a savepoint
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.rows.values())
+
+    def add(self, data: dict, table: Type[Base]) -> None:
+        """
+        Buffers a row. Keys of data that are not columns of the table are ignored.
+
+        :param data: A dictionary with an 'id' key plus column values, as returned by the parse_*_json functions.
+        :param table: The SQLAlchemy table class the row belongs to.
+
+        :return: None
+        """
+        columns = self.columns.get(table)
+        if columns is None:
+            columns = self.columns[table] = set(table.__table__.columns.keys())
+
+        row = {key: value for key, value in data.items() if key in columns}
+
+        rows = self.rows.setdefault(table, {})
+        self.remember(table, row['id'])
+        if row['id'] in rows:
+            rows[row['id']].update(row)
+        else:
+            rows[row['id']] = row
+
+    def contains(self, record_id: int, table: Type[Base]) -> bool:
+        return record_id in self.rows.get(table, {})
+
+    def update(self, record_id: int, table: Type[Base], values: dict) -> None:
+        """
+        Updates columns of an already buffered row.
+
+        :param record_id: The id of the buffered row (int).
+        :param table: The SQLAlchemy table class the row belongs to.
+        :param values: Column values to set (dict).
+
+        :return: None
+        """
+        self.remember(table, record_id)
+        self.rows[table][record_id].update(values)
+
+    def remember(self, table: Type[Base], record_id: int) -> None:
+        #records the buffered row before a change, so rollback_to_savepoint can restore it
+        if self.undo is not None:
+            previous = self.rows.get(table, {}).get(record_id)
+            self.undo.append((table, record_id, dict(previous) if previous is not None else None))
+
+    def savepoint(self) -> None:
+        """
+        Starts recording changes to the buffer, so the rows added by a unit of work (eg one archived record) can be
+        discarded again without losing the rows buffered before it. Costs O(rows changed), not O(rows buffered).
+
+        :return: None
+        """
+        self.undo = []
+
+    def rollback_to_savepoint(self) -> None:
+        """
+        Restores the buffer to its state at savepoint().
+
+        :return: None
+        """
+        for table, record_id, previous in reversed(self.undo or []):
+            if previous is None:
+                self.rows[table].pop(record_id, None)
+            else:
+                self.rows[table][record_id] = previous
+        self.undo = None
+
+    def release_savepoint(self) -> None:
+        self.undo = None
+
+    def clear(self) -> None:
+        self.rows = {}
+        self.undo = None
+
+    def flush(self, session: Session) -> int:
+        """
+        Writes every buffered row through the session and empties the buffer. Does not commit.
+
+        :param session: An SQLAlchemy session object.
+
+        :return: The number of rows written (int).
+        """
+        tables = FLUSH_ORDER + [table for table in self.rows if table not in FLUSH_ORDER]
+        written = 0
+
+        for table in tables:
+            for chunk in self.chunks(list(self.rows.get(table, {}).values())):
+                session.execute(upsert_statement(table, chunk))
+                written += len(chunk)
+
+        self.clear()
+        return written
+
+    def chunks(self, rows: List[dict]) -> List[List[dict]]:
+        """
+        Groups rows that set the same columns (a multi row VALUES needs identical keys) and splits each group into chunks.
+
+        :param rows: Buffered rows of a single table (List[dict]).
+
+        :return: A list of chunks (List[List[dict]]).
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row.keys())), []).append(row)
+
+        chunks = []
+        for keys, group in groups.items():
+            size = max(1, min(self.chunk_size, MAX_PARAMS // len(keys)))
+            chunks.extend(group[i:i+size] for i in range(0, len(group), size))
+        return chunks
+
+
+def upsert_statement(table: Type[Base], rows: List[dict], index_elements: List[str] = ['id']):
+    """
+    Builds an INSERT ... ON CONFLICT DO UPDATE statement that only overwrites the columns present in rows.
+
+    :param table: The SQLAlchemy table class.
+    :param rows: Rows that all have the same keys (List[dict]).
+    :param index_elements: The conflict target columns (List[str], optional). Defaults to the id primary key.
+
+    :return: The postgres insert statement.
+    """
+    stmt = insert(table.__table__).values(rows)
+    update_columns = {key: stmt.excluded[key] for key in rows[0] if key not in index_elements}
+
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=update_columns)
+
+
+def get_bulk_writer(session: Session) -> BulkUpserter:
+    """
+    Returns the BulkUpserter attached to the session, or None if rows are written one by one.
+
+    :param session: An SQLAlchemy session object.
+
+    :return: The attached BulkUpserter or None.
+    """
+    return session.info.get(BULK_WRITER_KEY)
+
+
+def attach_bulk_writer(session: Session, chunk_size: int = CHUNK_SIZE) -> BulkUpserter:
+    """
+    Attaches a new BulkUpserter to the session so add_row_by_id buffers rows instead of writing them one by one.
+
+    :param session: An SQLAlchemy session object.
+    :param chunk_size: Max rows per INSERT statement (int, optional).
+
+    :return: The attached BulkUpserter.
+    """
+    writer = BulkUpserter(chunk_size)
+    session.info[BULK_WRITER_KEY] = writer
+    return writer
@@ -0,0 +1,201 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+from scraper.bulk_writer import upsert_statement
+from datetime import datetime
+import hashlib
+import json
+from typing import Dict, List, Union
+
+
+ENTITY_EVENT = 'event'
+ENTITY_MATCH = 'match'
+ENTITY_GAME = 'game'
+
+STAGE_FETCHED = 'fetched' #raw responses are in the on disk response cache
+STAGE_PARSED = 'parsed' #the entity's own row is committed, its children may not be
+STAGE_PERSISTED = 'persisted' #the entity and all of its children are committed
+
+MAX_ATTEMPTS = 3 #Failures before an entity is skipped until its fingerprint changes
+MAX_ERROR_LENGTH = 500
+
+STATE_KEY = ['entity', 'entity_id']
+
+
+def fingerprint(*values) -> str:
+    """
+    Hashes the given JSON serialisable values into a short stable fingerprint.
+
+    :return: The hex digest (str).
+    """
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def match_fingerprint(match: dict) -> str:
+    """
+    Fingerprints the fields of a match JSON that change while it is played and parsed by bo3.gg.
+
+    :param match: A match JSON as embedded in the tournaments endpoint (dict).
+
+    :return: The fingerprint (str).
+    """
+    return fingerprint(match.get('status'), match.get('parsed_status'), match.get('team1_score'), match.get('team2_score'), match.get('winner_team_id'))
+
+
+def event_fingerprint(event: dict) -> str:
+    """
+    Fingerprints an event JSON from its status and the fingerprint of every match, so an unchanged event can be skipped without any further work.
+
+    :param event: An event JSON as returned by the tournaments endpoint (dict).
+
+    :return: The fingerprint (str).
+    """
+    matches = sorted((match['id'], match_fingerprint(match)) for match in event.get('matches') or [])
+    return fingerprint(event.get('status'), event.get('end_date'), matches)
+
+
+def load_states(session: Session, entity: str, entity_ids: List[int]) -> Dict[int, CrawlState]:
+    """
+    Loads the crawl state of several entities with a single query.
+
+    :param session: An SQLAlchemy session object.
+    :param entity: ENTITY_EVENT, ENTITY_MATCH or ENTITY_GAME (str).
+    :param entity_ids: The IDs to load (List[int]).
+
+    :return: A dict mapping entity ID to a detached snapshot of its CrawlState. IDs that were never crawled are missing.
+    """
+    if len(entity_ids) == 0:
+        return {}
+
+    states = session.query(CrawlState).filter(CrawlState.entity == entity, CrawlState.entity_id.in_(entity_ids)).all()
+    return detach(session, states)
+
+
+def load_child_states(session: Session, entity: str, parent_id: int) -> Dict[int, CrawlState]:
+    """
+    Loads the crawl state of every child of a parent, eg every game of a match.
+
+    :param session: An SQLAlchemy session object.
+    :param entity: The entity type of the children (str).
+    :param parent_id: The ID of the parent (int).
+
+    :return: A dict mapping entity ID to a detached snapshot of its CrawlState.
+    """
+    states = session.query(CrawlState).filter(CrawlState.entity == entity, CrawlState.parent_id == parent_id).all()
+    return detach(session, states)
+
+
+def detach(session: Session, states: List[CrawlState]) -> Dict[int, CrawlState]:
+    """
+    Detaches loaded states from the session so the per game commits do not expire them (and reload them one query at a time).
+
+    :param session: An SQLAlchemy session object.
+    :param states: The loaded CrawlState rows (List[CrawlState]).
+
+    :return: A dict mapping entity ID to its CrawlState.
+    """
+    for state in states:
+        session.expunge(state)
+    return {state.entity_id: state for state in states}
+
+
+def is_done(state: Union[CrawlState, None], current_fingerprint: str) -> bool:
+    """
+    Checks if an entity is fully persisted and has not changed remotely since.
+
+    :param state: The stored CrawlState or None (CrawlState).
+    :param current_fingerprint: The fingerprint of the freshly fetched JSON (str).
+
+    :return: True if the entity can be skipped, False otherwise.
+    """
+    return state is not None and state.stage == STAGE_PERSISTED and state.fingerprint == current_fingerprint
+
+
+def is_exhausted(state: Union[CrawlState, None], current_fingerprint: str) -> bool:
+    """
+    Checks if an entity has failed MAX_ATTEMPTS times in a row with its current fingerprint. It is retried once it changes remotely.
+
+    :param state: The stored CrawlState or None (CrawlState).
+    :param current_fingerprint: The fingerprint of the freshly fetched JSON (str).
+
+    :return: True if the entity should not be retried yet, False otherwise.
+    """
+    return state is not None and state.fingerprint == current_fingerprint and (state.attempts or 0) >= MAX_ATTEMPTS
+
+
+def checkpoint(session: Session, entity: str, entity_ids: Union[int, List[int]], stage: str, parent_id: int = None, fingerprint: str = None) -> None:
+    """
+    Records that entities reached a stage. Runs in the caller's transaction (does not commit),
+    so the checkpoint is committed atomically with the rows it describes.
+
+    Reaching STAGE_PERSISTED clears the failure count.
+
+    :param session: An SQLAlchemy session object.
+    :param entity: ENTITY_EVENT, ENTITY_MATCH or ENTITY_GAME (str).
+    :param entity_ids: The ID or IDs of the entities (int or List[int]).
+    :param stage: STAGE_FETCHED, STAGE_PARSED or STAGE_PERSISTED (str).
+    :param parent_id: The ID of the parent entity (int, optional).
+    :param fingerprint: The fingerprint of the entity (str, optional).
+
+    :return: None
+    """
+    if isinstance(entity_ids, int):
+        entity_ids = [entity_ids]
+    if len(entity_ids) == 0:
+        return
+
+    rows = []
+    for entity_id in entity_ids:
+        row = {'entity': entity, 'entity_id': entity_id, 'stage': stage, 'updated_at': datetime.utcnow()}
+        if parent_id is not None:
+            row['parent_id'] = parent_id
+        if fingerprint is not None:
+            row['fingerprint'] = fingerprint
+        if stage == STAGE_PERSISTED:
+            row['attempts'] = 0
+            row['last_error'] = None
+        rows.append(row)
+
+    session.execute(upsert_statement(CrawlState, rows, index_elements=STATE_KEY))
+
+
+def record_failure(session: Session, entity: str, entity_id: int, error: Exception, state: Union[CrawlState, None] = None, parent_id: int = None, fingerprint: str = None) -> int:
+    """
+    Counts a failed attempt at crawling an entity and commits it. The stage is left unchanged, except that a
+    persisted entity is downgraded to parsed. Call after rolling back the failed transaction.
+
+    :param session: An SQLAlchemy session object.
+    :param entity: ENTITY_EVENT, ENTITY_MATCH or ENTITY_GAME (str).
+    :param entity_id: The ID of the entity (int).
+    :param error: The exception that caused the failure (Exception).
+    :param state: The CrawlState loaded before the attempt, if any (CrawlState, optional).
+    :param parent_id: The ID of the parent entity (int, optional).
+    :param fingerprint: The fingerprint of the entity (str, optional).
+
+    :return: The number of consecutive failures with this fingerprint (int).
+    """
+    attempts = 1
+    if state is not None and state.fingerprint == fingerprint:
+        attempts = (state.attempts or 0) + 1
+
+    row = {
+        'entity': entity,
+        'entity_id': entity_id,
+        'attempts': attempts,
+        'last_error': str(error)[:MAX_ERROR_LENGTH],
+        'updated_at': datetime.utcnow(),
+    }
+    if state is not None and state.stage == STAGE_PERSISTED:
+        row['stage'] = STAGE_PARSED #persisted under an older fingerprint, its own row exists but is out of date
+    if parent_id is not None:
+        row['parent_id'] = parent_id
+    if fingerprint is not None:
+        row['fingerprint'] = fingerprint
+
+    session.execute(upsert_statement(CrawlState, [row], index_elements=STATE_KEY))
+    session.commit()
+    return attempts
@@ -0,0 +1,145 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+from typing import Union
+import requests
+from requests.adapters import HTTPAdapter
+
+
+POOL_SIZE = 32 #Max keep-alive connections kept open per host
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5 #Seconds, doubled every attempt
+BACKOFF_MAX = 30 #Seconds
+TIMEOUT = 30 #Seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient():
+    """Pooled keep-alive HTTP client that retries 429/5xx responses and network errors with exponential backoff and jitter."""
+
+    def __init__(self, pool_size: int = POOL_SIZE, max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX, timeout: float = TIMEOUT):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def get(self, url: str, headers: dict = None) -> requests.Response:
+        """
+        Sends a GET request over the pooled session, retrying on 429/5xx responses and network errors.
+
+        :param url: The URL to request (str).
+        :param headers: Optional request headers (dict).
+
+        :return: The last response received. Its status may still be an error once retries are exhausted.
+
+        :raises:
+        - requests.RequestException: If the last attempt failed with a network error.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+
+            time.sleep(self.backoff_delay(attempt, response))
+            attempt += 1
+
+    def backoff_delay(self, attempt: int, response: requests.Response = None) -> float:
+        """
+        Computes how long to wait before the next attempt. A Retry-After header from the server takes priority,
+        otherwise full jitter exponential backoff is used.
+
+        :param attempt: The number of attempts already retried (int).
+        :param response: The failed response, if any (requests.Response, optional).
+
+        :return: The delay in seconds (float).
+        """
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+def parse_retry_after(value: str) -> Union[float, None]:
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date.
+
+    :param value: The raw header value (str).
+
+    :return: The number of seconds to wait, or None if the header is missing or malformed.
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """
+    Returns the process wide HttpClient, creating it on first use.
+
+    :return: The shared HttpClient.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def configure_client(**kwargs) -> HttpClient:
+    """
+    Replaces the process wide HttpClient with one built from the given settings
+    (pool_size, max_retries, backoff_base, backoff_max, timeout).
+
+    :return: The new shared HttpClient.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = HttpClient(**kwargs)
+        return _client
@@ -0,0 +1,141 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from models.models import *
+import threading
+from typing import Type, Union
+
+
+DIMENSION_TABLES = [Regions, Countries, Teams, Players]
+
+
+class IdRegistry():
+    """
+    In memory set of the primary keys of the dimension tables, so existence checks during a crawl
+    do not need a database round trip.
+
+    Ids added during a transaction are pending until commit() and are forgotten again on rollback().
+    """
+
+    def __init__(self, tables: list = DIMENSION_TABLES):
+        self.ids = {table: set() for table in tables}
+        self.pending = {table: set() for table in tables}
+        self.since_savepoint = None #ids added since savepoint(), None without a savepoint
+        self.lock = threading.Lock()
+
+    def preload(self, session: Session) -> None:
+        """
+        Loads every existing primary key of the tracked tables.
+
+        :param session: An SQLAlchemy session object.
+
+        :return: None
+        """
+        for table in self.ids:
+            ids = {record_id for (record_id,) in session.query(table.id).yield_per(10000)}
+            with self.lock:
+                self.ids[table] |= ids
+
+    def tracks(self, table: Type[Base]) -> bool:
+        return table in self.ids
+
+    def known(self, record_id: int, table: Type[Base]) -> bool:
+        return record_id in self.ids[table]
+
+    def add(self, record_id: int, table: Type[Base]) -> None:
+        with self.lock:
+            if record_id not in self.ids[table]:
+                self.ids[table].add(record_id)
+                self.pending[table].add(record_id)
+                if self.since_savepoint is not None:
+                    self.since_savepoint[table].add(record_id)
+
+    def claim(self, record_id: int, table: Type[Base]) -> bool:
+        """
+        Atomically marks an id as known.
+
+        :param record_id: The id to claim (int).
+        :param table: The SQLAlchemy table class.
+
+        :return: True if the id was unseen and the caller should fetch it, False if it is already known or claimed.
+        """
+        if record_id is None:
+            return False
+
+        with self.lock:
+            if record_id in self.ids[table]:
+                return False
+            self.ids[table].add(record_id)
+            self.pending[table].add(record_id)
+            if self.since_savepoint is not None:
+                self.since_savepoint[table].add(record_id)
+            return True
+
+    def commit(self) -> None:
+        with self.lock:
+            for table in self.pending:
+                self.pending[table].clear()
+            self.since_savepoint = None
+
+    def rollback(self) -> None:
+        with self.lock:
+            for table in self.pending:
+                self.ids[table] -= self.pending[table]
+                self.pending[table].clear()
+            self.since_savepoint = None
+
+    def savepoint(self) -> None:
+        """
+        Starts recording the ids added from now on, so they can be forgotten without a full rollback().
+
+        :return: None
+        """
+        with self.lock:
+            self.since_savepoint = {table: set() for table in self.ids}
+
+    def rollback_to_savepoint(self) -> None:
+        """
+        Forgets the ids added since savepoint(), the ids pending before it stay pending.
+
+        :return: None
+        """
+        with self.lock:
+            for table, ids in (self.since_savepoint or {}).items():
+                self.ids[table] -= ids
+                self.pending[table] -= ids
+            self.since_savepoint = None
+
+    def release_savepoint(self) -> None:
+        with self.lock:
+            self.since_savepoint = None
+
+
+_registry = None
+
+
+def get_registry() -> Union[IdRegistry, None]:
+    """
+    Returns the registry loaded by load_registry, or None if it has not been loaded in this process.
+
+    :return: The shared IdRegistry or None.
+    """
+    return _registry
+
+
+def load_registry(session: Session) -> IdRegistry:
+    """
+    Builds the process wide registry from the database, once per process.
+
+    :param session: An SQLAlchemy session object.
+
+    :return: The shared IdRegistry.
+    """
+    global _registry
+    if _registry is None:
+        registry = IdRegistry()
+        registry.preload(session)
+        _registry = registry
+    return _registry
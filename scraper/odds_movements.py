@@ -0,0 +1,135 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import os
+import numpy as np
+import pandas as pd
+from typing import List, Union
+
+
+MOVEMENTS_PATH = "datasets/odds_movements.csv.gz"
+MOVEMENTS_COLUMNS = ['match_id', 'side', 'timestamp', 'price'] #timestamp in unix seconds (UTC)
+
+TIMESTAMP_DTYPE = 'datetime64[ns, UTC]'
+
+SIDES = {'1': 'home', '2': 'away'} #oddspedia outcome keys of the moneyline (ot=201)
+
+
+def move_timestamp(value: Union[int, float, str]) -> int:
+    """
+    Converts the x value of an oddspedia move (unix seconds, unix milliseconds or an ISO string) to unix seconds.
+
+    :param value: The raw x value.
+
+    :return: Unix seconds (int).
+    """
+    if isinstance(value, (int, float)):
+        return int(value // 1000) if value > 1e11 else int(value)
+    return int(pd.Timestamp(value).timestamp())
+
+
+def parse_moves(match_id: int, movements: dict) -> List[tuple]:
+    """
+    Flattens a getOddsMovements response into one row per price change.
+
+    :param match_id: The oddspedia match ID (int).
+    :param movements: The 'data' of the getOddsMovements response (dict).
+
+    :return: A list of (match_id, side, timestamp, price) tuples (List[tuple]).
+    """
+    rows = []
+    if len(movements) == 0 or movements.get('error') == "#NOFTM":
+        return rows
+
+    for key, side in SIDES.items():
+        for move in movements.get(key, {}).get('average', {}).get('moves', []):
+            rows.append((match_id, side, move_timestamp(move['x']), float(move['y'])))
+    return rows
+
+
+def append_movements(rows: List[tuple], path: str = MOVEMENTS_PATH) -> None:
+    """
+    Appends movement rows to the gzip compressed csv (every call adds one gzip member, the file stays a valid gzip stream).
+
+    :param rows: (match_id, side, timestamp, price) tuples (List[tuple]).
+    :param path: Path of the movements file (str, optional).
+
+    :return: None
+    """
+    if len(rows) == 0:
+        return
+
+    df = pd.DataFrame(rows, columns=MOVEMENTS_COLUMNS)
+    df.to_csv(path, mode='a', header=not os.path.exists(path), index=False, compression='gzip')
+
+
+def load_movements(path: str = MOVEMENTS_PATH, match_ids: List[int] = None) -> pd.DataFrame:
+    """
+    Loads the movement series sorted by match and time, with duplicates from resumed backfills removed.
+
+    :param path: Path of the movements file (str, optional).
+    :param match_ids: Only load these matches (List[int], optional).
+
+    :return: A DataFrame with columns match_id, side (category), timestamp (datetime64, UTC) and price (float).
+    """
+    df = pd.read_csv(path, dtype={'match_id': np.int64, 'side': 'category', 'timestamp': np.int64, 'price': np.float64})
+
+    if match_ids is not None:
+        df = df[df['match_id'].isin(match_ids)]
+
+    df = df.drop_duplicates().sort_values(['match_id', 'timestamp'], kind='mergesort')
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True).astype(TIMESTAMP_DTYPE)
+    return df.reset_index(drop=True)
+
+
+def odds_over_time(movements: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turns the long movement series into one row per (match_id, timestamp) with the latest price of both sides,
+    the hold and the no-vig probabilities at that moment. Prices are carried forward within a match until they move.
+
+    The hold is removed proportionally, like AlgoBet.remove_hold: nv_prob = (1 / price) / (1 + hold).
+
+    :param movements: A DataFrame as returned by load_movements (pd.DataFrame).
+
+    :return: A DataFrame indexed by (match_id, timestamp) with columns home_line, away_line, hold, home_nv_prob and away_nv_prob.
+    """
+    wide = movements.pivot_table(index=['match_id', 'timestamp'], columns='side', values='price', aggfunc='last', observed=True)
+    wide = wide.reindex(columns=list(SIDES.values()))
+    wide = wide.groupby(level='match_id').ffill()
+    wide.columns = ['home_line', 'away_line']
+
+    implied_home = 1 / wide['home_line']
+    implied_away = 1 / wide['away_line']
+    wide['hold'] = implied_home + implied_away - 1.0
+    wide['home_nv_prob'] = implied_home / (1 + wide['hold'])
+    wide['away_nv_prob'] = implied_away / (1 + wide['hold'])
+
+    return wide
+
+
+def odds_at(odds: pd.DataFrame, match_ids: List[int], timestamps: List) -> pd.DataFrame:
+    """
+    Looks up the odds of each match as they were at a given moment (the last move at or before it),
+    eg to price a hypothetical entry or the closing line at kickoff.
+
+    :param odds: A DataFrame as returned by odds_over_time (pd.DataFrame).
+    :param match_ids: The match of each lookup (List[int]).
+    :param timestamps: The moment of each lookup, anything pd.to_datetime accepts (List).
+
+    :return: One row per lookup, in lookup order, with the columns of odds (NaN if the match had no move yet).
+    """
+    queries = pd.DataFrame({'match_id': np.asarray(match_ids, dtype=np.int64), 'timestamp': pd.to_datetime(timestamps, utc=True).astype(TIMESTAMP_DTYPE)})
+    queries['order'] = np.arange(len(queries.index))
+
+    odds = odds.reset_index()
+    odds['timestamp'] = odds['timestamp'].astype(TIMESTAMP_DTYPE)
+
+    merged = pd.merge_asof(
+        queries.sort_values('timestamp', kind='mergesort'),
+        odds.sort_values('timestamp', kind='mergesort'),
+        on='timestamp', by='match_id', direction='backward',
+    )
+    return merged.sort_values('order').drop(columns='order').reset_index(drop=True)
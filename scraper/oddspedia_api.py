@@ -1,7 +1,39 @@
-from bo3_gg_api import fetch_json_from_url
-from constants import ODDS_HEADERS
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from scraper.bo3_gg_api import fetch_json_from_url
+from scraper.async_fetch import AsyncFetcher, fetch_urls
+from scraper.constants import ODDS_HEADERS
+from scraper.odds_movements import MOVEMENTS_PATH, append_movements, parse_moves
+import asyncio
+import os
 import pandas as pd
 from tqdm import tqdm
+from typing import Dict, List, Set, Tuple
+
+
+MAX_CONCURRENCY = 8 #Max oddspedia requests in flight at once
+REQUESTS_PER_SECOND = 5.0
+DATES_PER_CHUNK = 14 #Dates fetched before their rows are appended to the output file
+
+ODDS_COLUMNS = [
+    'id', 'date', 'home', 'away',
+    'home_moneyline_open', 'home_moneyline_close',
+    'away_moneyline_open', 'away_moneyline_close',
+    'hold_open', 'hold_close',
+    'query_date', #the yyyy-mm-dd date that was requested, used to resume a backfill
+]
+
+
+def match_list_url(date: str, page: int) -> str:
+    return f"https://oddspedia.com/api/v1/getMatchList?excludeSpecialStatus=0&sortBy=date&perPageDefault=50&startDate={date}T00:00:00Z&endDate={date}T23:59:59Z&geoCode=CA&status=all&sport=counter-strike-global-offensive&popularLeaguesOnly=0&r=wv&page={page}&perPage=50&language=ca"
+
+
+def odds_movements_url(match_id: int) -> str:
+    return f"https://oddspedia.com/api/v1/getOddsMovements?ot=201&matchId={match_id}&inplay=0&wettsteuer=0"
 
 
 def parse_match_date(date: str) -> None:
@@ -13,20 +45,24 @@ def parse_match_date(date: str) -> None:
     total_pages = 2
 
     while page < total_pages:
-        url = f"https://oddspedia.com/api/v1/getMatchList?excludeSpecialStatus=0&sortBy=date&perPageDefault=50&startDate={date}T00:00:00Z&endDate={date}T23:59:59Z&geoCode=CA&status=all&sport=counter-strike-global-offensive&popularLeaguesOnly=0&r=wv&page={page}&perPage=50&language=ca"
-        json = fetch_json_from_url(url, headers=ODDS_HEADERS)['data']
+        json = fetch_json_from_url(match_list_url(date, page), headers=ODDS_HEADERS)['data']
         total_pages = json['total_pages']
 
         #parse_odds
         matches = json['matchList']
 
         for match in matches:
-            match_data = parse_match(match)
-            parse_moneyline_odds(match_data)
-            all_match_data.append(match_data)
+            all_match_data.append(parse_match(match))
         
         page += 1
 
+    #odds movements of every match of the day at once
+    movements = fetch_urls([odds_movements_url(match_data['id']) for match_data in all_match_data], MAX_CONCURRENCY, REQUESTS_PER_SECOND, headers=ODDS_HEADERS)
+    movements = dict(zip(dict.fromkeys(match_data['id'] for match_data in all_match_data), movements))
+
+    for match_data in all_match_data:
+        parse_moneyline_odds(match_data, movements[match_data['id']])
+
     return all_match_data
 
 
@@ -51,9 +87,12 @@ def parse_match(match: dict) -> None:
     return data
 
 
-def parse_moneyline_odds(match_data):
-    url = f"https://oddspedia.com/api/v1/getOddsMovements?ot=201&matchId={match_data['id']}&inplay=0&wettsteuer=0"
-    json = fetch_json_from_url(url, headers=ODDS_HEADERS)['data']
+def parse_moneyline_odds(match_data, movements: dict = None):
+    #movements is the prefetched getOddsMovements response, fetched here if not given
+    if movements is None:
+        movements = fetch_json_from_url(odds_movements_url(match_data['id']), headers=ODDS_HEADERS)
+
+    json = movements['data']
 
     if len(json) == 0:
         return
@@ -73,24 +112,164 @@ def parse_moneyline_odds(match_data):
 
 def parse_odds_date_range(date_range):
     # Accepts list of dates in format yyyy-mm-dd
-    odds_df = None
+    rows = []
 
     # Wrap date_range with tqdm to display a progress bar
-    for date in tqdm(date_range, desc='Processing dates'):
-        date_data_dict = parse_match_date(date)  # Assuming this returns a list of dictionaries
+    with tqdm(total=len(date_range), desc='Processing dates') as progress:
+        for i in range(0, len(date_range), DATES_PER_CHUNK):
+            chunk = date_range[i:i+DATES_PER_CHUNK]
+            for date_rows in asyncio.run(fetch_odds_dates(chunk))[0].values():
+                rows.extend(date_rows)
+            progress.update(len(chunk))
+
+    # One DataFrame from all rows instead of a concat per date
+    return pd.DataFrame(rows, columns=ODDS_COLUMNS)
+
+
+async def fetch_odds_dates(dates: List[str], max_concurrency: int = MAX_CONCURRENCY, requests_per_second: float = REQUESTS_PER_SECOND) -> Tuple[Dict[str, List[dict]], Dict[str, List[tuple]]]:
+    """
+    Fetches the match lists and the moneyline odds movements of several dates concurrently.
+
+    Every page of every date is requested at once, then the odds movements of every match found. A date is only
+    returned if all of its requests succeeded, so a failed date is fetched again by the next backfill.
+
+    :param dates: Dates in yyyy-mm-dd format (List[str]).
+    :param max_concurrency: Max number of requests in flight (int, optional).
+    :param requests_per_second: Max requests per second to oddspedia (float, optional).
+
+    :return: Two dicts mapping each successfully fetched date to its odds rows and to its full
+             (match_id, side, timestamp, price) movement series (see odds_movements.parse_moves).
+    """
+    fetcher = AsyncFetcher(max_concurrency=max_concurrency, requests_per_second=requests_per_second, headers=ODDS_HEADERS)
+    try:
+        first_pages = await fetcher.fetch_all([match_list_url(date, 1) for date in dates])
+
+        pages = {}
+        failed = set()
+        for date, response in zip(dates, first_pages):
+            if response is None:
+                failed.add(date)
+                continue
+            pages[(date, 1)] = response['data']
+
+        # Same paging as parse_match_date, pages 2 .. total_pages - 1
+        more = [(date, page) for (date, _), data in pages.items() for page in range(2, data['total_pages'])]
+        for key, response in zip(more, await fetcher.fetch_all([match_list_url(date, page) for date, page in more])):
+            if response is None:
+                failed.add(key[0])
+                continue
+            pages[key] = response['data']
+
+        rows = {date: [] for date in dates if date not in failed}
+        for (date, page), data in sorted(pages.items()):
+            if date in failed:
+                continue
+            for match in data['matchList']:
+                match_data = parse_match(match)
+                match_data['query_date'] = date
+                rows[date].append(match_data)
+
+        all_rows = [match_data for date_rows in rows.values() for match_data in date_rows]
+        movements = await fetcher.fetch_all([odds_movements_url(match_data['id']) for match_data in all_rows])
+
+        moves = {date: [] for date in rows}
+        for match_data, response in zip(all_rows, movements):
+            if response is None:
+                failed.add(match_data['query_date'])
+                continue
+            parse_moneyline_odds(match_data, response)
+            moves[match_data['query_date']].extend(parse_moves(match_data['id'], response['data']))
+    finally:
+        fetcher.close()
+
+    return {date: date_rows for date, date_rows in rows.items() if date not in failed}, {date: date_moves for date, date_moves in moves.items() if date not in failed}
+
+
+def completed_dates_path(output_path: str) -> str:
+    #sidecar of the odds csv listing every date fetched successfully, including dates without matches (no rows in the csv)
+    return output_path + ".dates"
+
+
+def mark_dates_completed(dates: List[str], output_path: str) -> None:
+    """
+    Appends successfully fetched dates to the completed dates sidecar of an odds csv.
+
+    :param dates: Dates in yyyy-mm-dd format (List[str]).
+    :param output_path: Path of the odds csv (str).
+
+    :return: None
+    """
+    if len(dates) == 0:
+        return
+
+    with open(completed_dates_path(output_path), 'a') as file:
+        file.writelines(date + "\n" for date in dates)
+
+
+def completed_dates(output_path: str) -> Set[str]:
+    """
+    Reads the dates already fetched by backfill_odds, from the odds csv and its completed dates sidecar.
+
+    A file written before the query_date column existed is migrated in place, the query date is taken from the match date.
+
+    :param output_path: Path of the odds csv (str).
+
+    :return: The set of yyyy-mm-dd dates already fetched (Set[str]).
+    """
+    done = set()
+    if os.path.exists(completed_dates_path(output_path)):
+        with open(completed_dates_path(output_path)) as file:
+            done = {line.strip() for line in file if line.strip()}
+
+    if not os.path.exists(output_path):
+        return done
+
+    header = pd.read_csv(output_path, nrows=0).columns
+    if 'query_date' not in header:
+        legacy_df = pd.read_csv(output_path)
+        legacy_df = legacy_df.drop(columns=[column for column in legacy_df.columns if column.startswith('Unnamed')]) #old files were written with the index
+        legacy_df['query_date'] = pd.to_datetime(legacy_df['date'], utc=True, errors='coerce').dt.strftime('%Y-%m-%d')
+        legacy_df.reindex(columns=ODDS_COLUMNS).to_csv(output_path, index=False)
+
+    return done | set(pd.read_csv(output_path, usecols=['query_date'])['query_date'].dropna().astype(str))
+
+
+def backfill_odds(date_range: List[str], output_path: str = "datasets/odds.csv", movements_path: str = MOVEMENTS_PATH, max_concurrency: int = MAX_CONCURRENCY, requests_per_second: float = REQUESTS_PER_SECOND) -> int:
+    """
+    Fetches the moneyline odds of every date concurrently and appends them to a csv in chunks of DATES_PER_CHUNK dates.
+    The full line movement series of every match is appended to movements_path as well.
+    Dates already fetched are skipped, so an interrupted backfill resumes where it stopped. Completed dates are also
+    recorded in a sidecar file (see completed_dates_path), so dates without any match are not fetched again either.
+
+    :param date_range: Dates in yyyy-mm-dd format (List[str]).
+    :param output_path: Path of the odds csv (str, optional).
+    :param movements_path: Path of the movement series file (str, optional).
+    :param max_concurrency: Max number of requests in flight (int, optional).
+    :param requests_per_second: Max requests per second to oddspedia (float, optional).
+
+    :return: The number of rows written (int).
+    """
+    done = completed_dates(output_path)
+    remaining = [date for date in date_range if date not in done]
+    written = 0
+
+    with tqdm(total=len(remaining), desc='Processing dates') as progress:
+        for i in range(0, len(remaining), DATES_PER_CHUNK):
+            chunk = remaining[i:i+DATES_PER_CHUNK]
+            rows, moves = asyncio.run(fetch_odds_dates(chunk, max_concurrency, requests_per_second))
+
+            # Movements first, the odds csv and then the sidecar mark the dates as done
+            append_movements([move for date in chunk for move in moves.get(date, [])], movements_path)
+
+            chunk_df = pd.DataFrame([match_data for date in chunk for match_data in rows.get(date, [])], columns=ODDS_COLUMNS)
+            chunk_df.to_csv(output_path, mode='a', header=not os.path.exists(output_path), index=False)
 
-        # Convert the list of dictionaries to a DataFrame
-        date_df = pd.DataFrame(date_data_dict)
+            mark_dates_completed([date for date in chunk if date in rows], output_path)
 
-        # If odds_df is None, it means it's the first iteration, so assign date_df to odds_df
-        if odds_df is None:
-            odds_df = date_df
-        else:
-            # Otherwise, concatenate the new DataFrame to the existing odds_df
-            odds_df = pd.concat([odds_df, date_df], ignore_index=True)
+            written += len(chunk_df.index)
+            progress.update(len(chunk))
 
-    # Return the concatenated DataFrame
-    return odds_df
+    return written
 
 
 def generate_date_range(input_path, date_column_name):
@@ -109,8 +288,7 @@ def generate_date_range(input_path, date_column_name):
 
 if __name__ == "__main__":
     dates = generate_date_range("datasets/games.csv", "begin_at")
-    odds_df = parse_odds_date_range(dates)
-    odds_df.to_csv("datasets/odds.csv")
+    backfill_odds(dates, "datasets/odds.csv")
 
 
 
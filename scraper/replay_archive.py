@@ -0,0 +1,182 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+from scraper.scrape_bo3 import *
+from scraper.archive import Archive, STREAM_DIMENSIONS, STREAM_EVENTS, STREAM_GAMES, read_partition
+from odds_pipeline.log import log, LEVEL_WARNING
+
+
+DIMENSION_LOADERS = {
+    'regions': get_region_data,
+    'countries': get_country_data,
+    'teams': get_team_data,
+    'players': get_player_data,
+}
+
+
+def begin_record(session: Session) -> None:
+    """
+    Starts a savepoint in the session's BulkUpserter and the IdRegistry before an archived record is replayed.
+    """
+    writer = get_bulk_writer(session)
+    if writer is not None:
+        writer.savepoint()
+
+    registry = get_registry()
+    if registry is not None:
+        registry.savepoint()
+
+
+def end_record(session: Session, success: bool) -> None:
+    """
+    Keeps the rows and ids of a replayed record, or discards them if the record failed part way through,
+    so a skipped record leaves no partial rows or claimed ids behind for the partition commit.
+
+    :param session: SQLAlchemy session object with a BulkUpserter attached.
+    :param success: Whether the record was replayed completely (bool).
+
+    :return: None
+    """
+    writer = get_bulk_writer(session)
+    registry = get_registry()
+
+    if success:
+        if writer is not None:
+            writer.release_savepoint()
+        if registry is not None:
+            registry.release_savepoint()
+        return
+
+    if writer is not None:
+        writer.rollback_to_savepoint()
+    if registry is not None:
+        registry.rollback_to_savepoint()
+
+
+def replay_dimensions(session: Session, archive: Archive) -> int:
+    """
+    Adds every archived region, country, team and player to the session's BulkUpserter.
+    All partitions are replayed regardless of date, since events and games of any date may reference them.
+    Tables are replayed one pass at a time in DIMENSION_LOADERS order, so a country never refetches its region.
+
+    :param session: SQLAlchemy session object with a BulkUpserter attached.
+    :param archive: The archive to read (Archive).
+
+    :return: The number of records replayed (int).
+    """
+    count = 0
+    for table, loader in DIMENSION_LOADERS.items():
+        for record in archive.read(STREAM_DIMENSIONS):
+            if record['table'] == table:
+                loader(session, record['id'], record['results'])
+                count += 1
+    return count
+
+
+def replay_events(session: Session, archive: Archive, start: str = None, end: str = None) -> int:
+    """
+    Adds every archived event and its prizes to the session's BulkUpserter.
+
+    :param session: SQLAlchemy session object with a BulkUpserter attached.
+    :param archive: The archive to read (Archive).
+    :param start: First partition to replay, 'YYYY-MM-DD' (str, optional).
+    :param end: Last partition to replay, 'YYYY-MM-DD' (str, optional).
+
+    :return: The number of records replayed (int).
+    """
+    count = 0
+    for event in archive.read(STREAM_EVENTS, start, end):
+        if claim_id(session, event['region_id'], Regions):
+            get_region_data(session, event['region_id'])
+
+        if claim_id(session, event['country_id'], Countries):
+            get_country_data(session, event['country_id'])
+
+        add_row_by_id(session, parse_event_json(event), Events)
+
+        get_prize_data(session, event.get('tournament_prizes') or [])
+        count += 1
+    return count
+
+
+def replay_games(session: Session, archive: Archive, start: str = None, end: str = None) -> int:
+    """
+    Replays every archived game (and the match it belongs to), committing once per date partition.
+    Records that fail to parse are logged and skipped, the rows they buffered before failing are discarded.
+
+    :param session: SQLAlchemy session object with a BulkUpserter attached.
+    :param archive: The archive to read (Archive).
+    :param start: First partition to replay, 'YYYY-MM-DD' (str, optional).
+    :param end: Last partition to replay, 'YYYY-MM-DD' (str, optional).
+
+    :return: The number of records replayed (int).
+    """
+    count = 0
+    for path in archive.partitions(STREAM_GAMES, start, end):
+        for record in read_partition(path):
+            begin_record(session)
+            try:
+                store_match_row(session, record['match'])
+                store_game(session, record['game'])
+                end_record(session, True)
+                count += 1
+            except Exception as e:
+                end_record(session, False)
+                log(f"Failed to replay game {record['game']['game'].get('id')} from {path.name} due to: {e}", LEVEL_WARNING)
+
+        commit_crawl(session)
+    return count
+
+
+def replay_archive(archive: Archive = None, start: str = None, end: str = None) -> dict:
+    """
+    Rebuilds the scraped tables from the raw payload archive with bulk upserts, without touching the network.
+
+    Dimensions are written first, then events, then games partition by partition, so foreign keys are always satisfied.
+    The response cache is switched to offline mode, so an id missing from the archive is served from the cache
+    (and only fetched if it was never cached either).
+
+    Crawl checkpoints are not written. The next crawl records matches found in the database as persisted.
+
+    :param archive: The archive to read (Archive, optional). Defaults to archive/ in the repo.
+    :param start: First date partition of events and games to replay, 'YYYY-MM-DD' (str, optional).
+    :param end: Last date partition of events and games to replay, 'YYYY-MM-DD' (str, optional).
+
+    :return: The number of records replayed per stream (dict).
+    """
+    archive = archive or Archive(enabled=False)
+    set_offline()
+    set_archive_enabled(False) #do not archive the archive again
+
+    session = Session()
+    load_registry(session)
+    attach_bulk_writer(session)
+
+    try:
+        counts = {STREAM_DIMENSIONS: replay_dimensions(session, archive)}
+        commit_crawl(session)
+
+        counts[STREAM_EVENTS] = replay_events(session, archive, start, end)
+        commit_crawl(session)
+
+        counts[STREAM_GAMES] = replay_games(session, archive, start, end)
+    except Exception:
+        rollback_crawl(session)
+        raise
+    finally:
+        session.close()
+
+    return counts
+
+
+if __name__ == "__main__":
+    #usage: python scraper/replay_archive.py [start YYYY-MM-DD] [end YYYY-MM-DD]
+    init_db()
+
+    start = sys.argv[1] if len(sys.argv) > 1 else None
+    end = sys.argv[2] if len(sys.argv) > 2 else None
+
+    print(replay_archive(start=start, end=end))
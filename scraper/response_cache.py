@@ -0,0 +1,167 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Union
+
+
+CACHE_DIR = current_directory / "cache" / "responses"
+FOREVER = -1 #TTL for payloads that never change
+
+# (url pattern, ttl in seconds) first match wins. Urls that match nothing are not cached.
+TTL_RULES = [
+    (re.compile(r"api\.bo3\.gg/api/v1/games/\d+/rounds/\d+/players_stats"), FOREVER), #only fetched for finished games
+    (re.compile(r"api\.bo3\.gg/api/v1/games/\d+/players_stats"), FOREVER),
+    (re.compile(r"api\.bo3\.gg/api/v1/games\?.*filter\[games\.match_id\]"), FOREVER),
+    (re.compile(r"api\.bo3\.gg/api/v1/matches\?.*upcoming"), 30),
+    (re.compile(r"api\.bo3\.gg/api/v1/tournaments\?"), 5 * 60),
+    (re.compile(r"api\.bo3\.gg/api/v1/players\?.*filter\[players\.team_id\]"), 60), #rosters of upcoming matches (lineup_service)
+    (re.compile(r"api\.bo3\.gg/api/v1/(teams|players|countries|regions)\?"), 24 * 60 * 60),
+]
+
+
+def ttl_for_url(url: str) -> Union[int, None]:
+    """
+    Looks up the cache TTL of a url from TTL_RULES.
+
+    :param url: The request url (str).
+
+    :return: The TTL in seconds, FOREVER, or None if the url should not be cached.
+    """
+    for pattern, ttl in TTL_RULES:
+        if pattern.search(url):
+            return ttl
+    return None
+
+
+class ResponseCache():
+    """On disk cache of raw JSON responses stored as gzip blobs keyed by a hash of the url."""
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, offline: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.offline = offline #serve any cached entry regardless of age (used to re-parse without the network)
+
+    def path_for_url(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.json.gz"
+
+    def load(self, url: str) -> Union[dict, None]:
+        """
+        Loads the cache entry of a url.
+
+        :param url: The request url (str).
+
+        :return: The entry dict with keys 'url', 'fetched_at', 'etag', 'last_modified', 'body', or None on a miss.
+        """
+        path = self.path_for_url(url)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('url') != url: #hash collision
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict, ttl: int) -> bool:
+        if self.offline or ttl == FOREVER:
+            return True
+        return time.time() - entry['fetched_at'] < ttl
+
+    def conditional_headers(self, entry: dict) -> dict:
+        """
+        Builds revalidation headers from a stale entry.
+
+        :param entry: A cache entry (dict).
+
+        :return: A dict with If-None-Match / If-Modified-Since when the server supplied an ETag / Last-Modified.
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url: str, body: Union[dict, list], response_headers: dict = None) -> None:
+        """
+        Writes a response body to the cache. The file is replaced atomically so concurrent readers never see partial data.
+
+        :param url: The request url (str).
+        :param body: The parsed JSON body (dict or list).
+        :param response_headers: The response headers, used for ETag / Last-Modified (dict, optional).
+
+        :return: None
+        """
+        response_headers = response_headers or {}
+        entry = {
+            'url': url,
+            'fetched_at': time.time(),
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'body': body,
+        }
+
+        path = self.path_for_url(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as file:
+                file.write(json.dumps(entry).encode('utf-8'))
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def invalidate(self, url: str) -> None:
+        """
+        Removes the cache entry of a url, eg when a payload cached forever turned out to change.
+
+        :param url: The request url (str).
+
+        :return: None
+        """
+        try:
+            os.remove(self.path_for_url(url))
+        except FileNotFoundError:
+            pass
+
+    def touch(self, url: str, entry: dict) -> None:
+        """
+        Marks a revalidated (304 Not Modified) entry as freshly fetched.
+
+        :param url: The request url (str).
+        :param entry: The cache entry that was revalidated (dict).
+
+        :return: None
+        """
+        self.store(url, entry['body'], {'ETag': entry.get('etag'), 'Last-Modified': entry.get('last_modified')})
+
+
+_cache = ResponseCache()
+
+
+def get_cache() -> ResponseCache:
+    return _cache
+
+
+def set_offline(offline: bool = True) -> None:
+    """
+    Switches the shared cache to offline mode, where every cached response is served regardless of age.
+    Use this to re-parse everything from disk after a schema change in models.py.
+
+    :param offline: Whether to serve stale entries (bool).
+
+    :return: None
+    """
+    _cache.offline = offline
@@ -4,14 +4,20 @@ current_directory_str = str(current_directory).replace('\\', '/')
 import sys
 sys.path.append(current_directory_str)
 
-from bo3_gg_api import *
+from scraper.bo3_gg_api import *
+from scraper.async_fetch import fetch_match_bundles, fetch_urls, games_url, game_players_stats_url, round_players_stats_url, team_url, player_url
+from scraper.response_cache import get_cache, set_offline
+from scraper.bulk_writer import attach_bulk_writer, get_bulk_writer
+from scraper.id_registry import get_registry, load_registry
+from scraper.crawl_state import *
+from scraper.archive import get_archive, set_archive_enabled
 from models.models import *
 from sqlalchemy import asc, desc, inspect
 from sqlalchemy.sql import select, exists
 from constants import *
 import traceback
 import time
-from typing import TypeVar, Type, List
+from typing import TypeVar, Type, List, Tuple
 from odds_pipeline.log import log, LEVEL_ERROR, LEVEL_WARNING
 
 
@@ -24,6 +30,9 @@ def add_row_by_id(session: Session, data: dict, table: Type[Table]) -> None:
     """
     Adds a new record to the table in the database.
 
+    If a BulkUpserter is attached to the session (see bulk_writer.attach_bulk_writer) the row is buffered
+    and written later with a chunked INSERT ... ON CONFLICT (id) DO UPDATE instead.
+
     :param session: An SQLAlchemy session object.
     :param data: A dictionary containing the necessary fields to create a new record.
                  Expects 'id' key in data to be related to 'id' key in table.
@@ -32,6 +41,15 @@ def add_row_by_id(session: Session, data: dict, table: Type[Table]) -> None:
 
     :return: None.
     """
+    registry = get_registry()
+    if registry is not None and registry.tracks(table):
+        registry.add(data.get('id'), table)
+
+    writer = get_bulk_writer(session)
+    if writer is not None:
+        writer.add(data, table)
+        return
+
     record = session.query(table).filter_by(id=data.get('id')).first()
 
     if record:
@@ -49,11 +67,75 @@ def id_exists(session: Session, record_id: int, my_table: Type[Table]) -> bool:
     :param record_id: The ID to check for existence.
     :param my_table: The SQLAlchemy table class representing the table.
 
-    :return: True if the ID exists, False otherwise.
+    :return: True if the ID exists (or is buffered to be written), False otherwise.
     """
+    registry = get_registry()
+    if registry is not None and registry.tracks(my_table):
+        return registry.known(record_id, my_table)
+
+    writer = get_bulk_writer(session)
+    if writer is not None and writer.contains(record_id, my_table):
+        return True
 
     return session.query(exists().where(my_table.id == record_id)).scalar()
 
+def claim_id(session: Session, record_id: int, my_table: Type[Table]) -> bool:
+    """
+    Check if a record with the given ID still has to be fetched, and mark it as seen so it is only fetched once.
+
+    Uses the in memory IdRegistry when it is loaded, otherwise falls back to id_exists.
+
+    :param session: The SQLAlchemy session object.
+    :param record_id: The ID to check (None is never fetched).
+    :param my_table: The SQLAlchemy table class representing the table.
+
+    :return: True if the ID is unseen and should be fetched, False otherwise.
+    """
+    if record_id is None:
+        return False
+
+    registry = get_registry()
+    if registry is not None and registry.tracks(my_table):
+        return registry.claim(record_id, my_table)
+
+    return not id_exists(session, record_id, my_table)
+
+def commit_crawl(session: Session) -> None:
+    """
+    Writes the rows buffered in the session's BulkUpserter, commits, and marks the claimed registry ids as committed.
+
+    :param session: SQLAlchemy session object.
+
+    :return: None
+    """
+    writer = get_bulk_writer(session)
+    if writer is not None:
+        writer.flush(session)
+
+    session.commit()
+
+    registry = get_registry()
+    if registry is not None:
+        registry.commit()
+
+def rollback_crawl(session: Session) -> None:
+    """
+    Discards the rows buffered in the session's BulkUpserter, rolls back, and forgets the registry ids claimed since the last commit.
+
+    :param session: SQLAlchemy session object.
+
+    :return: None
+    """
+    writer = get_bulk_writer(session)
+    if writer is not None:
+        writer.clear()
+
+    session.rollback()
+
+    registry = get_registry()
+    if registry is not None:
+        registry.rollback()
+
 def truncate_all_tables(session: Session) -> None:
     """
     Delete all rows from all tables using the given SQLAlchemy session. Table structures remain intact.
@@ -76,6 +158,7 @@ def truncate_all_tables(session: Session) -> None:
     session.query(Events).delete()
     session.query(Regions).delete()
     session.query(Countries).delete()
+    session.query(CrawlState).delete()
     
     # Commit the changes
     session.commit()
@@ -100,6 +183,7 @@ def drop_all_tables() -> None:
     Events.__table__.drop(session.bind)
     Countries.__table__.drop(session.bind)
     Regions.__table__.drop(session.bind)
+    CrawlState.__table__.drop(session.bind)
 
     session.commit()
     session.close()
@@ -117,6 +201,14 @@ def update_table_parameter(session: Session, table: Type, id: int, parameter_nam
 
     :return: None
     """
+    writer = get_bulk_writer(session)
+    if writer is not None and writer.contains(id, table):
+        writer.update(id, table, {parameter_name: new_value})
+        if commit:
+            writer.flush(session)
+            session.commit()
+        return
+
     event = session.query(table).filter(table.id == id).first()
 
     if not event:
@@ -172,201 +264,410 @@ def get_prize_data(session: Session, prizes: List[dict]) -> None:
     for prize in prizes:
         prize_data = parse_prize_json(prize)
         
-        if prize_data['team_id'] is not None and not id_exists(session, prize_data['team_id'], Teams):
+        if claim_id(session, prize_data['team_id'], Teams):
             get_team_data(session, prize_data['team_id'])
 
         add_row_by_id(session, prize_data, Prizes)
 
 
-def get_team_data(session: Session, team_id: int) -> None:
+def get_team_data(session: Session, team_id: int, team_data: List[dict] = None) -> None:
     """
     Fetches team data for a given team ID from the API and adds it to the database.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param team_id: The ID of the team to fetch data for (int)
+    :param team_data: Prefetched 'results' of the teams endpoint, eg from the archive (List[dict], optional).
 
     :return: None
     """
-    team_data = fetch_json_from_url("https://api.bo3.gg/api/v1/teams?&filter[teams.id][eq]={}".format(team_id))['results']
+    if team_data is None:
+        team_data = fetch_json_from_url(team_url(team_id))['results']
+        get_archive().archive_dimension('teams', team_id, team_data)
+
     if len(team_data) == 0:
         add_row_by_id(session, {'id': team_id, 'name': 'undefined', 'slug': 'undefined'}, Teams)
     for team in team_data:
         add_row_by_id(session, parse_team_json(team), Teams)
     
 
-def get_region_data(session: Session, region_id: int) -> None:
+def get_region_data(session: Session, region_id: int, region_data: List[dict] = None) -> None:
     """
     Fetches region data for a given region ID from the API and adds it to the database.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param region_id: The ID of the region to fetch data for (int).
+    :param region_data: Prefetched 'results' of the regions endpoint, eg from the archive (List[dict], optional).
 
     :return: None
     """
-    region_data = fetch_json_from_url("https://api.bo3.gg/api/v1/regions?&filter[id][eq]={}".format(region_id))['results']
+    if region_data is None:
+        region_data = fetch_json_from_url("https://api.bo3.gg/api/v1/regions?&filter[id][eq]={}".format(region_id))['results']
+        get_archive().archive_dimension('regions', region_id, region_data)
+
     for region in region_data:
         add_row_by_id(session, parse_region_json(region), Regions)
 
 
-def get_country_data(session: Session, country_id: int) -> None:
+def get_country_data(session: Session, country_id: int, country_data: List[dict] = None) -> None:
     """
     Fetches country data for a given country ID from the API and adds it to the database.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param country_id: The ID of the country to fetch data for (int).
+    :param country_data: Prefetched 'results' of the countries endpoint, eg from the archive (List[dict], optional).
 
     :return: None
     """
-    country_data = fetch_json_from_url("https://api.bo3.gg/api/v1/countries?&filter[id][eq]={}".format(country_id))['results']
+    if country_data is None:
+        country_data = fetch_json_from_url("https://api.bo3.gg/api/v1/countries?&filter[id][eq]={}".format(country_id))['results']
+        get_archive().archive_dimension('countries', country_id, country_data)
+
     for country in country_data:
-        if not id_exists(session, country['region_id'], Regions):
+        if claim_id(session, country['region_id'], Regions):
             get_region_data(session, country['region_id'])
 
         add_row_by_id(session, parse_country_json(country), Countries)
 
 
-def get_match_data(session: Session, matches: List[dict]) -> int: #TODO Multithread match fetching
+def get_match_data(session: Session, matches: List[dict], event_id: int = None) -> Tuple[int, int]:
     """
     Processes a list of match data, adds it to the database, and fetches associated game data.
 
     For each match in the provided list, this function:
-    1. Parses the match's JSON representation.
-    2. Checks if the match status is "done" or "partially_done."
-    3. Skips matches already stored in the database.
-    4. Ensures that team data for the home and away teams exists in the database.
-    5. Adds the parsed match data to the database.
-    6. Calls get_game_data to fetch and add associated game data.
+    1. Checks if the match status is "done" or "partially_done."
+    2. Skips matches that are persisted and unchanged since the last crawl (or failed MAX_ATTEMPTS times without changing).
+    3. Fetches the games, game player stats and round player stats of all remaining matches concurrently.
+    4. Stores each match (and then each of its games) in its own transaction, see store_match.
+
+    The session must not have uncommitted work, every match is committed separately.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param matches: A list of JSON representations of matches (List[dict]).
+    :param event_id: The ID of the event the matches belong to (int, optional).
 
-    :return: The number of matches processed (int).
+    :return: The number of matches processed and the number of matches that are still not persisted (Tuple[int, int]).
     """
-    for match in matches: 
-        match_data = parse_match_json(match)
+    candidates = [match for match in matches if match['status'] == "finished" and match['parsed_status'] in ('done', 'partially_done')]
+    fingerprints = {match['id']: match_fingerprint(match) for match in candidates}
+    states = load_states(session, ENTITY_MATCH, list(fingerprints))
 
-        if match['status'] != "finished":
+    unchecked = [match_id for match_id in fingerprints if match_id not in states]
+    stored = {match_id for (match_id,) in session.query(Matches.id).filter(Matches.id.in_(unchecked))} if unchecked else set()
+
+    to_fetch = []
+    not_persisted = 0
+    for match in candidates:
+        state = states.get(match['id'])
+        match_fp = fingerprints[match['id']]
+
+        if is_done(state, match_fp):
             continue
 
-        if match['parsed_status'] != 'done' and match['parsed_status'] != 'partially_done':
+        if is_exhausted(state, match_fp):
+            not_persisted += 1
             continue
 
-        if id_exists(session, match['id'], Matches): #skip matches already stored in db
+        if match['id'] in stored: #stored before crawl checkpoints existed, record it so later changes are picked up
+            checkpoint(session, ENTITY_MATCH, match['id'], STAGE_PERSISTED, parent_id=event_id, fingerprint=match_fp)
             continue
-        
-        if match_data['away_team_id'] is not None and not id_exists(session, match_data['away_team_id'], Teams):
-            get_team_data(session, match_data['away_team_id'])
 
-        if match_data['home_team_id'] is not None and not id_exists(session, match_data['home_team_id'], Teams):
-            get_team_data(session, match_data['home_team_id'])
+        if state is not None and state.fingerprint != match_fp:
+            forget_cached_match(match['id']) #changed remotely, the payloads cached forever are out of date
+
+        to_fetch.append(match)
 
-        if match_data['winner_team_id'] is not None and not id_exists(session, match_data['winner_team_id'], Teams):
-            get_team_data(session, match_data['winner_team_id'])
+    session.commit()
+
+    match_bundles = fetch_match_bundles([match['id'] for match in to_fetch])
+
+    archive = get_archive()
+    for match in to_fetch:
+        for game_bundle in match_bundles[match['id']]['games'] or []:
+            archive.archive_game(match, game_bundle) #raw copy so the db can be rebuilt offline, see replay_archive.py
 
-        if match_data['loser_team_id'] is not None and not id_exists(session, match_data['loser_team_id'], Teams):
-            get_team_data(session, match_data['loser_team_id'])
+    prefetch_new_dimensions(session, to_fetch, match_bundles)
+
+    for match in to_fetch:
+        if states.get(match['id']) is None or states[match['id']].fingerprint != fingerprints[match['id']]:
+            checkpoint(session, ENTITY_MATCH, match['id'], STAGE_FETCHED, parent_id=event_id, fingerprint=fingerprints[match['id']])
+    session.commit()
 
-        add_row_by_id(session, match_data, Matches)
+    for match in to_fetch:
+        if not store_match(session, match, match_bundles[match['id']], states.get(match['id']), fingerprints[match['id']]):
+            not_persisted += 1
 
-        get_game_data(session, match_data['id'])
-    return len(matches)
+    return len(matches), not_persisted
 
 
-def get_game_data(session: Session, match_id: int) -> None:
+def store_match(session: Session, match: dict, match_bundle: dict, state: CrawlState = None, match_fp: str = None) -> bool:
+    """
+    Stores a match and then each of its games, committing after the match row and after every game,
+    so a crash resumes at the first game that was not committed.
+
+    For the provided match, this function:
+    1. Parses the match's JSON representation.
+    2. Ensures that team data for the home and away teams exists in the database.
+    3. Adds the parsed match data to the database and commits it with a parsed checkpoint.
+    4. Calls get_game_data to add associated game data from the prefetched bundle.
+    5. Marks the match persisted once every game is committed.
+
+    Failures are recorded in the crawl state instead of being raised.
+
+    :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
+    :param match: The JSON representation of the match (dict).
+    :param match_bundle: The prefetched match bundle from fetch_match_bundles (dict).
+    :param state: The crawl state of the match before this crawl (CrawlState, optional).
+    :param match_fp: The fingerprint of the match (str, optional).
+
+    :return: True if the match and all of its games are persisted, False otherwise.
+    """
+    try:
+        if match_bundle['games'] is None:
+            raise RuntimeError(f"Failed to fetch the games of match {match['id']}")
+
+        match_data = store_match_row(session, match)
+
+        checkpoint(session, ENTITY_MATCH, match['id'], STAGE_PARSED, fingerprint=match_fp)
+        commit_crawl(session)
+
+        failed_games = get_game_data(session, match_data['id'], match_bundle, match_fp)
+        if failed_games > 0:
+            raise RuntimeError(f"{failed_games} games of match {match['id']} were not stored")
+
+        checkpoint(session, ENTITY_MATCH, match['id'], STAGE_PERSISTED, fingerprint=match_fp)
+        commit_crawl(session)
+        return True
+    except Exception as e:
+        rollback_crawl(session)
+        attempts = record_failure(session, ENTITY_MATCH, match['id'], e, state, fingerprint=match_fp)
+        log(f"Failed to process match {match['id']} (attempt {attempts}/{MAX_ATTEMPTS}) due to: {e}", LEVEL_WARNING)
+        return False
+
+
+def store_match_row(session: Session, match: dict) -> dict:
+    """
+    Parses a match JSON, ensures its teams exist and adds the match row to the database.
+
+    :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
+    :param match: The JSON representation of the match (dict).
+
+    :return: The parsed match data (dict).
+    """
+    match_data = parse_match_json(match)
+
+    if claim_id(session, match_data['away_team_id'], Teams):
+        get_team_data(session, match_data['away_team_id'])
+
+    if claim_id(session, match_data['home_team_id'], Teams):
+        get_team_data(session, match_data['home_team_id'])
+
+    if claim_id(session, match_data['winner_team_id'], Teams):
+        get_team_data(session, match_data['winner_team_id'])
+
+    if claim_id(session, match_data['loser_team_id'], Teams):
+        get_team_data(session, match_data['loser_team_id'])
+
+    add_row_by_id(session, match_data, Matches)
+
+    return match_data
+
+
+def forget_cached_match(match_id: int) -> None:
+    """
+    Removes the cached games, game player stats and round player stats responses of a match from the response cache.
+
+    :param match_id: The ID of the match (int).
+
+    :return: None
+    """
+    cache = get_cache()
+    entry = cache.load(games_url(match_id))
+
+    if entry is not None and isinstance(entry['body'], dict):
+        for game in entry['body'].get('results') or []:
+            cache.invalidate(game_players_stats_url(game['id']))
+            for i in range(1, (game.get('rounds_count') or 0) + 1):
+                cache.invalidate(round_players_stats_url(game['id'], i))
+
+    cache.invalidate(games_url(match_id))
+
+
+def prefetch_new_dimensions(session: Session, matches: List[dict], match_bundles: dict) -> None:
+    """
+    Concurrently fetches the team and player records of every unseen id referenced by the matches and their bundles.
+
+    The responses land in the on disk response cache, so the sequential get_team_data / get_player_data calls
+    that follow read them from disk instead of doing one round trip each. Ids are deduplicated, so each unseen
+    id is requested once no matter how many rounds reference it.
+
+    :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
+    :param matches: The match JSONs about to be stored (List[dict]).
+    :param match_bundles: The prefetched match bundles from fetch_match_bundles (dict).
+
+    :return: None
+    """
+    team_ids = set()
+    player_ids = set()
+
+    for match in matches:
+        team_ids.update([match.get('team1_id'), match.get('team2_id'), match.get('winner_team_id'), match.get('loser_team_id')])
+
+    for match_bundle in match_bundles.values():
+        for game_bundle in match_bundle['games'] or []:
+            rounds = game_bundle['rounds_players_stats'] or []
+            for player in [p for round_players in rounds for p in (round_players or [])]:
+                if player is None or player.get('steam_profile') is None or player['steam_profile'].get('player') is None:
+                    continue
+                team_ids.add(player['steam_profile']['player'].get('team_id'))
+                player_ids.add(player['steam_profile']['player'].get('id'))
+
+    urls = [team_url(team_id) for team_id in team_ids if team_id is not None and not id_exists(session, team_id, Teams)]
+    urls += [player_url(player_id) for player_id in player_ids if player_id is not None and not id_exists(session, player_id, Players)]
+
+    fetch_urls(urls)
+
+
+def get_game_data(session: Session, match_id: int, match_bundle: dict = None, match_fp: str = None) -> int:
     """
     Fetches game data for a given match ID from the API and adds it to the database.
 
     For each game associated with the provided match ID, this function:
-    1. Fetches the game's JSON representation.
-    2. Parses the game data.
-    3. Ensures that winner and loser team data exists in the database.
-    4. Adds the parsed game data to the database.
-    5. Calls get_game_player_stats to fetch and add player statistics for the game.
-    6. Calls get_round_data to fetch and add round data for the game.
-    7. Calls get_round_player_data to fetch and add player data for each round of the game.
+    1. Fetches the game's JSON representation (unless a prefetched bundle is given).
+    2. Skips the game if it was persisted by an earlier crawl of the unchanged match.
+    3. Calls store_game to add the game, its player statistics, rounds and round player data.
+    4. Commits the game together with its persisted checkpoint.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param match_id: The ID of the match for which game data should be fetched (int).
+    :param match_bundle: Prefetched match bundle from async_fetch.fetch_match_bundles (dict, optional).
+    :param match_fp: The fingerprint of the match, stored with each game checkpoint (str, optional).
+
+    :return: The number of games that failed and were rolled back (int).
+
+    :raises:
+    - RuntimeError: If the games of the match could not be fetched.
+    """
+    if match_bundle is None:
+        match_bundle = fetch_match_bundles([match_id])[match_id]
+
+    if match_bundle['games'] is None:
+        raise RuntimeError(f"Failed to fetch the games of match {match_id}")
+
+    game_states = load_child_states(session, ENTITY_GAME, match_id)
+    failed = 0
+
+    for game_bundle in match_bundle['games']:
+        game = game_bundle['game']
+        state = game_states.get(game['id'])
+
+        if is_done(state, match_fp):
+            continue #committed by an earlier crawl that stopped part way through the match
+
+        try:
+            store_game(session, game_bundle)
+
+            checkpoint(session, ENTITY_GAME, game['id'], STAGE_PERSISTED, parent_id=match_id, fingerprint=match_fp)
+            commit_crawl(session)
+        except Exception as e:
+            rollback_crawl(session)
+            record_failure(session, ENTITY_GAME, game['id'], e, state, parent_id=match_id, fingerprint=match_fp)
+            log(f"Failed to process game {game['id']} of match {match_id} due to: {e}", LEVEL_WARNING)
+            failed += 1
+
+    return failed
+
+
+def store_game(session: Session, game_bundle: dict) -> None:
+    """
+    Adds a game and its player stats, rounds, round team stats and round player stats to the database from a game bundle.
+
+    :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
+    :param game_bundle: A game bundle as returned by async_fetch.AsyncFetcher.fetch_game_bundle (dict).
 
     :return: None
     """
-    games = fetch_json_from_url(f"https://api.bo3.gg/api/v1/games?sort=number&filter[games.match_id][eq]={match_id}&with=winner_team_clan,loser_team_clan,game_side_results,game_rounds")['results']
-    for game in games:
-        game_data = parse_game_json(game)
+    game = game_bundle['game']
+    game_data = parse_game_json(game)
 
-        if game_data['winner_team_id'] is not None and not id_exists(session, game_data['winner_team_id'], Teams):
-            get_team_data(session, game_data['winner_team_id']) #add team if not in player table
+    if claim_id(session, game_data['winner_team_id'], Teams):
+        get_team_data(session, game_data['winner_team_id']) #add team if not in player table
 
-        if game_data['loser_team_id'] is not None and not id_exists(session, game_data['loser_team_id'], Teams):
-            get_team_data(session, game_data['loser_team_id']) #add team if not in player table
+    if claim_id(session, game_data['loser_team_id'], Teams):
+        get_team_data(session, game_data['loser_team_id']) #add team if not in player table
 
-        add_row_by_id(session, game_data, Games)
+    add_row_by_id(session, game_data, Games)
 
-        get_game_player_stats(session, game['id'])
+    get_game_player_stats(session, game['id'], game_bundle['players_stats'])
 
-        get_round_data(session, game)
+    get_round_data(session, game)
 
-        get_round_player_data(session, game['id'], game['rounds_count'])
+    get_round_player_data(session, game['id'], game['rounds_count'], game_bundle['rounds_players_stats'])
 
 
-def get_round_player_data(session: Session, game_id: int, num_rounds: int) -> None:
+def get_round_player_data(session: Session, game_id: int, num_rounds: int, rounds_players_stats: List[list] = None) -> None:
     """
     Fetches player data for each round of a game from the API and adds it to the database.
 
     For each round of the game with the provided game ID, this function:
-    1. Fetches player statistics data for that round.
+    1. Fetches player statistics data for that round (unless prefetched data is given).
     2. For each player in the round, checks if their team and player data exists in the database.
     3. Adds the parsed player statistics data to the database.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param game_id: The ID of the game for which round player data should be fetched (int).
     :param num_rounds: The number of rounds in the game (int).
+    :param rounds_players_stats: Prefetched player stats JSON for each round, in round order (List[list], optional).
 
     :return: None
     """
     if num_rounds is None:
         return
 
-    for i in range(1,num_rounds+1):
-        player_data = fetch_json_from_url(f"https://api.bo3.gg/api/v1/games/{game_id}/rounds/{i}/players_stats")
-        
+    if rounds_players_stats is None:
+        rounds_players_stats = [fetch_json_from_url(round_players_stats_url(game_id, i)) for i in range(1,num_rounds+1)]
+
+    for player_data in rounds_players_stats:
         for player in player_data:
             if player is None or player['steam_profile'] is None or player['steam_profile']['player'] is None:
                 continue
 
-            if player['steam_profile']['player']['team_id'] is not None and not id_exists(session, player['steam_profile']['player']['team_id'], Teams):
+            if claim_id(session, player['steam_profile']['player']['team_id'], Teams):
                 get_team_data(session, player['steam_profile']['player']['team_id'])
             
-            if player['steam_profile']['player']['id'] is not None and not id_exists(session, player['steam_profile']['player']['id'], Players):
+            if claim_id(session, player['steam_profile']['player']['id'], Players):
                 get_player_data(session, player['steam_profile']['player']['id'])
             
             add_row_by_id(session, parse_round_player_stats_json(player), RoundPlayerStats)
 
 
-def get_player_data(session: Session, player_id: int) -> None:
+def get_player_data(session: Session, player_id: int, player_data: List[dict] = None) -> None:
     """
     Fetches player data for a given player ID from the API and adds it to the database.
 
     For the provided player ID, this function:
-    1. Fetches the player's JSON representation.
+    1. Fetches the player's JSON representation (unless prefetched data is given).
     2. Adds the parsed player data to the database.
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param player_id: The ID of the player to fetch data for (int).
+    :param player_data: Prefetched 'results' of the players endpoint, eg from the archive (List[dict], optional).
 
     :return: None
     """
-    player_data = fetch_json_from_url(f"https://api.bo3.gg/api/v1/players?&filter[id][eq]={player_id}&with=country")['results']
+    if player_data is None:
+        player_data = fetch_json_from_url(player_url(player_id))['results']
+        get_archive().archive_dimension('players', player_id, player_data)
+
     for player in player_data:
         add_row_by_id(session, parse_player_json(player), Players)
 
 
-def get_game_player_stats(session: Session, game_id: int) -> None:
+def get_game_player_stats(session: Session, game_id: int, players_stats: list = None) -> None:
     """
     Fetches player statistics for a given game ID from the API and updates the player and player statistics tables.
 
     For the provided game ID, this function:
-    1. Fetches player statistics data for the game.
+    1. Fetches player statistics data for the game (unless prefetched data is given).
     2. Parses player statistics data and player data.
     3. Ensures that the player's country, team, and team associated with the statistics exist in the database.
     4. Updates the player data in the database.
@@ -374,10 +675,13 @@ def get_game_player_stats(session: Session, game_id: int) -> None:
 
     :param session: SQLAlchemy session object for database interactions (sqlalchemy.orm.session.Session).
     :param game_id: The ID of the game for which player statistics should be fetched and updated (int).
+    :param players_stats: Prefetched player statistics JSON for the game (list, optional).
 
     :return: None
     """
-    players_stats = fetch_json_from_url(f"https://api.bo3.gg/api/v1/games/{game_id}/players_stats")
+    if players_stats is None:
+        players_stats = fetch_json_from_url(game_players_stats_url(game_id))
+
     for p_stats in players_stats:
         p_stats_data = parse_player_stats_json(p_stats)
 
@@ -386,13 +690,13 @@ def get_game_player_stats(session: Session, game_id: int) -> None:
 
         player_data = parse_player_json(p_stats['steam_profile']['player'])
 
-        if player_data['country_id'] is not None and not id_exists(session, player_data['country_id'], Countries):
+        if claim_id(session, player_data['country_id'], Countries):
             get_country_data(session, player_data['country_id']) #add country if not in player table
 
-        if player_data['team_id'] is not None and not id_exists(session, player_data['team_id'], Teams):
+        if claim_id(session, player_data['team_id'], Teams):
             get_team_data(session, player_data['team_id']) #add team if not in player table
 
-        if p_stats_data['team_id'] is not None and not id_exists(session, p_stats_data['team_id'], Teams):
+        if claim_id(session, p_stats_data['team_id'], Teams):
             get_team_data(session, p_stats_data['team_id']) #add team if not in player table
 
         add_row_by_id(session, player_data, Players) #update player data
@@ -428,11 +732,18 @@ def parse_finished_events() -> None:
     This function iterates through finished events, retrieves event data, and adds it to the database.
     It also fetches and adds region, country, prize, match, and other related data to the database.
 
+    Progress is checkpointed in the crawl_state table per event, match and game, so an interrupted crawl resumes
+    at the first game that was not committed. An event that keeps failing is skipped after MAX_ATTEMPTS runs.
+
     :return: None
     """
     offset = 0
     count = 100
 
+    session = Session()
+    load_registry(session) #preload known team/player/country/region ids once per crawl
+    session.close()
+
     while offset < count:
         event_link_finished = events_link_new_data(status=STATUS_FINISHED, offset=offset) #grabs events marked finished (filtered by earliest start date of event that i have in my db that has matches_parsed=false)
 
@@ -442,46 +753,64 @@ def parse_finished_events() -> None:
         count = headers['count']
         offset += headers['limit']
 
-        i = 0
-        while i < len(event_data):
+        session = Session()
+        event_states = load_states(session, ENTITY_EVENT, [event['id'] for event in event_data])
+        session.close()
+
+        for event in event_data:
             session = Session()
+            attach_bulk_writer(session)
 
-            event = event_data[i]
+            state = event_states.get(event['id'])
+            event_fp = event_fingerprint(event)
 
             '''print(f"Fetching data for finished event {event['id']}")
-            print()''' 
+            print()'''
 
             try:
+                if is_exhausted(state, event_fp):
+                    continue #failed MAX_ATTEMPTS times, retried once the event changes
+
                 if id_exists(session, event.get('id'), Events) and session.query(Events).filter_by(id=event.get('id')).first().matches_parsed:
                     continue #match already fully parsed in db
 
-                if event['region_id'] is not None and not id_exists(session, event['region_id'], Regions): 
+                if claim_id(session, event['region_id'], Regions):
                     get_region_data(session, event['region_id']) #add region if its not in table
 
-                if event['country_id'] is not None and not id_exists(session, event['country_id'], Countries):
+                if claim_id(session, event['country_id'], Countries):
                     get_country_data(session, event['country_id']) #add country if not in table
 
+                get_archive().archive_event(event)
+
                 add_row_by_id(session, parse_event_json(event), Events) #add / update event
 
                 get_prize_data(session, event['tournament_prizes']) #add prize data from finished event
 
-                num_matches = get_match_data(session, event['matches']) #Get match data
+                checkpoint(session, ENTITY_EVENT, event['id'], STAGE_PARSED, fingerprint=event_fp)
+                commit_crawl(session) #event row first, matches are committed one at a time below
 
-                update_table_parameter(session, Events, event['id'], "number_matches", num_matches) #update values to show that this event is fully processed
-                update_table_parameter(session, Events, event['id'], "matches_parsed", True)
+                num_matches, not_persisted = get_match_data(session, event['matches'], event['id']) #Get match data
+
+                update_table_parameter(session, Events, event['id'], "number_matches", num_matches)
+
+                if not_persisted == 0: #update values to show that this event is fully processed
+                    update_table_parameter(session, Events, event['id'], "matches_parsed", True)
+                    checkpoint(session, ENTITY_EVENT, event['id'], STAGE_PERSISTED, fingerprint=event_fp)
 
-                session.commit()  # Commit changes if all operations were successful
+                commit_crawl(session)
+
+                if not_persisted > 0:
+                    raise RuntimeError(f"{not_persisted} matches were not stored")
             except Exception as e:
-                session.rollback()  # Rollback changes if any operation failed
-                log(f"Failed to process event {event['id']} due to: {e}", LEVEL_WARNING)
+                rollback_crawl(session)  # Rollback changes if any operation failed (requests were already retried with backoff so move on, event stays unparsed for next run)
+                attempts = record_failure(session, ENTITY_EVENT, event['id'], e, state, fingerprint=event_fp)
+                log(f"Failed to process event {event['id']} (attempt {attempts}/{MAX_ATTEMPTS}) due to: {e}", LEVEL_WARNING)
                 #traceback.print_exc()
                 #print()
-                i -= 1 
-                time.sleep(30)
             finally:
                 session.close()  # Close the session
-                i += 1
-            
+                get_archive().flush()
+
 
 def parse_ongoing_events() -> None:
     """
@@ -490,11 +819,18 @@ def parse_ongoing_events() -> None:
     This function iterates through ongoing events, retrieves event data, and adds it to the database.
     It also fetches and adds region, country, prize, match, and other related data to the database.
 
+    Events whose matches did not change since the last crawl are skipped without any further requests,
+    so this is cheap enough to run every few minutes.
+
     :return: None
     """
     offset = 0
     count = 100
 
+    session = Session()
+    load_registry(session) #preload known team/player/country/region ids once per crawl
+    session.close()
+
     while offset < count:
         event_link_finished = events_link_new_data(status=STATUS_ONGOING, offset=offset) #grabs events marked ongoing (filtered by earliest start date of event that i have in my db that has matches_parsed=false)
 
@@ -504,47 +840,72 @@ def parse_ongoing_events() -> None:
         count = headers['count']
         offset += headers['limit']
 
-        i = 0
-        while i < len(event_data):
+        session = Session()
+        event_states = load_states(session, ENTITY_EVENT, [event['id'] for event in event_data])
+        session.close()
+
+        for event in event_data:
             session = Session()
+            attach_bulk_writer(session)
 
-            event = event_data[i]
+            state = event_states.get(event['id'])
+            event_fp = event_fingerprint(event)
 
             '''print(f"Fetching data for ongoing event {event['id']}")
             print() '''
 
             try:
+                if is_done(state, event_fp) or is_exhausted(state, event_fp):
+                    continue #no match changed status since the last crawl
+
                 if id_exists(session, event.get('id'), Events) and session.query(Events).filter_by(id=event.get('id')).first().matches_parsed:
                     continue #match already fully parsed in db
 
-                if event['region_id'] is not None and not id_exists(session, event['region_id'], Regions): 
+                if claim_id(session, event['region_id'], Regions):
                     get_region_data(session, event['region_id']) #add region if its not in table
 
-                if event['country_id'] is not None and not id_exists(session, event['country_id'], Countries):
+                if claim_id(session, event['country_id'], Countries):
                     get_country_data(session, event['country_id']) #add country if not in table
 
+                get_archive().archive_event(event)
+
                 add_row_by_id(session, parse_event_json(event), Events) #add / update event
 
-                num_matches = get_match_data(session, event['matches']) #Get match data
+                checkpoint(session, ENTITY_EVENT, event['id'], STAGE_PARSED, fingerprint=event_fp)
+                commit_crawl(session) #event row first, matches are committed one at a time below
+
+                num_matches, not_persisted = get_match_data(session, event['matches'], event['id']) #Get match data
 
                 update_table_parameter(session, Events, event['id'], "number_matches", num_matches) #update values to show that this event is fully processed
 
-                session.commit()  # Commit changes if all operations were successful
+                if not_persisted == 0:
+                    checkpoint(session, ENTITY_EVENT, event['id'], STAGE_PERSISTED, fingerprint=event_fp)
+
+                commit_crawl(session)
+
+                if not_persisted > 0:
+                    raise RuntimeError(f"{not_persisted} matches were not stored")
             except Exception as e:
-                session.rollback()  # Rollback changes if any operation failed
-                log(f"Failed to process event {event['id']} due to: {e}", LEVEL_WARNING)
+                rollback_crawl(session)  # Rollback changes if any operation failed, the event is retried on the next run
+                attempts = record_failure(session, ENTITY_EVENT, event['id'], e, state, fingerprint=event_fp)
+                log(f"Failed to process event {event['id']} (attempt {attempts}/{MAX_ATTEMPTS}) due to: {e}", LEVEL_WARNING)
                 #traceback.print_exc()
                 #print()
-                i -= 1
             finally:
                 session.close()  # Close the session
-                i += 1
+                get_archive().flush()
 
 
 
 if __name__ == "__main__":
     #drop_all_tables() #remove
 
+    if "--offline" in sys.argv:
+        set_offline() #re-parse from the on disk response cache (eg after a schema change in models.py)
+
+    if "--no-archive" in sys.argv:
+        set_archive_enabled(False) #do not append raw payloads to archive/ (eg when re-parsing offline)
+
     init_db()
 
     #Update & get finished events
@@ -0,0 +1,63 @@
+from pathlib import Path
+current_directory = Path(__file__).parent.parent
+current_directory_str = str(current_directory).replace('\\', '/')
+import sys
+sys.path.append(current_directory_str)
+
+import numpy as np
+import pandas as pd
+from bo3_stats.glicko import CHECK_TOLERANCE, TEAM_OTHER, GlickoState, check_period_mode, game_arrays
+
+
+def synthetic_games():
+    """
+    A few games of two teams of two players (10 and 20), plus a player whose team is neither side of the game.
+    Includes undated games, a game without a score, NaN tdp and games with too few rounds for a tdp multiplier.
+    """
+    games = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5, 6],
+        'begin_at': pd.to_datetime(['2024-01-01 10:00', '2024-01-01 12:00', '2024-01-02 09:00', None, '2024-01-03 18:00', None]),
+        'winner_team_id': [10, 20, 10, 20, 10, 10],
+        'loser_team_id': [20, 10, 20, 10, 20, 20],
+        'winner_team_score': [13, 16, 13, 13, None, 13],
+        'loser_team_score': [7, 14, 11, 2, None, 9],
+    })
+
+    rows = []
+    for game_id in games['id']:
+        for player_id, team_id in [(1, 10), (2, 10), (3, 20), (4, 20)]:
+            rows.append({'game_id': game_id, 'player_id': player_id, 'num_rounds': 20, 'tdp': 50.0 + 10 * player_id + game_id, 'team_id': team_id})
+    rows.append({'game_id': 2, 'player_id': 5, 'num_rounds': 20, 'tdp': 60.0, 'team_id': 30}) #neither side
+    rows.append({'game_id': 6, 'player_id': 5, 'num_rounds': 24, 'tdp': 70.0, 'team_id': 10})
+
+    players = pd.DataFrame(rows)
+    players.loc[(players['game_id'] == 3) & (players['player_id'] == 2), 'tdp'] = np.nan
+    players.loc[(players['game_id'] == 5) & (players['player_id'] == 4), 'tdp'] = np.nan
+    players.loc[players['game_id'] == 4, 'num_rounds'] = 8
+    return games, players
+
+
+def test_synthetic_games_cover_edge_cases():
+    arrays = game_arrays(*synthetic_games())
+
+    assert not arrays['dated'].all()
+    assert not arrays['dated'][-2:].any() #undated games are rated last
+    assert (arrays['team'] == TEAM_OTHER).any()
+
+
+def test_one_game_periods_match_per_game_mode():
+    arrays = game_arrays(*synthetic_games())
+
+    assert check_period_mode(arrays, GlickoState(arrays['player_id'])) <= CHECK_TOLERANCE
+
+
+def test_one_game_periods_match_per_game_mode_from_stored_ratings():
+    arrays = game_arrays(*synthetic_games())
+    state = GlickoState(arrays['player_id']).load(pd.DataFrame({
+        'player_id': [1, 3, 5],
+        'rating': [1650.0, 1420.0, 1500.0],
+        'deviation': [80.0, 120.0, 300.0],
+        'vol': [0.06, 0.059, 0.061],
+    }))
+
+    assert check_period_mode(arrays, state) <= CHECK_TOLERANCE